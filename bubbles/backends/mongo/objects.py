@@ -82,7 +82,7 @@ class MongoDBCollection(DataObject):
     def __init__(self, collection, fields, truncate=False,
                  expand=False,
                  database=None, host='localhsot', port=27017,
-                 store=None):
+                 store=None, query=None):
         """Creates a MongoDB data object.
 
         Attributes
@@ -93,6 +93,8 @@ class MongoDBCollection(DataObject):
         * `expand`: expand dictionary values and treat children as top-level
           keys with dot '.' separated key path to the child.
         * `store`: MongoDBStore owning the object
+        * `query`: MongoDB query document selecting documents of the
+          collection, default is all documents
 
         Specify either store or database, not both.
         """
@@ -121,17 +123,25 @@ class MongoDBCollection(DataObject):
                                       "implemented, please specify them "
                                       "manually")
         self.fields = fields
+        self.query = query
 
         if truncate:
             self.truncate()
 
-    def clone(self, fields=None, expand=None):
+    def clone(self, fields=None, expand=None, query=None):
+        """Returns a copy of the collection object. If `query` is specified
+        it is combined with the receiver's query."""
         fields = fields or self.fields
         if expand is None:
             expand = self.expand
 
+        if query is None:
+            query = self.query
+        elif self.query:
+            query = {"$and": [self.query, query]}
+
         return MongoDBCollection(collection=self.collection, store=self.store,
-                             fields=fields, expand=expand)
+                             fields=fields, expand=expand, query=query)
 
     def representations(self):
         return ["mongo", "records", "rows"]
@@ -143,16 +153,16 @@ class MongoDBCollection(DataObject):
         self.collection.remove()
 
     def __len__(self):
-        return self.collection.count()
+        return self.collection.find(self.query).count()
 
     def rows(self):
         fields = self.fields.names()
-        iterator = self.collection.find(fields=fields)
+        iterator = self.collection.find(self.query, fields=fields)
         return MongoDBRowIterator(iterator, fields, self.expand)
 
     def records(self):
-        fields = self.field.names()
-        iterator = self.collection.find(fields=fields)
+        fields = self.fields.names()
+        iterator = self.collection.find(self.query, fields=fields)
         return MongoDBRecordIterator(iterator, self.expand)
 
     def append(self, obj):
@@ -5,12 +5,121 @@ from ...metadata import *
 from ...errors import *
 from ...prototypes import *
 from ...objects import *
+from ...operation import RetryOperation
+from ...expression import Compiler
+from collections import namedtuple
 
 def prepare_mongo_key(key):
     key = prepare_key(key)
     return {name:1 for name in key}
 
 
+class _MongoField(str):
+    """Reference to a document field in a compiled expression"""
+    pass
+
+# Compiled condition: query selecting documents where the condition is true
+# and query selecting documents where it is false. Comparison with a null or
+# missing field is unknown, such documents are selected by neither query.
+_MongoCondition = namedtuple("_MongoCondition", ["true", "false"])
+
+# Comparison operator -> (MongoDB operator, negated MongoDB operator,
+# operator with swapped operands)
+_mongo_comparisons = {
+    "=": ("$eq", "$ne", "="),
+    "!=": ("$ne", "$eq", "!="),
+    "≠": ("$ne", "$eq", "≠"),
+    "<": ("$lt", "$gte", ">"),
+    "<=": ("$lte", "$gt", ">="),
+    "≤": ("$lte", "$gt", "≥"),
+    ">": ("$gt", "$lte", "<"),
+    ">=": ("$gte", "$lt", "<="),
+    "≥": ("$gte", "$lt", "≤"),
+}
+
+def _mongo_comparison(field, mongo_op, value):
+    """Returns query comparing `field` with a non-null `value`"""
+    if mongo_op == "$eq":
+        return {field: value}
+    elif mongo_op == "$ne":
+        # $ne alone matches null and missing fields as well
+        return {field: {"$nin": [value, None]}}
+    else:
+        return {field: {mongo_op: value}}
+
+class MongoQueryCompiler(Compiler):
+    """Compiles expressions into MongoDB query documents. Only comparisons
+    of a field with a literal value combined with logical operators are
+    supported, other expressions raise `ExpressionError`. `context` is a
+    list of known field names.
+
+    The result is a named tuple with query `true` selecting documents where
+    the expression is true and query `false` selecting documents where the
+    expression is false. Documents where the expression is unknown because
+    of null or missing fields are not selected by either query."""
+
+    def compile_literal(self, context, literal):
+        return literal
+
+    def compile_variable(self, context, variable):
+        if variable not in context:
+            raise ExpressionError("Unknown variable %s" % variable)
+        return _MongoField(variable)
+
+    def compile_operator(self, context, operator, op1, op2):
+        if operator in ("and", "or"):
+            if not isinstance(op1, _MongoCondition) \
+                    or not isinstance(op2, _MongoCondition):
+                raise ExpressionError("Operands of '%s' should be "
+                                      "conditions" % operator)
+            true = [op1.true, op2.true]
+            false = [op1.false, op2.false]
+            if operator == "and":
+                return _MongoCondition({"$and": true}, {"$or": false})
+            else:
+                return _MongoCondition({"$or": true}, {"$and": false})
+
+        try:
+            mongo_op, negated_op, swapped = _mongo_comparisons[operator]
+        except KeyError:
+            raise ExpressionError("Operator '%s' is not supported in "
+                                  "MongoDB queries" % operator)
+
+        operands = (_MongoField, _MongoCondition)
+        if isinstance(op1, _MongoField) and not isinstance(op2, operands):
+            field, value = op1, op2
+        elif isinstance(op2, _MongoField) and not isinstance(op1, operands):
+            field, value = op2, op1
+            mongo_op, negated_op, _ = _mongo_comparisons[swapped]
+        else:
+            raise ExpressionError("Only comparison of a field with a value "
+                                  "is supported in MongoDB queries")
+
+        if value is None:
+            raise ExpressionError("Comparison with null is not supported in "
+                                  "MongoDB queries")
+
+        field = str(field)
+        return _MongoCondition(_mongo_comparison(field, mongo_op, value),
+                               _mongo_comparison(field, negated_op, value))
+
+    def compile_unary(self, context, operator, operand):
+        if operator in ("not", "~", "¬") \
+                and isinstance(operand, _MongoCondition):
+            return _MongoCondition(operand.false, operand.true)
+        elif operator == "-" and not isinstance(operand, (_MongoField,
+                                                          _MongoCondition)):
+            return -operand
+        else:
+            raise ExpressionError("Unary operator '%s' is not supported in "
+                                  "MongoDB queries" % operator)
+
+    def finalize(self, context, expression):
+        if not isinstance(expression, _MongoCondition):
+            raise ExpressionError("Expression is not a condition")
+        return expression
+
+
 #############################################################################
 # Metadata Operations
 
@@ -39,9 +148,29 @@ def _(ctx, obj, keep=None, drop=None, rename=None, filter=None):
 #############################################################################
 # Row Operations
 
+@filter_expression.register("mongo")
+def _(ctx, obj, expression, discard=False):
+    """Filters documents by `expression` compiled into a MongoDB query.
+    Expressions that can not be expressed as a query are evaluated on
+    rows."""
+
+    try:
+        condition = MongoQueryCompiler().compile(expression,
+                                                 obj.fields.names())
+    except ExpressionError as e:
+        raise RetryOperation(["rows"], reason=str(e))
+
+    # Documents with unknown result are dropped in both cases
+    if discard:
+        query = condition.false
+    else:
+        query = condition.true
+
+    return obj.clone(query=query)
+
 
 @distinct.register("mongo")
-def _(ctx, obj, key=None):
+def _(ctx, obj, key=None, is_sorted=False, buffer_size=None):
 
     if not key:
         key = obj.fields.names()
@@ -49,6 +178,7 @@ def _(ctx, obj, key=None):
     key = prepare_mongo_key(key)
 
     new_fields = obj.fields.fields(key)
-    cursor = obj.collection.group(key, {}, {}, "function(obj, prev){}")
+    cursor = obj.collection.group(key, obj.query or {}, {},
+                                  "function(obj, prev){}")
     return IterableRecordsDataSource(cursor, new_fields)
 
@@ -0,0 +1 @@
+from .objects import *
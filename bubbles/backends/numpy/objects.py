@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from ...objects import *
+from ...errors import *
+from ...metadata import Field, FieldList
+from datetime import date
+from itertools import islice
+
+__all__ = (
+        "BatchesDataSource",
+        "rows_to_batches",
+        "batches_to_rows",
+        "column_array",
+    )
+
+try:
+    import numpy as np
+except ImportError:
+    from ...common import MissingPackage
+    np = MissingPackage("numpy", "Columnar batches", "http://www.numpy.org/")
+
+# Batches
+# =======
+#
+# A batch is a list of columns – one-dimensional NumPy arrays of the same
+# length – in the order of object's fields. Typed columns (integer, number,
+# boolean, date, datetime) are stored as native NumPy arrays, other columns
+# and typed columns with missing values are stored as arrays of Python
+# objects.
+
+DEFAULT_BATCH_SIZE = 65536
+
+# Field storage type -> (NumPy dtype, accepted kinds of inferred array)
+_storage_dtypes = {
+    "integer": ("int64", "i"),
+    "number": ("float64", "if"),
+    "boolean": ("bool", "b"),
+    "date": ("datetime64[D]", None),
+    "datetime": ("datetime64[us]", None),
+}
+
+def _object_array(values):
+    """Returns one-dimensional array of Python objects. Values that are
+    sequences are not expanded into another dimension."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+def column_array(values, field):
+    """Returns an array for column `values` of `field`. Native array is
+    returned if the values match the field's storage type, otherwise an
+    array of objects is returned."""
+
+    try:
+        dtype, kinds = _storage_dtypes[field.storage_type]
+    except KeyError:
+        return _object_array(values)
+
+    if kinds:
+        # Missing values can not be represented in native arrays
+        if any(value is None for value in values):
+            return _object_array(values)
+
+        inferred = np.asarray(values)
+        if inferred.dtype.kind in kinds:
+            return inferred.astype(dtype, copy=False)
+    else:
+        # Missing dates are represented as NaT
+        if all(value is None or isinstance(value, date) for value in values):
+            return np.array(values, dtype=dtype)
+
+    return _object_array(values)
+
+def rows_to_batches(rows, fields, batch_size=None):
+    """Returns a generator of batches of at most `batch_size` rows from the
+    `rows` iterable."""
+
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    rows = iter(rows)
+
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+
+        columns = zip(*chunk)
+        yield [column_array(list(column), field)
+               for column, field in zip(columns, fields)]
+
+def batches_to_rows(batches):
+    """Returns a generator of rows from `batches`. Values are converted to
+    Python types."""
+
+    for batch in batches:
+        yield from zip(*[column.tolist() for column in batch])
+
+
+class BatchesDataSource(DataObject):
+    """Data source that yields batches of column arrays. Rows and records
+    are converted from the batches on demand."""
+
+    __identifier__ = "batches"
+
+    _bubbles_info = {
+        "attributes": [
+            {"name":"batches", "description": "iterable of batches"},
+            {"name":"fields", "description":"fields of the batches"}
+        ]
+    }
+
+    def __init__(self, batches, fields):
+        """Creates a data object that wraps an iterable of `batches` – lists
+        of NumPy arrays, one for each field in `fields`."""
+        self.fields = fields
+        self.iterable = batches
+
+    def representations(self):
+        return ["batches", "rows", "records"]
+
+    def batches(self):
+        return iter(self.iterable)
+
+    def rows(self):
+        return batches_to_rows(self.batches())
+
+    def records(self):
+        names = [str(field) for field in self.fields]
+        for row in self.rows():
+            yield dict(zip(names, row))
+
+    def is_consumable(self):
+        return True
+
+    def retained(self, retain_count=1):
+        """Returns object that shares the batches between `retain_count`
+        consumers. Only few batches are kept in memory, the rest is spilled
+        to a temporary file."""
+        tee = TeeDataSource(self.batches(), self.fields, retain_count,
+                            buffer_size=4)
+        return _RetainedBatchesDataSource(tee)
+
+
+class _RetainedBatchesDataSource(BatchesDataSource):
+    def __init__(self, tee):
+        self.fields = tee.fields
+        self.tee = tee
+
+    def batches(self):
+        # Each call claims another consumer of the tee
+        return self.tee.rows()
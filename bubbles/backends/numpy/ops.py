@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+from .objects import BatchesDataSource, rows_to_batches, column_array
+from .objects import np
+
+from ...metadata import *
+from ...errors import *
+from ...operation import RetryOperation
+from ...prototypes import *
+from ...datautil import to_bool
+
+from datetime import datetime
+from time import strptime
+from base64 import b64decode
+import json
+
+# Vectorized implementations of row operations for the "batches"
+# representation. Operations that are not implemented here are evaluated on
+# rows converted from the batches.
+
+#############################################################################
+# Conversion
+
+@as_batches.register("rows")
+def _(ctx, obj, batch_size=None):
+    batches = rows_to_batches(obj.rows(), obj.fields, batch_size)
+    return BatchesDataSource(batches, obj.fields.clone())
+
+@as_batches.register("batches")
+def _(ctx, obj, batch_size=None):
+    return obj
+
+#############################################################################
+# Metadata Operations
+
+_numeric_dtypes = {
+    "integer": "int64",
+    "number": "float64",
+}
+
+_python_converters = {
+    "integer": int,
+    "number": float,
+    "boolean": to_bool,
+    "date": lambda val: datetime.strptime(val, '%Y-%m-%d').date(),
+    "time": lambda val: strptime(val, '%H:%M'),
+    "datetime": lambda val: datetime.strptime(val, '%Y-%m-%dT%H:%M:%S%Z'),
+    "binary": b64decode,
+    "object": json.loads,
+    "geojson": json.loads,
+}
+
+@retype.register("batches")
+def _(ctx, obj, typemap):
+    def iterator():
+        for batch in obj.batches():
+            batch = list(batch)
+            for index, field in conversions:
+                column = batch[index]
+                dtype = _numeric_dtypes.get(field.storage_type)
+                if dtype and column.dtype != object:
+                    batch[index] = column.astype(dtype)
+                else:
+                    conv = _python_converters[field.storage_type]
+                    values = [conv(value) for value in column.tolist()]
+                    batch[index] = column_array(values, field)
+            yield batch
+
+    fields = FieldList()
+    conversions = []
+    for i, field in enumerate(obj.fields):
+        new_type = typemap.get(field.name)
+        if new_type and new_type != field.storage_type:
+            if new_type not in _python_converters:
+                raise RetryOperation(["rows"], reason="Conversion to '%s' is "
+                                     "not supported for batches" % new_type)
+            field = field.clone(storage_type=new_type)
+            conversions.append((i, field))
+        else:
+            field = field.clone()
+        fields.append(field)
+
+    return BatchesDataSource(iterator(), fields)
+
+#############################################################################
+# Row Operations
+
+def _filtered(obj, predicate):
+    """Returns batches of `obj` with rows where `predicate(batch)` evaluates
+    to ``True``. Empty batches are skipped."""
+
+    def iterator():
+        for batch in obj.batches():
+            mask = np.asarray(predicate(batch), dtype=bool)
+            if mask.all():
+                yield batch
+            elif mask.any():
+                yield [column[mask] for column in batch]
+
+    return BatchesDataSource(iterator(), obj.fields.clone())
+
+@filter_by_value.register("batches")
+def _(ctx, obj, key, value, discard=False):
+    index = obj.fields.index(str(key))
+
+    if discard:
+        predicate = lambda batch: batch[index] != value
+    else:
+        predicate = lambda batch: batch[index] == value
+
+    return _filtered(obj, predicate)
+
+@filter_by_set.register("batches")
+def _(ctx, obj, field, values, discard=False):
+    index = obj.fields.index(field)
+    values = set(values)
+
+    def predicate(batch):
+        column = batch[index]
+        if column.dtype == object:
+            mask = np.fromiter((value in values for value in column),
+                               dtype=bool, count=len(column))
+        else:
+            mask = np.isin(column, list(values))
+
+        return ~mask if discard else mask
+
+    return _filtered(obj, predicate)
+
+@filter_by_range.register("batches")
+def _(ctx, obj, field, low, high, discard=False):
+    index = obj.fields.index(field)
+
+    def predicate(batch):
+        column = batch[index]
+        if high is None and low is not None:
+            mask = low <= column
+        elif low is None and high is not None:
+            mask = column <= high
+        else:
+            mask = (low <= column) & (column <= high)
+
+        mask = np.asarray(mask, dtype=bool)
+        return ~mask if discard else mask
+
+    return _filtered(obj, predicate)
+
+#############################################################################
+# Aggregation
+
+def _none_min(a, b):
+    if a is None or (b is not None and b < a):
+        return b
+    return a
+
+def _none_max(a, b):
+    if a is None or (b is not None and b > a):
+        return b
+    return a
+
+def _add_pairs(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
+# Aggregation -> (ufunc for native columns, function merging partial results)
+# Missing values are skipped, as in the "rows" version. Partial result of
+# average is a tuple (count, sum).
+_aggregations = {
+    "sum": ("add", lambda a, b: a + b),
+    "min": ("minimum", _none_min),
+    "max": ("maximum", _none_max),
+    "average": ("add", _add_pairs),
+    "avg": ("add", _add_pairs),
+}
+
+def _reduce_groups(column, function, order, starts, counts):
+    """Returns list of partial results of `function` for groups of rows in
+    the `column`."""
+
+    ufunc = getattr(np, _aggregations[function][0])
+    merge = _aggregations[function][1]
+    is_average = function in ("average", "avg")
+
+    if column.dtype != object:
+        values = ufunc.reduceat(column[order], starts).tolist()
+        if is_average:
+            values = list(zip(counts, values))
+        return values
+
+    # Arrays of objects might contain missing values
+    values = column[order].tolist()
+    ends = list(starts[1:].tolist()) + [len(values)]
+    result = []
+    for start, end in zip(starts.tolist(), ends):
+        group = [value for value in values[start:end] if value is not None]
+        if is_average:
+            result.append((len(group), sum(group)))
+        elif function == "sum":
+            result.append(sum(group))
+        else:
+            partial = None
+            for value in group:
+                partial = merge(partial, value)
+            result.append(partial)
+
+    return result
+
+def _factorize(column):
+    """Returns tuple (`uniques`, `codes`) where `codes` are indexes into
+    `uniques` for each value in the `column`."""
+    if column.dtype != object:
+        return np.unique(column, return_inverse=True)
+
+    codes = np.empty(len(column), dtype="int64")
+    index = {}
+    uniques = []
+    for i, value in enumerate(column.tolist()):
+        try:
+            codes[i] = index[value]
+        except KeyError:
+            codes[i] = index[value] = len(uniques)
+            uniques.append(value)
+
+    return (uniques, codes)
+
+def _group_batch(batch, key_indexes):
+    """Returns tuple (`keys`, `order`, `starts`) where `keys` is a list of
+    key tuples of the groups in the batch, `order` is a permutation of rows
+    that puts rows of the same group together and `starts` are positions of
+    the first rows of the groups in the permuted batch."""
+
+    length = len(batch[0])
+
+    if not key_indexes:
+        return ([()], np.arange(length), np.array([0]))
+
+    factors = [_factorize(batch[i]) for i in key_indexes]
+
+    if len(factors) == 1:
+        codes = factors[0][1]
+    else:
+        stacked = np.stack([codes for uniques, codes in factors], axis=1)
+        _, codes = np.unique(stacked, axis=0, return_inverse=True)
+
+    codes = codes.reshape(-1)
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_codes)) + 1))
+
+    keys = []
+    for start in starts:
+        row = order[start]
+        keys.append(tuple(_value(uniques[codes_[row]])
+                          for uniques, codes_ in factors))
+
+    return (keys, order, starts)
+
+def _value(value):
+    """Converts NumPy scalar to Python value"""
+    return value.item() if isinstance(value, np.generic) else value
+
+@aggregate.register("batches")
+def _(ctx, obj, key, measures=None, include_count=True,
+      count_field="record_count", is_sorted=False):
+    """Aggregates measures of batches by `key`. Batches are grouped and
+    reduced with NumPy functions, partial results of the batches are merged
+    by key. `is_sorted` is ignored. Functions not supported for batches are
+    evaluated on rows. See the "rows" version of `aggregate` for more
+    information."""
+
+    keys = prepare_key(key)
+    measures = prepare_aggregation_list(measures)
+
+    out_fields = FieldList()
+    out_fields += obj.fields.fields(keys)
+
+    measure_aggregates = []
+    for name, function in measures:
+        if function not in _aggregations:
+            raise RetryOperation(["rows"], reason="Aggregation '%s' is not "
+                                 "supported for batches" % function)
+
+        index = obj.fields.index(name)
+        measure_aggregates.append((index, function))
+
+        field = obj.fields.field(name)
+        field = field.clone(name="%s_%s" % (name, function),
+                            analytical_type="measure")
+        out_fields.append(field)
+
+    if include_count:
+        out_fields.append(Field(count_field,
+                            storage_type="integer",
+                            analytical_type="measure"))
+
+    key_indexes = obj.fields.indexes(keys) if keys else []
+
+    # key -> [count, aggregate, ...]
+    aggregates = {}
+
+    for batch in obj.batches():
+        if not len(batch[0]):
+            continue
+
+        group_keys, order, starts = _group_batch(batch, key_indexes)
+        counts = np.diff(np.append(starts, len(order))).tolist()
+
+        results = [_reduce_groups(batch[index], function, order, starts,
+                                  counts)
+                   for index, function in measure_aggregates]
+
+        for i, group_key in enumerate(group_keys):
+            partial = [counts[i]] + [result[i] for result in results]
+            try:
+                current = aggregates[group_key]
+            except KeyError:
+                aggregates[group_key] = partial
+                continue
+
+            current[0] += partial[0]
+            for j, (index, function) in enumerate(measure_aggregates, 1):
+                merge = _aggregations[function][1]
+                current[j] = merge(current[j], partial[j])
+
+    def result_rows():
+        for group_key, aggregate in aggregates.items():
+            row = list(group_key)
+            count = aggregate[0]
+            for j, (index, function) in enumerate(measure_aggregates, 1):
+                if function in ("average", "avg"):
+                    n, total = aggregate[j]
+                    row.append(total / n if n else None)
+                else:
+                    row.append(aggregate[j])
+
+            if include_count:
+                row.append(count)
+
+            yield row
+
+    batches = rows_to_batches(result_rows(), out_fields)
+    return BatchesDataSource(batches, out_fields)
+
+#############################################################################
+# Date Operations
+
+@split_date.register("batches")
+def _(ctx, obj, fields, parts=["year", "month", "day"]):
+    """Extract `parts` from date columns."""
+
+    def extract(column, part):
+        if column.dtype.kind == "M" and part in ("year", "month", "day"):
+            years = column.astype("datetime64[Y]")
+            months = column.astype("datetime64[M]")
+            if part == "year":
+                result = years.astype("int64") + 1970
+            elif part == "month":
+                result = (months - years).astype("int64") + 1
+            else:
+                days = column.astype("datetime64[D]")
+                result = (days - months).astype("int64") + 1
+
+            # Missing dates are NaT which has no meaningful integer value
+            missing = np.isnat(column)
+            if missing.any():
+                result = result.astype(object)
+                result[missing] = None
+            return result
+        else:
+            values = [getattr(value, part) if value is not None else None
+                      for value in column.tolist()]
+            return column_array(values, proto)
+
+    def iterator():
+        for batch in obj.batches():
+            new_batch = []
+            for i, column in enumerate(batch):
+                if i in indexes:
+                    new_batch += [extract(column, part) for part in parts]
+                else:
+                    new_batch.append(column)
+            yield new_batch
+
+    date_fields = prepare_key(fields)
+    indexes = obj.fields.indexes(date_fields)
+
+    fields = FieldList()
+    proto = Field(name="p", storage_type="integer", analytical_type="ordinal")
+
+    for field in obj.fields:
+        if str(field) in date_fields:
+            for part in parts:
+                name = "%s_%s" % (str(field), part)
+                fields.append(proto.clone(name=name))
+        else:
+            fields.append(field.clone())
+
+    return BatchesDataSource(iterator(), fields)
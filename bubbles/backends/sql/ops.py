@@ -3,9 +3,11 @@ from ...operation import RetryOperation
 from ...prototypes import *
 from ...metadata import Field, FieldList, FieldFilter
 from ...metadata import prepare_aggregation_list, prepare_order_list
+from ...metadata import prepare_window_list
 from ...objects import IterableDataSource
 from ...errors import *
 from .utils import prepare_key, zip_condition, join_on_clause
+from .utils import SQLExpressionCompiler
 
 try:
     import sqlalchemy
@@ -74,6 +76,9 @@ def _(ctx, src, key, value, discard=False):
     if len(filter_cols) == 1:
         value = (value, )
     condition = zip_condition(filter_cols, value)
+    if discard:
+        condition = sql.expression.not_(condition)
+
     statement = sql.expression.select(cols, from_obj=statement,
                                         whereclause=condition)
 
@@ -86,12 +91,12 @@ def _(ctx, src, field, low, high, discard=False):
     """Filter by range: field should be between low and high."""
 
     statement = src.sql_statement()
-    key_column = statement.c[str(key)]
+    key_column = statement.c[str(field)]
 
     if low is not None and high is None:
         cond = key_column >= low
     elif high is not None and low is None:
-        cond = key_column < high
+        cond = key_column <= high
     else:
         cond = sql.expression.between(key_column, low, high)
 
@@ -109,7 +114,41 @@ def _(ctx, src, field, low, high, discard=False):
 
 @filter_by_set.register("sql")
 def _(ctx, obj, key, value_set, discard=False):
-    raise RetryOperation(["rows"], reason="Not implemented")
+    """Select rows where value of `key` belongs to the `value_set`"""
+    statement = obj.sql_statement()
+
+    column = statement.c[str(key)]
+    if discard:
+        condition = sql.expression.not_(column.in_(list(value_set)))
+    else:
+        condition = column.in_(list(value_set))
+
+    statement = sql.expression.select(obj.columns(), from_obj=statement,
+                                      whereclause=condition)
+
+    statement = statement.alias("__set_filter")
+    return obj.clone_statement(statement=statement)
+
+
+@filter_expression.register("sql")
+def _(ctx, obj, expression, discard=False):
+    """Select rows where `expression` is true. The expression is compiled
+    into the ``WHERE`` clause of the statement."""
+    statement = obj.sql_statement()
+
+    try:
+        condition = SQLExpressionCompiler().compile(expression, statement)
+    except ExpressionError as e:
+        raise RetryOperation(["rows"], reason=str(e))
+
+    if discard:
+        condition = sql.expression.not_(condition)
+
+    statement = sql.expression.select(obj.columns(), from_obj=statement,
+                                      whereclause=condition)
+
+    statement = statement.alias("__expression_filter")
+    return obj.clone_statement(statement=statement)
 
 
 @filter_not_empty.register("sql")
@@ -125,14 +164,24 @@ def _(ctx, obj, field):
 
     return obj.clone_statement(statement=statement)
 
-@filter_by_predicate.register("sql")
-def _(ctx, obj, fields, predicate, discard=False):
-    raise RetryOperation(["rows"], reason="Not implemented")
+@filter_empty.register("sql")
+def _(ctx, obj, field):
+    statement = obj.sql_statement()
+
+    column = statement.c[str(field)]
+    condition = sql.expression.or_(column == None, column == "")
+    selection = obj.columns()
+
+    statement = sql.expression.select(selection, from_obj=statement,
+                                            whereclause=condition)
+
+    return obj.clone_statement(statement=statement)
 
 
 @distinct.register("sql")
-def _(ctx, obj, keys=None):
-    """Returns a statement that selects distinct values for `keys`"""
+def _(ctx, obj, keys=None, is_sorted=False, buffer_size=None):
+    """Returns a statement that selects distinct values for `keys`.
+    `is_sorted` and `buffer_size` are ignored."""
 
     statement = obj.sql_statement()
     if keys:
@@ -149,34 +198,75 @@ def _(ctx, obj, keys=None):
 
 
 @first_unique.register("sql")
-def _(ctx, statement, keys=None):
+def _(ctx, statement, keys=None, discard=False, is_sorted=False,
+      buffer_size=None):
     """Returns a statement that selects whole rows with distinct values
     for `keys`"""
     # TODO: use prepare_key
-    raise NotImplementedError
+    raise RetryOperation(["rows"], reason="Not implemented")
+
+# Dialect -> function returning random number from [0, 1)
+_random_functions = {
+    "postgresql": lambda: sqlalchemy.func.random(),
+    "mysql": lambda: sqlalchemy.func.rand(),
+    # SQLite random() returns a signed 64-bit integer
+    "sqlite": lambda: (sqlalchemy.func.abs(sqlalchemy.func.random())
+                       % 1000000000) / 1000000000.0,
+}
 
 @sample.register("sql")
-@_unary
-def _(ctx, statement, value, mode="first"):
-    """Returns a sample. `statement` is expected to be ordered."""
+def _(ctx, obj, value, discard=False, mode="first", key=None, seed=None):
+    """Returns a sample. `statement` is expected to be ordered for the
+    ``first`` mode. ``random`` and ``bernoulli`` modes are evaluated by the
+    database if the dialect has a random function: ``random`` as ``ORDER BY
+    random() LIMIT value``, ``bernoulli`` as ``TABLESAMPLE BERNOULLI`` of
+    a PostgreSQL table or as a ``random() < value`` condition. Other modes,
+    seeded samples and discarding random samples are retried on rows."""
+
+    statement = obj.sql_statement()
 
     if mode == "first":
-        return statement.select(limit=value)
+        if discard:
+            statement = statement.select(offset=value)
+        else:
+            statement = statement.select(limit=value)
+        return obj.clone_statement(statement=statement)
+
+    dialect = obj.store.connectable.dialect.name
+    random_function = _random_functions.get(dialect)
+
+    if mode not in ("random", "bernoulli") or seed is not None \
+            or random_function is None \
+            or (mode == "random" and discard):
+        raise RetryOperation(["rows"], reason="Unhandled sample mode '%s'"
+                                              % mode)
+
+    if mode == "random":
+        statement = sql.expression.select(statement.columns,
+                                          from_obj=statement)
+        statement = statement.order_by(random_function()).limit(value)
     else:
-        raise RetryOperation(["rows"], reason="Unhandled mode '%s'" % mode)
-
+        probability = 1 - value if discard else value
+
+        if dialect == "postgresql" \
+                and isinstance(statement, sqlalchemy.schema.Table):
+            sampled = sql.expression.tablesample(
+                            statement,
+                            sqlalchemy.func.bernoulli(probability * 100))
+            statement = sampled.select()
+        else:
+            cond = random_function() < probability
+            statement = sql.expression.select(statement.columns,
+                                              from_obj=statement,
+                                              whereclause=cond)
 
-@sort.register("sql")
-@_unary
-def _(ctx, statement, orderby):
-    """Returns a ordered SQL statement. `orders` should be a list of
-    two-element tuples `(field, order)`"""
+    statement = statement.alias("__sample")
+    return obj.clone_statement(statement=statement)
 
-    # Each attribute mentioned in the order should be present in the selection
-    # or as some column from joined table. Here we get the list of already
-    # selected columns and derived aggregates
 
-    orderby = prepare_order_list(orderby)
+def _order_columns(statement, orderby):
+    """Returns list of ordered columns of `statement` according to `orderby`
+    list of `(field, order)` tuples."""
 
     columns = []
     for field, order in orderby:
@@ -187,28 +277,158 @@ def _(ctx, statement, orderby):
         elif order.startswith("desc"):
             column = column.desc()
         else:
-            raise ValueError("Unknown order %s for column %s") % (order, column)
+            raise ArgumentError("Unknown order %s for column %s"
+                                % (order, column))
 
         columns.append(column)
 
+    return columns
+
+@sort.register("sql")
+@_unary
+def _(ctx, statement, orderby, buffer_size=None):
+    """Returns a ordered SQL statement. `orders` should be a list of
+    two-element tuples `(field, order)`. `buffer_size` is ignored, the
+    sorting is done by the database."""
+
+    # Each attribute mentioned in the order should be present in the selection
+    # or as some column from joined table. Here we get the list of already
+    # selected columns and derived aggregates
+
+    orderby = prepare_order_list(orderby)
+    columns = _order_columns(statement, orderby)
+
     statement = sql.expression.select(statement.columns,
                                    from_obj=statement,
                                    order_by=columns)
     return statement
 
+@top_n.register("sql")
+@_unary
+def _(ctx, statement, key, orderby, n):
+    """Returns a statement that selects `n` first rows according to `orderby`
+    for each `key` using ``ROW_NUMBER() OVER (PARTITION BY key ORDER BY
+    orderby)`` window function. Result is ordered by the key and the
+    rank."""
+
+    keys = prepare_key(key) if key else ()
+    orderby = prepare_order_list(orderby)
+
+    partition = [statement.c[str(key)] for key in keys]
+    row_number = sqlalchemy.func.row_number().over(
+                        partition_by=partition or None,
+                        order_by=_order_columns(statement, orderby))
+
+    columns = list(statement.columns)
+    ranked = sql.expression.select(columns + [row_number.label("__rank")],
+                                   from_obj=statement)
+    ranked = ranked.alias("__ranked")
+
+    rank = ranked.c["__rank"]
+    columns = [ranked.c[column.name] for column in columns]
+
+    statement = sql.expression.select(columns,
+                                      from_obj=ranked,
+                                      whereclause=rank <= n,
+                                      order_by=[ranked.c[str(key)]
+                                                for key in keys] + [rank])
+    return statement
+
 aggregation_functions = {
     "sum": sql.functions.sum,
     "min": sql.functions.min,
     "max": sql.functions.max,
-    "count": sql.functions.count
+    "count": sql.functions.count,
+    "average": sql.func.avg,
+    "avg": sql.func.avg,
+}
+
+# Window functions that are not aggregations: name -> SQL function
+_window_functions = {
+    "rank": sql.func.rank,
+    "dense_rank": sql.func.dense_rank,
+    "row_number": sql.func.row_number,
+    "lag": sql.func.lag,
+    "lead": sql.func.lead,
 }
 
+@window_aggregate.register("sql")
+def _(ctx, obj, key, orderby, functions, is_sorted=False):
+    """Returns a statement with window `functions` over partitions by `key`
+    ordered by `orderby` – ``func() OVER (PARTITION BY key ORDER BY
+    orderby)``. Running and moving aggregations use ``ROWS`` frames.
+    `is_sorted` is ignored. Functions without SQL equivalent are retried on
+    rows. See the "rows" version of `window_aggregate` for list of
+    functions."""
+
+    keys = prepare_key(key) if key else ()
+    orderby = prepare_order_list(orderby)
+    functions = prepare_window_list(functions)
+
+    statement = obj.sql_statement()
+
+    partition = [statement.c[str(key)] for key in keys] or None
+    order = _order_columns(statement, orderby) or None
+
+    window_fields = obj.fields.window_fields(functions)
+    out_fields = FieldList()
+    out_fields += obj.fields.clone()
+    out_fields += window_fields
+
+    selection = list(statement.columns)
+
+    for (field, function, argument), out_field in \
+            zip(functions, window_fields):
+
+        column = statement.c[field] if field is not None else None
+
+        if function in ("lag", "lead"):
+            offset = 1 if argument is None else argument
+            if offset < 0:
+                raise ArgumentError("Offset of '%s' should not be negative"
+                                    % function)
+            expression = _window_functions[function](column, offset)
+            window = {"order_by": order}
+        elif function in _window_functions:
+            expression = _window_functions[function]()
+            window = {"order_by": order}
+        else:
+            if function.startswith("running_"):
+                agg = function[len("running_"):]
+                window = {"order_by": order, "rows": (None, 0)}
+            elif function.startswith("moving_") and argument:
+                agg = function[len("moving_"):]
+                window = {"order_by": order, "rows": (-(argument - 1), 0)}
+            else:
+                agg = function
+                window = {}
+
+            if agg not in aggregation_functions:
+                raise RetryOperation(["rows"], reason="Window function '%s' "
+                                     "is not supported in SQL" % function)
+
+            expression = aggregation_functions[agg](column)
+
+        expression = expression.over(partition_by=partition, **window)
+        selection.append(expression.label(out_field.name))
+
+    statement = sql.expression.select(selection, from_obj=statement)
+    statement = statement.alias("__window")
+
+    order_by = [statement.c[str(key)] for key in keys]
+    order_by += _order_columns(statement, orderby)
+    statement = sql.expression.select(statement.columns, from_obj=statement,
+                                      order_by=order_by)
+
+    return obj.clone_statement(statement=statement, fields=out_fields)
+
+
 
 @aggregate.register("sql")
 def _(ctx, obj, key, measures=None, include_count=True,
-              count_field="record_count"):
+              count_field="record_count", is_sorted=False):
 
-    """Aggregate `measures` by `key`"""
+    """Aggregate `measures` by `key`. `is_sorted` is ignored."""
 
     keys = prepare_key(key)
 
@@ -217,6 +437,11 @@ def _(ctx, obj, key, measures=None, include_count=True,
     else:
         measures = []
 
+    for measure, agg_name in measures:
+        if agg_name not in aggregation_functions:
+            raise RetryOperation(["rows"], reason="Aggregation '%s' is not "
+                                 "supported in SQL" % agg_name)
+
     out_fields = FieldList()
     out_fields += obj.fields.fields(keys)
     out_fields += obj.fields.aggregated_fields(
@@ -385,12 +610,13 @@ def _(ctx, objects):
 
 
 @join_details.register("sql", "sql")
-def _(ctx, master, detail, master_key, detail_key):
+def _(ctx, master, detail, master_key, detail_key, inner=True,
+      buffer_size=None):
     """Creates a master-detail join using simple or composite keys. The
     columns used as a key in the `detail` object are not included in the
-    result.
+    result. If `inner` is ``False`` then left outer join is created.
+    `buffer_size` is ignored.
     """
-    # TODO: add left inner, left outer
 
     if not master.can_compose(detail):
         raise RetryOperation(["rows", "rows"], reason="Can not compose")
@@ -417,7 +643,8 @@ def _(ctx, master, detail, master_key, detail_key):
 
     joined = sql.expression.join(master_stat,
                                  detail_stat,
-                                 onclause=onclause)
+                                 onclause=onclause,
+                                 isouter=not inner)
 
     # Alias the output fields to match the field names
     aliased = []
@@ -430,9 +657,20 @@ def _(ctx, master, detail, master_key, detail_key):
 
     return master.clone_statement(statement=select, fields=out_fields)
 
+@merge_join.register("sql", "sql")
+def _(ctx, master, detail, master_key, detail_key, inner=True):
+    """Creates a master-detail join statement, the join strategy is left to
+    the database."""
+
+    if not master.can_compose(detail):
+        raise RetryOperation(["rows", "rows"], reason="Can not compose")
+
+    return ctx.op.join_details(master, detail, master_key, detail_key,
+                               inner=inner)
+
 # TODO: deprecated
 @join_details.register("sql", "sql[]", name="join_details")
-def _(ctx, master, details, joins):
+def _(ctx, master, details, joins, inner=True, buffer_size=None):
     """Creates left inner master-detail join (star schema) where `master` is an
     iterator if the "bigger" table `details` are details. `joins` is a list of
     tuples `(master, detail)` where the master is index of master key and
@@ -484,7 +722,8 @@ def _(ctx, master, details, joins):
 
         joined = sql.expression.join(joined,
                                      det_stmt,
-                                     onclause=onclause)
+                                     onclause=onclause,
+                                     isouter=not inner)
 
     aliased = []
     for col, field in zip(selection, out_fields):
@@ -742,6 +981,12 @@ def _(ctx, obj, fields=None):
     out_fields = obj.fields.fields(fields)
     return obj.clone_statement(statement=statement, fields=out_fields)
 
+@approx_distinct_count.register("sql")
+def _(ctx, obj, fields=None, precision=None):
+    """Returns exact distinct counts – `precision` is ignored. Database
+    computes ``COUNT(DISTINCT)`` without transferring the rows."""
+    return ctx.op.distinct_count(obj, fields)
+
 
 #############################################################################
 # Assertions
@@ -1,10 +1,20 @@
 from ...errors import *
 from ...metadata import Field, FieldList
+from ...expression import Compiler, expression_variables
+
+try:
+    from sqlalchemy import sql
+except ImportError:
+    from ...common import MissingPackage
+    sql = MissingPackage("sqlalchemy", "SQL streams", "http://www.sqlalchemy.org/",
+                         comment = "Recommended version is > 0.7")
 
 __all__ = (
             "prepare_key",
             "zip_condition",
-            "join_on_clause"
+            "join_on_clause",
+            "SQLExpressionCompiler",
+            "is_sql_expression"
         )
 
 def prepare_key(key):
@@ -47,3 +57,90 @@ def zip_condition(left, right):
 
     return cond
 
+
+
+class SQLExpressionCompiler(Compiler):
+    """Compiles expressions into SQLAlchemy column expressions. `context` is
+    a statement (or a selectable) which columns are referenced by the
+    expression variables.
+
+    Semantics follow the `PythonExpressionCompiler`: ``/`` is a true
+    division and equality comparison with a ``null`` literal, which
+    SQLAlchemy would turn into ``IS NULL``, raises `ExpressionError`."""
+
+    def compile_literal(self, context, literal):
+        if literal is None:
+            return sql.expression.null()
+        elif literal is True:
+            return sql.expression.true()
+        elif literal is False:
+            return sql.expression.false()
+        else:
+            return sql.expression.literal(literal)
+
+    def compile_variable(self, context, variable):
+        try:
+            return context.c[variable]
+        except KeyError:
+            raise ExpressionError("Unknown variable %s" % variable)
+
+    def compile_operator(self, context, operator, op1, op2):
+        if operator == "and":
+            return sql.expression.and_(op1, op2)
+        elif operator == "or":
+            return sql.expression.or_(op1, op2)
+        elif operator in ("=", "==", "!=", "≠"):
+            if isinstance(op1, sql.expression.Null) \
+                    or isinstance(op2, sql.expression.Null):
+                raise ExpressionError("Comparison with null is not supported "
+                                      "in SQL")
+            if operator in ("=", "=="):
+                return op1 == op2
+            else:
+                return op1 != op2
+        elif operator == "<":
+            return op1 < op2
+        elif operator in ("<=", "≤"):
+            return op1 <= op2
+        elif operator == ">":
+            return op1 > op2
+        elif operator in (">=", "≥"):
+            return op1 >= op2
+        elif operator == "+":
+            return op1 + op2
+        elif operator == "-":
+            return op1 - op2
+        elif operator == "*":
+            return op1 * op2
+        elif operator == "/":
+            return sql.expression.cast(op1, sql.sqltypes.Float) / op2
+        elif operator == "%":
+            return op1 % op2
+        else:
+            raise ExpressionError("Operator '%s' is not supported in SQL"
+                                  % operator)
+
+    def compile_unary(self, context, operator, operand):
+        if operator in ("not", "~", "¬"):
+            return sql.expression.not_(operand)
+        elif operator == "-":
+            return -operand
+        else:
+            raise ExpressionError("Unary operator '%s' is not supported in "
+                                  "SQL" % operator)
+
+
+def is_sql_expression(expression):
+    """Returns `True` if `expression` can be compiled into SQL, that is if
+    the SQL `filter_expression` will not fall back to rows (unless a
+    variable is not a column of the statement)."""
+
+    try:
+        variables = expression_variables(expression)
+        columns = [sql.expression.column(name) for name in variables]
+        statement = sql.expression.table("__expression", *columns)
+        SQLExpressionCompiler().compile(expression, statement)
+    except ExpressionError:
+        return False
+
+    return True
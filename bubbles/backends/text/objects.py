@@ -3,13 +3,20 @@
 
 import csv
 import io
+import os
 import os.path
+import locale
+import urllib.parse
 from collections import defaultdict, namedtuple
+from concurrent import futures
+import threading
+import queue
 import itertools
 from ...objects import *
 from ...metadata import *
 from ...errors import *
-from ...resource import Resource
+from ...resource import Resource, is_local, open_compressed
+from ...resource import resolve_compression
 from ...stores import DataStore
 import json
 from datetime import datetime
@@ -20,6 +27,7 @@ import json
 __all__ = (
         "CSVStore",
         "CSVSource",
+        "ParallelCSVSource",
         "CSVTarget",
         )
 
@@ -109,13 +117,28 @@ class CSVSource(DataObject):
             {
                 "name": "type_converters",
                 "description": "dictionary of data type converters"
+            },
+            {
+                "name": "strict",
+                "description": "raise conversion errors instead of "
+                               "counting them"
+            },
+            {
+                "name": "batch_size",
+                "description": "number of rows converted at once"
+            },
+            {
+                "name": "compression",
+                "description": "file compression: gzip, bz2, xz, zstd or "
+                               "infer (default) from the file extension"
             }
         ]
     }
 
     def __init__(self, resource, read_header=True, dialect=None,
             delimiter=None, encoding=None, skip_rows=None,
-            empty_as_null=True, fields=None, type_converters=None, **options):
+            empty_as_null=True, fields=None, type_converters=None,
+            strict=False, batch_size=None, compression="infer", **options):
         """Creates a CSV data source stream.
 
         * `resource`: file name, URL or a file handle with CVS data
@@ -129,6 +152,15 @@ class CSVSource(DataObject):
         * `empty_as_null`: treat empty strings as ``Null`` values
         * `type_converters`: dictionary of converters (functions). It has
           to cover all known types.
+        * `strict`: if ``True`` then conversion errors are raised. Default
+          is ``False`` – values that can not be converted are ``None`` and
+          are counted in `conversion_errors`
+        * `batch_size`: number of rows that are converted at once, column
+          by column. Default is 1024.
+        * `compression`: ``gzip``, ``bz2``, ``xz`` or ``zstd``. Default
+          ``infer`` determines the compression from the file extension, such
+          as ``.csv.gz``. Compressed files are decompressed in a background
+          thread.
 
         Note: avoid auto-detection when you are reading from remote URL
         stream.
@@ -158,8 +190,29 @@ class CSVSource(DataObject):
         self.fields = fields
         # TODO: use default type converters
         self.type_converters = type_converters or {}
+        self.strict = strict
+        self.batch_size = batch_size
 
-        self.resource = Resource(resource, encoding=self.encoding)
+        # Local files can be read again by consumers of the retained source
+        if isinstance(resource, str) and is_local(resource):
+            self.path = resource
+        else:
+            self.path = None
+
+        self.arguments = dict(options,
+                              read_header=read_header,
+                              dialect=dialect,
+                              delimiter=delimiter,
+                              encoding=encoding,
+                              skip_rows=skip_rows,
+                              empty_as_null=empty_as_null,
+                              type_converters=type_converters,
+                              strict=strict,
+                              batch_size=batch_size,
+                              compression=compression)
+
+        self.resource = Resource(resource, encoding=self.encoding,
+                                 compression=compression)
         self.handle = self.resource.open()
 
         options = dict(options) if options else {}
@@ -206,54 +259,510 @@ class CSVSource(DataObject):
         if not any(self.converters):
             self.converters = None
 
+        missing_values = [f.missing_value for f in fields]
+        memoized = [f.storage_type in _memoized_types for f in fields]
+
+        self.row_converter = _RowConverter(missing_values,
+                                           self.empty_as_null,
+                                           self.converters,
+                                           memoized,
+                                           self.batch_size,
+                                           self.strict)
+        self.errors = [0] * len(fields)
+
+    @property
+    def conversion_errors(self):
+        """Dictionary of field names and number of values that could not be
+        converted so far."""
+        return {str(field): count
+                for field, count in zip(self.fields, self.errors) if count}
+
     def release(self):
         if self.resource:
             self.resource.close()
 
+    # Each row is a new list
+    fresh_rows = True
+
     def representations(self):
         return ["csv", "rows", "records"]
 
     def rows(self):
-        missing_values = [f.missing_value for f in self.fields]
+        return self.row_converter.rows(self.reader, self.errors)
+
+    def csv_stream(self):
+        return self.handle
 
+    def records(self):
+        fields = self.fields.names()
         for row in self.reader:
-            result = []
+            yield dict(zip(fields, row))
 
-            for i, value in enumerate(row):
-                if self.empty_as_null and not value:
-                    result.append(None)
-                    continue
+    def is_consumable(self):
+        return True
 
-                if missing_values[i] and value == missing_values[i]:
-                    result.append(None)
-                    continue
+    def retained(self, retain_count=1):
+        """Returns retained copy of the consumable. Local files are opened
+        and parsed again for every consumer, therefore the memory used does
+        not depend on the number of consumers. Other resources are shared
+        through a :class:`TeeDataSource`."""
+
+        if self.path is None:
+            return TeeDataSource(self.rows(), self.fields, retain_count)
 
-                func = self.converters[i] if self.converters else None
+        self.release()
+        return _RereadCSVSource(self.path, self.fields, self.arguments)
 
-                if func:
-                    result.append(func(value))
+
+class _RereadCSVSource(DataObject):
+    """Retained local CSV file that is read again by each consumer."""
+
+    def __init__(self, path, fields, arguments):
+        self.path = path
+        self.fields = fields
+        self.arguments = arguments
+
+    # Each row is a new list
+    fresh_rows = True
+
+    def representations(self):
+        return ["rows", "records"]
+
+    def source(self):
+        """Returns a new `CSVSource` for the file"""
+        return CSVSource(self.path, fields=self.fields, **self.arguments)
+
+    def rows(self):
+        source = self.source()
+        try:
+            yield from source.rows()
+        finally:
+            source.release()
+
+    def records(self):
+        source = self.source()
+        try:
+            yield from source.records()
+        finally:
+            source.release()
+
+    def is_consumable(self):
+        return False
+
+    def retained(self, retain_count=1):
+        return self
+
+
+# Conversion of Values
+# =====================
+#
+# Rows are read in batches, transposed to columns and each column is
+# converted as a whole: empty and missing values are replaced in one pass,
+# the converter is mapped over the present values and values of date and time
+# columns are parsed once per distinct value. If a conversion fails, the
+# column is converted value by value – values that fail to convert are
+# replaced by ``None`` and counted per column, unless the conversion is
+# strict.
+
+DEFAULT_CONVERSION_BATCH_SIZE = 1024
+
+# Number of converted values remembered per column
+_MEMO_SIZE = 65536
+_memoized_types = ("date", "datetime", "time")
+_conversion_exceptions = (ValueError, TypeError, ArithmeticError)
+
+class _RowConverter(object):
+    def __init__(self, missing_values, empty_as_null=True, converters=None,
+                 memoized=None, batch_size=None, strict=False):
+        """Converts rows of strings read from a CSV file. `missing_values`
+        are values that are replaced by ``None`` for each column,
+        `converters` are functions (or ``None``) for each column.
+        `memoized` is a list of flags whether results of the column
+        conversion should be remembered for repeated values. If `strict` is
+        ``True`` then conversion errors are raised."""
+
+        self.missing_values = missing_values
+        self.empty_as_null = empty_as_null
+        self.converters = converters or [None] * len(missing_values)
+        self.memoized = memoized or [False] * len(missing_values)
+        self.batch_size = batch_size or DEFAULT_CONVERSION_BATCH_SIZE
+        self.strict = strict
+
+    def rows(self, reader, errors):
+        """Yields converted rows of the `reader` as lists. Number of failed
+        conversions is added to the list of per-column `errors`."""
+
+        width = len(self.missing_values)
+        memos = [{} if flag else None for flag in self.memoized]
+        reader = iter(reader)
+
+        while True:
+            chunk = list(itertools.islice(reader, self.batch_size))
+            if not chunk:
+                break
+
+            if any(len(row) != width for row in chunk):
+                # Rows of different lengths are converted one by one
+                for row in chunk:
+                    yield [self.column([value], i, memos, errors)[0]
+                           if i < width else (value or None)
+                           for i, value in enumerate(row)]
+                continue
+
+            columns = [self.column(list(values), i, memos, errors)
+                       for i, values in enumerate(zip(*chunk))]
+
+            for row in zip(*columns):
+                yield list(row)
+
+    def column(self, values, index, memos, errors):
+        """Returns converted list of `values` of column `index`"""
+
+        missing = self.missing_values[index]
+        if self.empty_as_null and missing:
+            values = [None if not value or value == missing else value
+                      for value in values]
+        elif self.empty_as_null:
+            values = [value or None for value in values]
+        elif missing:
+            values = [None if value == missing else value
+                      for value in values]
+
+        converter = self.converters[index]
+        if converter is None:
+            return values
+
+        memo = memos[index]
+
+        if memo is None:
+            present = [value for value in values if value is not None]
+            try:
+                converted = list(map(converter, present))
+            except _conversion_exceptions:
+                # Invalid values are handled one by one below
+                pass
+            else:
+                if len(present) == len(values):
+                    return converted
+                converted = iter(converted)
+                return [None if value is None else next(converted)
+                        for value in values]
+
+        result = []
+        failed = 0
+
+        for value in values:
+            if value is None:
+                result.append(None)
+                continue
+
+            if memo is not None:
+                try:
+                    result.append(memo[value])
+                    continue
+                except KeyError:
+                    pass
+
+            try:
+                converted = converter(value)
+            except _conversion_exceptions:
+                if self.strict:
+                    raise
+                failed += 1
+                converted = None
+            else:
+                if memo is not None:
+                    if len(memo) >= _MEMO_SIZE:
+                        memo.clear()
+                    memo[value] = converted
+
+            result.append(converted)
+
+        if failed:
+            errors[index] += failed
+
+        return result
+
+
+# Parallel CSV Reader
+# ===================
+#
+# A local file is split into byte ranges of about `chunk_size` bytes which
+# are parsed and converted in a pool of processes. Range boundaries are moved
+# to the start of the next record. A newline starts a record only if it is
+# not within a quoted value, which is known from the parity of the number of
+# quote characters since the start of the data. Doubled quotes inside quoted
+# values do not change the parity.
+#
+# Reading is done in two passes, both in the worker processes: the first
+# pass counts quotes in each range and finds candidate record starts for both
+# possible quote states at the beginning of the range. The second pass parses
+# the exact record ranges.
+#
+# Files are read as bytes – the encoding should encode the quote character
+# and the newline as single ASCII bytes (UTF-8, Latin-N, ...). Records should
+# be terminated by ``\n`` or ``\r\n``.
+
+DEFAULT_CSV_CHUNK_SIZE = 16 * 1024 * 1024
+_SCAN_BLOCK_SIZE = 64 * 1024
+
+def _record_end(handle, offset, in_quotes, quotechar):
+    """Returns position after the newline that ends a record which contains
+    `offset` in a binary file `handle`. `in_quotes` is ``True`` if `offset`
+    is within a quoted value. Returns end of file if there is no such
+    newline."""
+
+    handle.seek(offset)
+    position = offset
+
+    while True:
+        block = handle.read(_SCAN_BLOCK_SIZE)
+        if not block:
+            return position
+
+        start = 0
+        while True:
+            newline = block.find(b"\n", start)
+            if newline < 0:
+                if block.count(quotechar, start) % 2:
+                    in_quotes = not in_quotes
+                break
+
+            if block.count(quotechar, start, newline) % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                return position + newline + 1
+
+            start = newline + 1
+
+        position += len(block)
+
+def _record_start(handle, offset, in_quotes, quotechar):
+    """Returns position of the first record start at or after `offset`."""
+
+    if offset > 0 and not in_quotes:
+        handle.seek(offset - 1)
+        if handle.read(1) == b"\n":
+            return offset
+
+    return _record_end(handle, offset, in_quotes, quotechar)
+
+def _scan_csv_range(path, start, end, quotechar):
+    """Returns tuple (`parity`, `outside`, `inside`) for the byte range
+    where `parity` is ``True`` if there is odd number of quote characters in
+    the range. `outside` and `inside` are the first record starts in the
+    range when the range starts outside or inside of a quoted value."""
+
+    with open(path, "rb") as handle:
+        outside = _record_start(handle, start, False, quotechar)
+        inside = _record_start(handle, start, True, quotechar)
+
+        handle.seek(start)
+        remaining = end - start
+        parity = 0
+        while remaining > 0:
+            block = handle.read(min(remaining, _SCAN_BLOCK_SIZE))
+            if not block:
+                break
+            parity += block.count(quotechar)
+            remaining -= len(block)
+
+    return (bool(parity % 2), outside, inside)
+
+def _parse_csv_range(path, start, end, encoding, options, row_converter):
+    """Returns tuple (`rows`, `errors`) with list of converted rows of
+    records in the byte range and list of conversion error counts per
+    column."""
+
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+
+    # Newlines are translated as in files opened by `CSVSource`
+    text = io.StringIO(data.decode(encoding), newline=None)
+    reader = csv.reader(text, **options)
+    errors = [0] * len(row_converter.missing_values)
+    rows = list(row_converter.rows(reader, errors))
+
+    return (rows, errors)
+
+_dialect_attributes = ("delimiter", "doublequote", "escapechar",
+                       "lineterminator", "quotechar", "quoting",
+                       "skipinitialspace", "strict")
+
+def _reader_options(options):
+    """Returns CSV reader options with the dialect expanded into plain
+    attributes, so the options can be passed to other processes."""
+
+    options = dict(options)
+    dialect = options.pop("dialect", None)
+    if dialect is None:
+        return options
+
+    result = {attr: getattr(dialect, attr) for attr in _dialect_attributes
+              if hasattr(dialect, attr)}
+    result.update(options)
+    return result
+
+
+class ParallelCSVSource(CSVSource):
+    """Local comma separated values file as a data source that is parsed by
+    multiple processes."""
+
+    def __init__(self, resource, workers=None, chunk_size=None,
+                 keep_order=True, **kwargs):
+        """Creates a CSV data source that splits the file into byte ranges
+        of about `chunk_size` bytes (default is 16 MB) and parses them in a
+        pool of `workers` processes (default is number of CPUs). If
+        `keep_order` is ``False`` then chunks of rows are yielded as soon as
+        they are parsed, otherwise the rows are in the file order.
+
+        `resource` should be a path of a local file. Other arguments are the
+        same as of `CSVSource`. `type_converters` should be functions that
+        can be passed to other processes, such as module level functions.
+
+        The source is not consumable – the file is read again on every
+        `rows()` call."""
+
+        if not isinstance(resource, str) or not is_local(resource):
+            raise ArgumentError("Parallel CSV source requires a local file "
+                                "path")
+
+        super(ParallelCSVSource, self).__init__(resource, **kwargs)
+        # Header is already read
+        self.resource.close()
+
+        if self.resource.compression:
+            raise ArgumentError("Compressed files can not be read by the "
+                                "parallel CSV source, use CSVSource")
+
+        # Plain paths may contain '#' or '?', only file URLs are parsed
+        if resource.startswith("file:"):
+            self.path = urllib.parse.urlparse(resource).path
+        else:
+            self.path = resource
+        self.workers = workers
+        self.chunk_size = chunk_size or DEFAULT_CSV_CHUNK_SIZE
+        self.keep_order = keep_order
+
+        self.reader_options = _reader_options(self.options)
+        if self.reader_options.get("escapechar"):
+            raise ArgumentError("Parallel CSV source does not support "
+                                "escape characters, only doubled quotes")
+
+        quotechar = self.reader_options.get("quotechar", '"') or '"'
+        self.encoding = self.encoding or locale.getpreferredencoding(False)
+        self.quotechar = quotechar.encode(self.encoding)
+
+        # Position of the first data record
+        skip = self.skip_rows + (1 if self.read_header else 0)
+        self.data_start = 0
+        with open(self.path, "rb") as handle:
+            for i in range(skip):
+                self.data_start = _record_end(handle, self.data_start, False,
+                                              self.quotechar)
+
+    def is_consumable(self):
+        return False
+
+    def retained(self, retain_count=1):
+        return self
+
+    def ranges(self, executor):
+        """Returns list of (`start`, `end`) byte ranges of whole records"""
+
+        size = os.path.getsize(self.path)
+        start = self.data_start
+
+        splits = list(range(start, size, self.chunk_size)) + [size]
+        if len(splits) < 2:
+            return []
+
+        scans = [executor.submit(_scan_csv_range, self.path, low, high,
+                                 self.quotechar)
+                 for low, high in zip(splits, splits[1:])]
+
+        boundaries = [start]
+        in_quotes = False
+        for i, scan in enumerate(scans):
+            parity, outside, inside = scan.result()
+            if i:
+                boundary = inside if in_quotes else outside
+                boundaries.append(max(boundary, boundaries[-1]))
+            in_quotes = in_quotes != parity
+        boundaries.append(size)
+
+        return [(low, high) for low, high in zip(boundaries, boundaries[1:])
+                if low < high]
+
+    def chunks(self):
+        """Yields lists of rows parsed from the byte ranges of the file."""
+
+        args = (self.encoding, self.reader_options, self.row_converter)
+
+        workers = self.workers or os.cpu_count() or 1
+
+        with futures.ProcessPoolExecutor(workers) as executor:
+            ranges = iter(self.ranges(executor))
+
+            def submit():
+                try:
+                    start, end = next(ranges)
+                except StopIteration:
+                    return None
+                return executor.submit(_parse_csv_range, self.path, start,
+                                       end, *args)
+
+            # Only few parsed chunks are kept in memory
+            pending = []
+            for i in range(2 * workers):
+                future = submit()
+                if future is None:
+                    break
+                pending.append(future)
+
+            while pending:
+                if self.keep_order:
+                    future = pending.pop(0)
                 else:
-                    result.append(value)
-            yield result
+                    done, _ = futures.wait(pending,
+                                        return_when=futures.FIRST_COMPLETED)
+                    future = done.pop()
+                    pending.remove(future)
 
-    def csv_stream(self):
-        return self.handle
+                rows, errors = future.result()
+                for i, count in enumerate(errors):
+                    self.errors[i] += count
+
+                future = submit()
+                if future is not None:
+                    pending.append(future)
+
+                yield rows
+
+    def rows(self):
+        for chunk in self.chunks():
+            yield from chunk
 
     def records(self):
         fields = self.fields.names()
-        for row in self.reader:
+        for row in self.rows():
             yield dict(zip(fields, row))
 
-    def is_consumable(self):
-        return True
 
-    def retained(self):
-        """Returns retained copy of the consumable"""
-        # Default implementation is naive: consumes whole CSV into Python
-        # memory
-        # TODO: decide whether source is seek-able or not
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+DEFAULT_WRITE_BATCH_SIZE = 1000
+
+# Number of batches waiting for the writer thread
+_WRITE_QUEUE_SIZE = 4
 
-        return RowListDataObject(list(self.rows()), self.fields)
+def _copy_row(row):
+    """Returns a copy of `row` if it is a list that might be modified by its
+    producer, other rows are returned as they are."""
+    if isinstance(row, list):
+        return list(row)
+    else:
+        return row
 
 
 class CSVTarget(DataObject):
@@ -285,7 +794,9 @@ class CSVTarget(DataObject):
     }
 
     def __init__(self, resource, write_headers=True, truncate=True,
-                 encoding="utf-8", dialect=None,fields=None, **kwds):
+                 encoding="utf-8", dialect=None,fields=None, buffer_size=None,
+                 batch_size=None, threaded=False, compression="infer",
+                 **kwds):
         """Creates a CSV data target
 
         :Attributes:
@@ -293,6 +804,18 @@ class CSVTarget(DataObject):
               object
             * write_headers: write field names as headers into output file
             * truncate: remove data from file before writing, default: True
+            * buffer_size: size of the file write buffer in bytes, default
+              is 1 MB
+            * batch_size: number of appended rows that are written at once,
+              default is 1000
+            * threaded: if `True` then rows are written by a background
+              thread, so disk writes overlap with production of the rows.
+              Errors of the writer are raised by the next `append()`,
+              `flush()` or `finalize()`.
+            * compression: ``gzip``, ``bz2``, ``xz`` or ``zstd``. Default
+              ``infer`` determines the compression from the file extension.
+              Data are compressed by the writer thread if `threaded` is
+              `True`.
 
         """
         self.write_headers = write_headers
@@ -302,12 +825,26 @@ class CSVTarget(DataObject):
         self.fields = fields
         self.kwds = kwds
 
+        self.buffer_size = buffer_size or DEFAULT_WRITE_BUFFER_SIZE
+        self.batch_size = batch_size or DEFAULT_WRITE_BATCH_SIZE
+
         self.close_file = False
         self.handle = None
 
         mode = "w" if self.truncate else "a"
 
-        self.handle = open(resource, mode=mode, encoding=encoding)
+        self.compression = resolve_compression(compression, resource)
+        self.raw_handle = None
+
+        if self.compression:
+            self.raw_handle = open(resource, mode=mode + "b",
+                                   buffering=self.buffer_size)
+            stream = open_compressed(self.raw_handle, mode + "b",
+                                     self.compression)
+            self.handle = io.TextIOWrapper(stream, encoding=encoding)
+        else:
+            self.handle = open(resource, mode=mode, encoding=encoding,
+                               buffering=self.buffer_size)
 
         self.writer = csv.writer(self.handle, dialect=self.dialect, **self.kwds)
 
@@ -318,13 +855,98 @@ class CSVTarget(DataObject):
 
         self.field_names = self.fields.names()
 
+        self._batch = []
+        self._error = None
+
+        if threaded:
+            self._queue = queue.Queue(maxsize=_WRITE_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._write_batches,
+                                            name="CSVTarget writer",
+                                            daemon=True)
+            self._thread.start()
+        else:
+            self._queue = None
+            self._thread = None
+
+    def _write_batches(self):
+        """Writes batches from the queue until ``None`` is received."""
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    break
+                # Batches after an error are discarded, so the producer is
+                # not blocked
+                if self._error is None:
+                    self.writer.writerows(batch)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        """Raises exception of the writer thread, if there is any."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, batch):
+        self._raise_error()
+
+        if self._queue is not None:
+            self._queue.put(batch)
+        else:
+            self.writer.writerows(batch)
+
+    def flush(self):
+        """Writes appended rows to the file."""
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._write(batch)
+
+        if self._queue is not None:
+            self._queue.join()
+            self._raise_error()
+
+        self.handle.flush()
+
     def finalize(self):
         if self.handle:
-            self.handle.close()
+            try:
+                self.flush()
+            finally:
+                if self._thread is not None:
+                    self._queue.put(None)
+                    self._thread.join()
+                    self._thread = None
+                self.handle.close()
+                self.handle = None
+                if self.raw_handle is not None:
+                    self.raw_handle.close()
 
     def append(self, row):
-        self.writer.writerow(row)
+        # Row is kept until the batch is written, caller might reuse it
+        self._batch.append(_copy_row(row))
+        if len(self._batch) >= self.batch_size:
+            batch, self._batch = self._batch, []
+            self._write(batch)
 
     def append_from(self, obj):
-        for row in obj:
-            self.append(row)
+        """Appends rows of `obj` – a data object or an iterable of rows – in
+        batches of `batch_size` rows."""
+
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._write(batch)
+
+        rows = iter(obj)
+        if not getattr(obj, "fresh_rows", False):
+            rows = map(_copy_row, rows)
+
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._write(batch)
+
+        self.flush()
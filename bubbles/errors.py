@@ -96,3 +96,7 @@ class GraphError(BubblesError):
 class FieldError(BubblesError):
     """Raised when wrong field types are passed to an operation."""
     pass
+
+class ExpressionError(BubblesError):
+    """Raised when an expression can not be parsed or compiled."""
+    pass
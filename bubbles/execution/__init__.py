@@ -2,3 +2,4 @@ from .context import *
 from .engine import *
 from .graph import *
 from .pipeline import *
+from .planner import *
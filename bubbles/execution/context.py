@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 import itertools
+import importlib.util
+import threading
+import ast
+import os.path
 from collections import defaultdict
 from ..errors import *
 from ..dev import is_experimental
@@ -14,14 +18,17 @@ __all__ = (
             "CollectingContextObserver",
         )
 
-"""List of modules with operations to be loaded for the default contex."""
+"""List of modules with operations to be loaded for the default contex. The
+modules are loaded on demand, when an operation is called with operands
+matching one of the module's signatures. Modules earlier in the list are
+preferred."""
 
-# FIXME: make this more intelligent and lazy
 _default_op_modules = (
-            "bubbles.backends.sql.ops",
-            "bubbles.backends.mongo.ops",
             "bubbles.ops.rows",
             "bubbles.ops.generic",
+            "bubbles.backends.sql.ops",
+            "bubbles.backends.mongo.ops",
+            "bubbles.backends.numpy.ops",
         )
 
 
@@ -63,6 +70,19 @@ class OperationContext(object):
         self.retry_allow = []
         self.retry_deny = []
 
+        # Dispatch cache: (operation name, representations) ->
+        # (operation, operation revision, resolution order)
+        self._dispatch_cache = {}
+
+        # Modules to be loaded on demand and index of their operations:
+        # operation name -> list of (module path, signature)
+        self._lazy_modules = []
+        self._lazy_index = defaultdict(list)
+        self._lazy_lock = threading.RLock()
+        # (operation name, representations) that did not match any module in
+        # the lazy index, cleared when a module is registered
+        self._lazy_misses = set()
+
     def operation(self, name):
         """Get operation by `name`. If operatin does not exist, then
         `operation_not_found()` is called and the lookup is retried."""
@@ -82,11 +102,78 @@ class OperationContext(object):
             if isinstance(op, Operation):
                 self.add_operation(op)
 
+    def add_lazy_operations_from(self, modulepath):
+        """Registers module with `modulepath` to be imported when one of its
+        operations is needed. Operation names and signatures are collected
+        from the module source without importing the module, therefore the
+        module dependencies, such as database drivers, are imported only
+        when they are really used. If the module source is not available,
+        the module is imported immediately."""
+
+        index = _module_operations(modulepath)
+
+        if index is None:
+            self.add_operations_from(_load_module(modulepath))
+            return
+
+        with self._lazy_lock:
+            self._lazy_modules.append(modulepath)
+            for name, signature in index:
+                self._lazy_index[name].append((modulepath, signature))
+            self._lazy_misses.clear()
+
+    def lazy_signatures(self, name):
+        """Returns list of signatures of operation `name` provided by modules
+        that were registered for on demand loading and are not loaded yet.
+        Signature is a tuple of representations or `None` for an operation
+        that matches any operands."""
+
+        with self._lazy_lock:
+            return [signature for _, signature
+                    in self._lazy_index.get(name, [])]
+
+    def load_lazy_modules(self, name=None, representations=None):
+        """Imports modules registered by `add_lazy_operations_from()`. If
+        `name` is specified, then only modules providing an operation with
+        that name are imported. If `representations` are specified as well,
+        then only modules with a signature matching the representations are
+        imported. Returns `True` if any module was loaded."""
+
+        if not self._lazy_modules:
+            return False
+
+        with self._lazy_lock:
+            if name is None:
+                modules = list(self._lazy_modules)
+            else:
+                modules = []
+                for modulepath, signature in self._lazy_index.get(name, []):
+                    if modulepath in modules:
+                        continue
+                    if representations is None \
+                            or _signature_matches(signature, representations):
+                        modules.append(modulepath)
+
+            for modulepath in modules:
+                self.logger.debug("loading operations from %s" % modulepath)
+                self.add_operations_from(_load_module(modulepath))
+                self._lazy_modules.remove(modulepath)
+
+                for name_, entries in list(self._lazy_index.items()):
+                    entries = [e for e in entries if e[0] != modulepath]
+                    if entries:
+                        self._lazy_index[name_] = entries
+                    else:
+                        del self._lazy_index[name_]
+
+        return bool(modules)
+
     def add_operation(self, op):
         """Registers a decorated operation.  operation is considered to be a
         context's method and would receive the context as first argument."""
 
         self.operations[op.name] = op
+        self._dispatch_cache.clear()
 
     def remove_operation(self, name):
         """Removes all operations with `name` and `signature`. If no
@@ -94,11 +181,21 @@ class OperationContext(object):
         removed, regardles of the signature."""
 
         del self.operations[name]
+        self._dispatch_cache.clear()
 
     def operation_not_found(self, name):
-        """Subclasses might override this method to load necessary modules and
-        register operations using `register_operation()`. Default
-        implementation raises an exception."""
+        """Loads modules providing operation `name` that were registered for
+        on demand loading. Subclasses might override this method to load
+        necessary modules and register operations using
+        `register_operation()`. Raises an exception if the operation can not
+        be found."""
+
+        if self.load_lazy_modules(name):
+            try:
+                return self.operations[name]
+            except KeyError:
+                pass
+
         raise OperationError("Operation '%s' not found" % name)
 
     def get_operation(self, name, signature):
@@ -143,6 +240,28 @@ class OperationContext(object):
 
         return True
 
+    def resolution_order(self, op, representations):
+        """Returns a list of signatures of operation `op` matching
+        `representations` of the operands in order in which they should be
+        tried. The result is cached per context, the cache is invalidated
+        when operations are added or removed or when a new function is
+        registered for the operation."""
+
+        key = (op.name, tuple(tuple(reps) for reps in representations))
+
+        try:
+            cached_op, revision, order = self._dispatch_cache[key]
+        except KeyError:
+            pass
+        else:
+            if cached_op is op and revision == op.revision:
+                return list(order)
+
+        order = op.resolution_order(representations)
+        self._dispatch_cache[key] = (op, op.revision, tuple(order))
+
+        return order
+
     def call(self, op_name, *args, **kwargs):
         """Dispatch and call operation with `name`. Arguments are passed to the
         operation, If the operation raises `RetryOperation` then another
@@ -153,7 +272,15 @@ class OperationContext(object):
         operands = args[:op.opcount]
 
         reps = get_representations(*operands)
-        resolution_order = op.resolution_order(reps)
+
+        if op_name in self._lazy_index:
+            key = (op_name, tuple(tuple(rep) for rep in reps))
+            if key not in self._lazy_misses:
+                with self._lazy_lock:
+                    if not self.load_lazy_modules(op_name, reps):
+                        self._lazy_misses.add(key)
+
+        resolution_order = self.resolution_order(op, reps)
         first_signature = resolution_order[0]
 
         self.logger.debug("op %s(%s)" % (op_name, reps))
@@ -178,8 +305,14 @@ class OperationContext(object):
             try:
                 function = op.function(sig)
             except KeyError:
-                raise OperationError("No signature (%s) in operation %s"
-                                     % (sig, op_name))
+                # Retry signature might be provided by a module that is not
+                # loaded yet
+                reps = [[rep] for rep in sig]
+                if not self.load_lazy_modules(op_name, reps) \
+                        or sig not in op.registry:
+                    raise OperationError("No signature (%s) in operation %s"
+                                         % (sig, op_name))
+                function = op.function(sig)
 
             try:
                 if op.experimental:
@@ -286,12 +419,14 @@ class _OperationGetter(object):
 
 
 def create_default_context():
-    """Creates a ExecutionContext with default operations."""
+    """Creates a ExecutionContext with default operations. Operation
+    prototypes are available immediately, modules with operation
+    implementations are imported on demand."""
     context = OperationContext()
 
+    context.add_operations_from(_load_module("bubbles.prototypes"))
     for modname in _default_op_modules:
-        mod = _load_module(modname)
-        context.add_operations_from(mod)
+        context.add_lazy_operations_from(modname)
 
     return context
 
@@ -307,6 +442,94 @@ def _load_module(modulepath):
     return mod
 
 
+def _module_source(modulepath):
+    """Returns path to the source file of module `modulepath` without
+    importing the module or its parent packages (except the top-level one).
+    Returns `None` if the source can not be found."""
+
+    top, *path = modulepath.split(".")
+
+    spec = importlib.util.find_spec(top)
+    if spec is None:
+        return None
+    if not path:
+        return spec.origin
+    if not spec.submodule_search_locations:
+        return None
+
+    dirs = list(spec.submodule_search_locations)
+    for i, token in enumerate(path):
+        is_last = (i == len(path) - 1)
+        for directory in dirs:
+            package = os.path.join(directory, token)
+            init = os.path.join(package, "__init__.py")
+            if os.path.exists(init):
+                if is_last:
+                    return init
+                dirs = [package]
+                break
+            elif is_last and os.path.exists(package + ".py"):
+                return package + ".py"
+        else:
+            return None
+
+def _module_operations(modulepath):
+    """Returns list of tuples `(name, signature)` of operations defined or
+    registered in module `modulepath`. `signature` is a tuple of
+    representations or `None` for an operation that matches any operands.
+    Returns `None` if the module source is not available."""
+
+    source_path = _module_source(modulepath)
+    if not source_path:
+        return None
+
+    try:
+        with open(source_path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), source_path)
+    except (OSError, SyntaxError):
+        return None
+
+    operations = []
+
+    for node in ast.walk(tree):
+        # @operation def name(...) or @operation(...) def name(...)
+        if isinstance(node, ast.FunctionDef):
+            for decorator in node.decorator_list:
+                if isinstance(decorator, ast.Call):
+                    decorator = decorator.func
+                if isinstance(decorator, ast.Name) \
+                        and decorator.id == "operation":
+                    operations.append((node.name, None))
+                # @name.register without signature
+                elif isinstance(decorator, ast.Attribute) \
+                        and decorator.attr == "register" \
+                        and isinstance(decorator.value, ast.Name) \
+                        and decorator in node.decorator_list:
+                    operations.append((decorator.value.id, None))
+
+        # name.register("rep", ...)
+        elif isinstance(node, ast.Call) \
+                and isinstance(node.func, ast.Attribute) \
+                and node.func.attr == "register" \
+                and isinstance(node.func.value, ast.Name):
+            signature = tuple(arg.value for arg in node.args
+                              if isinstance(arg, ast.Constant)
+                                 and isinstance(arg.value, str))
+            operations.append((node.func.value.id, signature or None))
+
+    return operations
+
+def _signature_matches(signature, representations):
+    """Returns `True` if `signature` from the module operation index matches
+    any combination of operand `representations`"""
+    if signature is None:
+        return True
+
+    signature = Signature(*signature)
+    return any(signature.matches(*reps)
+               for reps in itertools.product(*representations))
+
+
 default_context = LocalProxy("default_context",
                              factory=create_default_context)
 
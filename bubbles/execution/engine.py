@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple, Counter
+from concurrent import futures
 from ..errors import *
+from ..stores import open_store
+from ..threadlocal import LocalProxy
 
 __all__ = (
     "ExecutionEngine",
+    "ParallelExecutionEngine",
 
     # TODO: Not quite public yet, but we export it nonetheless
     "ExecutionStep",
@@ -54,21 +58,28 @@ ExecutionPlan = namedtuple("ExecutionPlan", ["steps", "consumption"])
 
 class ExecutionEngine(object):
 
-    def __init__(self, context, stores=None):
+    def __init__(self, context, stores=None, planner=None):
         """Creates an instance of execution engine within an execution
         `context`.
 
         `stores` is a mapping of store names and opened data stores. Stores
         are used when resolving data sources by reference.
 
+        `planner` is an optional object with method `optimize(graph)` that
+        returns rewritten graph to be executed instead of the original one,
+        such as :class:`PushdownPlanner`.
+
         Execution engine is also used in :class:`Pipeline` objects to run the
         pipelines.
         """
 
         self.stores = stores or {}
         self.context = context
+        self.planner = planner
         self.logger = context.logger
 
+        self._owned_stores = []
+
     def execution_plan(self, graph):
         """Returns a list of topologically sorted `ExecutionSteps`, ready to
         be used for execution.
@@ -80,6 +91,9 @@ class ExecutionEngine(object):
 
         # TODO: this method will be customizable in subclasses in the future
 
+        if self.planner:
+            graph = self.planner.optimize(graph)
+
         # Operation -> Node -> Execution Step
         # Node is an operation with parameters set (configured operation)
         # Execution Node is Node in execution context with bound outlets
@@ -124,15 +138,11 @@ class ExecutionEngine(object):
 
         return plan
 
-    def run(self, graph):
-        """Runs the `graph` nodes. First an execution plan is prepared, then
-        the nodes are executed according to the plan. See
-        :meth:`ExecutionEngine.prepare_execution_plan` for more information.
-        """
+    def open_stores(self):
+        """Opens stores that are specified as a dictionary with store `type`
+        and store options."""
 
-        # TODO: write documentation about consumable objects
-
-        # FIXME: FROM HERE vvvvvvv
+        # FIXME: this does not belong here
         for name, store in self.stores.items():
             if isinstance(store, dict):
                 store = dict(store)
@@ -142,8 +152,16 @@ class ExecutionEngine(object):
 
             self.stores[name] = store
 
+    def run(self, graph):
+        """Runs the `graph` nodes. First an execution plan is prepared, then
+        the nodes are executed according to the plan. See
+        :meth:`ExecutionEngine.prepare_execution_plan` for more information.
+        """
+
+        # TODO: write documentation about consumable objects
+
+        self.open_stores()
         plan = self.execution_plan(graph)
-        # FIXME: TO HERE ^^^^^^^
 
         # Set of already consumed nodes
         consumed = set()
@@ -159,8 +177,8 @@ class ExecutionEngine(object):
                 # used is going to be consumed. If it is consumable and will
                 # be consumed more than once, then a retained version of the
                 # object is created. Retention policy is defined by the
-                # backend. In most of the cases it is just python list wrapper
-                # over consumed iterator of rows, which might be quite costly.
+                # backend. In most of the cases it is a tee of the iterator of
+                # rows that spills to a temporary file.
 
                 consume_times = plan.consumption[outlet.node]
                 if outlet.result.is_consumable() and consume_times > 1:
@@ -168,9 +186,122 @@ class ExecutionEngine(object):
                         self.logger.debug("retaining consumable %s. it will "
                                           "be consumed %s times" % \
                                                  (outlet.node, consume_times))
-                        outlet.result = outlet.result.retained()
+                        outlet.result = outlet.result.retained(consume_times)
 
                 consumed.add(outlet.node)
                 operands.append(outlet.result)
 
             step.evaluate(self, self.context, operands)
+
+
+# Parallel Execution Engine
+# =========================
+#
+# Executes steps of the plan as soon as all of their outlets are evaluated.
+# Independent branches of the graph, such as forked pipelines, are evaluated
+# concurrently in a pool of workers.
+#
+# Note that most of the operations are lazy – they just compose an iterator
+# or a SQL statement – and the actual work is done by the consuming nodes,
+# such as `insert`, `create` or `pretty_print`. Those are the nodes that
+# benefit from the parallel execution.
+
+class ParallelExecutionEngine(ExecutionEngine):
+
+    def __init__(self, context, stores=None, max_workers=None, executor=None,
+                 planner=None):
+        """Creates an execution engine that evaluates independent steps of
+        the execution plan concurrently.
+
+        `max_workers` is number of workers of the default thread pool. If
+        not specified, then default of the :class:`ThreadPoolExecutor` is
+        used. `executor` is an optional `concurrent.futures.Executor`
+        instance that will be used instead of the default thread pool. The
+        executor is not shut down by the engine.
+
+        .. note::
+
+            Evaluated nodes pass data objects to each other, which are
+            iterators, cursors or open files in most of the cases. Use
+            executors that share the memory with the engine, such as a thread
+            pool.
+        """
+
+        # Thread-local context would be re-created in every worker thread,
+        # therefore we use the actual context object.
+        if isinstance(context, LocalProxy):
+            context = context._represented_local_object()
+
+        super().__init__(context, stores, planner)
+
+        self.max_workers = max_workers
+        self.executor = executor
+
+    def run(self, graph):
+        """Runs the `graph` nodes. Steps are evaluated as soon as all the
+        steps they depend on are evaluated. Retained versions of objects
+        consumed more than once are prepared before the consumers are
+        evaluated.
+
+        If any step fails, then no more steps are scheduled and the first
+        exception is re-raised after the running steps finish."""
+
+        self.open_stores()
+        plan = self.execution_plan(graph)
+
+        # step -> number of not yet evaluated outlet steps
+        waiting = {}
+        # step -> list of steps that use the step as an outlet
+        dependants = {step:[] for step in plan.steps}
+
+        for step in plan.steps:
+            outlets = set(step.outlets)
+            waiting[step] = len(outlets)
+            for outlet in outlets:
+                dependants[outlet].append(step)
+
+        if self.executor:
+            executor = self.executor
+        else:
+            executor = futures.ThreadPoolExecutor(self.max_workers)
+
+        running = {}
+
+        def submit(step):
+            operands = [outlet.result for outlet in step.outlets]
+            self.logger.debug("submitting %s" % str(step))
+            future = executor.submit(step.evaluate, self, self.context,
+                                     operands)
+            running[future] = step
+
+        try:
+            for step in plan.steps:
+                if not waiting[step]:
+                    submit(step)
+
+            while running:
+                done, _ = futures.wait(running,
+                                       return_when=futures.FIRST_COMPLETED)
+
+                for future in done:
+                    step = running.pop(future)
+
+                    # Re-raise the exception, if there is any
+                    future.result()
+
+                    consume_times = plan.consumption[step.node]
+                    if consume_times > 1 and step.result.is_consumable():
+                        self.logger.debug("retaining consumable %s. it will "
+                                          "be consumed %s times" % \
+                                                 (step.node, consume_times))
+                        step.result = step.result.retained(consume_times)
+
+                    for dependant in dependants[step]:
+                        waiting[dependant] -= 1
+                        if not waiting[dependant]:
+                            submit(dependant)
+        finally:
+            if running:
+                futures.wait(running)
+            if not self.executor:
+                executor.shutdown()
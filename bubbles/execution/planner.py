@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from .graph import Graph, Node, Connection
+from ..common import get_logger, MissingPackageError
+from ..errors import *
+
+__all__ = (
+    "PushdownPlanner",
+)
+
+# Pushdown Planner
+# ================
+#
+# Operations are dispatched one by one at the time of graph execution. If an
+# operation does not have an implementation for the representation of its
+# operand, for example there is no SQL implementation of a Python predicate
+# filter, then the operation falls back to "rows" and all the following
+# operations are streamed through Python as well, even if they could have
+# been composed into the SQL statement.
+#
+# The planner rewrites the graph before execution by reordering filters:
+# a filter that can not be evaluated in the preferred representation is moved
+# after the following steps that can, as long as the order of the two steps
+# does not change the result. The chain of steps in front of the filter is
+# therefore composed in the database and the filter is streamed through
+# Python afterwards.
+#
+# The planner does not choose representations – they are still chosen by
+# dispatch at run time – and it does not move other Python-only operations.
+# Cost heuristic is simple: every step that can be composed in the preferred
+# representation is cheaper than a step that can not. Only steps that select
+# rows without changing them (filters) are moved and only past steps that do
+# not change the row values or drop fields (filters, sorting, adding constant
+# fields).
+
+# Operations that select rows without modifying them
+FILTER_OPERATIONS = (
+    "filter_by_value",
+    "filter_by_set",
+    "filter_by_range",
+    "filter_not_empty",
+    "filter_empty",
+    "filter_by_predicate",
+    "filter_expression",
+)
+
+# Operations that can be swapped with a preceding filter without changing the
+# result
+COMMUTING_OPERATIONS = FILTER_OPERATIONS + (
+    "sort",
+    "append_constant_fields",
+)
+
+def _is_sql_expression(node):
+    from ..backends.sql.utils import is_sql_expression
+
+    if node.args:
+        expression = node.args[0]
+    else:
+        expression = node.kwargs.get("expression")
+
+    return is_sql_expression(expression)
+
+# Operations that have an implementation for a representation but might
+# still retry with another one, depending on their arguments. Keys are
+# (representation, operation name), values are functions of a node.
+ARGUMENT_CHECKS = {
+    ("sql", "filter_expression"): _is_sql_expression,
+}
+
+class PushdownPlanner(object):
+    def __init__(self, context, representation="sql"):
+        """Creates a planner that rewrites graphs by moving filters that
+        can not be evaluated in the `representation` (default is ``sql``)
+        within `context` after the following steps that can.
+
+        Use the planner with an execution engine::
+
+            planner = PushdownPlanner(context)
+            engine = ExecutionEngine(context, planner=planner)
+        """
+
+        self.context = context
+        self.representation = representation
+        self.logger = get_logger()
+
+    def is_native(self, node):
+        """Returns `True` if `node` is an operation that has an
+        implementation for the planner's representation."""
+
+        if not isinstance(node, Node):
+            return False
+
+        try:
+            op = self.context.operation(node.opname)
+        except OperationError:
+            return False
+
+        signatures = list(op.signatures())
+        # Implementation might be in a module that is not loaded yet
+        signatures += self.context.lazy_signatures(node.opname)
+
+        if not any(sig and sig[0] == self.representation
+                   for sig in signatures):
+            return False
+
+        check = ARGUMENT_CHECKS.get((self.representation, node.opname))
+        if check:
+            try:
+                return check(node)
+            except MissingPackageError:
+                return False
+
+        return True
+
+    def can_move_after(self, node, next_node):
+        """Returns `True` if `node` that is not native in the planner's
+        representation should be moved after `next_node`."""
+
+        return isinstance(node, Node) \
+                and isinstance(next_node, Node) \
+                and node.opname in FILTER_OPERATIONS \
+                and next_node.opname in COMMUTING_OPERATIONS \
+                and not self.is_native(node) \
+                and self.is_native(next_node)
+
+    def optimize(self, graph):
+        """Returns a new graph with reordered nodes. The nodes are the same
+        objects as in the original `graph`, only the connections are
+        changed. Original graph is not modified."""
+
+        result = Graph()
+        for name, node in graph.nodes.items():
+            result.add(node, name)
+        result.connections = set(graph.connections)
+
+        # Move the nodes as long as there is something to move
+        moved = True
+        while moved:
+            moved = False
+            for node in result.sorted_nodes():
+                if self._move_after_next(result, node):
+                    moved = True
+                    break
+
+        return result
+
+    def _move_after_next(self, graph, node):
+        """Moves `node` after its only target, if it is possible. Returns
+        `True` when the node was moved."""
+
+        inputs = [c for c in graph.connections if c.target == node]
+        outputs = [c for c in graph.connections if c.source == node]
+
+        # Only linear chains are considered: node has one input and one
+        # output and the output is the only input of the next node.
+        if len(inputs) != 1 or len(outputs) != 1:
+            return False
+
+        next_node = outputs[0].target
+        next_inputs = [c for c in graph.connections if c.target == next_node]
+        if len(next_inputs) != 1:
+            return False
+
+        if not self.can_move_after(node, next_node):
+            return False
+
+        self.logger.debug("moving %s after %s" % (node, next_node))
+
+        source = inputs[0].source
+        next_outputs = [c for c in graph.connections if c.source == next_node]
+
+        graph.connections -= set(inputs + outputs + next_outputs)
+
+        graph.connections.add(Connection(source, next_node,
+                                         outputs[0].outlet))
+        graph.connections.add(Connection(next_node, node, inputs[0].outlet))
+        for conn in next_outputs:
+            graph.connections.add(Connection(node, conn.target, conn.outlet))
+
+        return True
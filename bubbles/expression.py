@@ -1,6 +1,32 @@
-from expressions import Compiler, ExpressionError, default_dialect
+# -*- coding: utf-8 -*-
+"""Simple expressions used in predicates, such as ``amount > 100 and year
+>= 2012``. An expression is parsed once and compiled by a backend specific
+compiler – into Python code, SQL statement condition or a MongoDB query."""
 
-class bubbles_dialect(default_dialect):
+import re
+from collections import namedtuple
+from .errors import *
+
+__all__ = (
+    "parse_expression",
+    "expression_variables",
+    "Compiler",
+    "PythonExpressionCompiler",
+    "PythonLambdaCompiler",
+    "PythonRowCompiler",
+    "lambda_from_predicate",
+)
+
+# Operator kinds and associativity
+UNARY = 1
+BINARY = 2
+LEFT = "left"
+RIGHT = "right"
+
+# Precedence of operators such as '-' in their unary form
+UNARY_PRECEDENCE = 1000
+
+class bubbles_dialect(object):
     operators = {
         # "^": (1000, RIGHT, BINARY),
         "~": (1000, None, UNARY),
@@ -34,6 +60,13 @@ class bubbles_dialect(default_dialect):
     }
     case_sensitive = False
 
+    # Keywords that are literal values
+    literals = {
+        "true": True,
+        "false": False,
+        "null": None,
+    }
+
     # TODO: future function list (unused now)
     functions = (
             "min", "max",
@@ -42,19 +75,284 @@ class bubbles_dialect(default_dialect):
 # IS blank
 # IS null
 
+#############################################################################
+# Parser
+
+Literal = namedtuple("Literal", ["value"])
+Variable = namedtuple("Variable", ["name"])
+UnaryOperator = namedtuple("UnaryOperator", ["operator", "operand"])
+BinaryOperator = namedtuple("BinaryOperator", ["operator", "left", "right"])
+Function = namedtuple("Function", ["name", "args"])
+
+_symbols = sorted((op for op in bubbles_dialect.operators if not op.isalpha()),
+                  key=len, reverse=True)
+
+_token_pattern = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+\.\d*|\.\d+|\d+)([eE][-+]?\d+)? |
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*") |
+        (?P<name>[^\W\d]\w*) |
+        (?P<symbol>%s|[(),])
+    )""" % "|".join(re.escape(symbol) for symbol in _symbols),
+    re.VERBOSE | re.UNICODE)
+
+def _tokenize(text):
+    """Returns list of tokens – tuples (`kind`, `value`) where `kind` is one
+    of ``literal``, ``name``, ``operator`` or ``punctuation``."""
+
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = _token_pattern.match(text, position)
+        if not match:
+            while text[position].isspace():
+                position += 1
+            raise ExpressionError("Unexpected character '%s' at position %d "
+                                  "of expression '%s'"
+                                  % (text[position], position, text))
+        position = match.end()
+
+        if match.group("number") is not None:
+            number = match.group(0).strip()
+            if re.match(r"^\d+$", number):
+                tokens.append(("literal", int(number)))
+            else:
+                tokens.append(("literal", float(number)))
+        elif match.group("string") is not None:
+            string = match.group("string")
+            quote = string[0]
+            tokens.append(("literal",
+                           string[1:-1].replace(quote * 2, quote)))
+        elif match.group("name") is not None:
+            name = match.group("name")
+            lower = name.lower()
+            if lower in bubbles_dialect.operators:
+                tokens.append(("operator", lower))
+            elif lower in bubbles_dialect.literals:
+                tokens.append(("literal", bubbles_dialect.literals[lower]))
+            else:
+                tokens.append(("name", name))
+        else:
+            symbol = match.group("symbol")
+            if symbol in "(),":
+                tokens.append(("punctuation", symbol))
+            else:
+                tokens.append(("operator", symbol))
+
+    return tokens
+
+class _Parser(object):
+    """Precedence climbing parser of the `bubbles_dialect` expressions."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def error(self, message):
+        raise ExpressionError("%s in expression '%s'" % (message, self.text))
+
+    def expect(self, value):
+        kind, token = self.next()
+        if token != value or kind != "punctuation":
+            self.error("Expected '%s'" % value)
+
+    def parse(self):
+        if not self.tokens:
+            self.error("Empty expression")
+        node = self.expression(0)
+        if self.peek()[0] is not None:
+            self.error("Unexpected '%s'" % (self.peek()[1], ))
+        return node
+
+    def expression(self, min_precedence):
+        left = self.operand()
+
+        while True:
+            kind, token = self.peek()
+            if kind != "operator":
+                break
+
+            precedence, assoc, op_kind = bubbles_dialect.operators[token]
+            if not op_kind & BINARY or precedence < min_precedence:
+                break
+
+            self.next()
+            if assoc == LEFT:
+                right = self.expression(precedence + 1)
+            else:
+                right = self.expression(precedence)
+            left = BinaryOperator(token, left, right)
+
+        return left
+
+    def operand(self):
+        kind, token = self.next()
+
+        if kind == "literal":
+            return Literal(token)
+        elif kind == "name":
+            if self.peek() == ("punctuation", "("):
+                return self.function(token)
+            return Variable(token)
+        elif kind == "operator":
+            precedence, assoc, op_kind = bubbles_dialect.operators[token]
+            if not op_kind & UNARY:
+                self.error("Operator '%s' is not unary" % token)
+            # Operators that are both unary and binary, such as '-', bind
+            # tighter in their unary form
+            if op_kind & BINARY:
+                precedence = UNARY_PRECEDENCE
+            return UnaryOperator(token, self.expression(precedence))
+        elif (kind, token) == ("punctuation", "("):
+            node = self.expression(0)
+            self.expect(")")
+            return node
+        elif kind is None:
+            self.error("Unexpected end")
+        else:
+            self.error("Unexpected '%s'" % (token, ))
+
+    def function(self, name):
+        self.expect("(")
+        args = []
+        if self.peek() != ("punctuation", ")"):
+            args.append(self.expression(0))
+            while self.peek() == ("punctuation", ","):
+                self.next()
+                args.append(self.expression(0))
+        self.expect(")")
+        return Function(name, args)
+
+def parse_expression(text):
+    """Parses expression `text` and returns the expression tree of nodes
+    `Literal`, `Variable`, `UnaryOperator`, `BinaryOperator` and
+    `Function`. Raises `ExpressionError` on syntax error."""
+    return _Parser(text).parse()
+
+def expression_variables(expression):
+    """Returns list of variable names used in the `expression` (text or
+    parsed tree) in order of their first occurrence."""
+
+    if isinstance(expression, str):
+        expression = parse_expression(expression)
+
+    names = []
+
+    def collect(node):
+        if isinstance(node, Variable):
+            if node.name not in names:
+                names.append(node.name)
+        elif isinstance(node, UnaryOperator):
+            collect(node.operand)
+        elif isinstance(node, BinaryOperator):
+            collect(node.left)
+            collect(node.right)
+        elif isinstance(node, Function):
+            for arg in node.args:
+                collect(arg)
+
+    collect(expression)
+    return names
+
+#############################################################################
+# Compilers
+
+class Compiler(object):
+    """Base expression compiler. Subclasses implement the `compile_*`
+    methods that return compiled form of the expression parts from already
+    compiled operands. `context` is passed to all the methods, it is
+    compiler specific – usually list of known variables."""
+
+    def compile(self, expression, context=None):
+        """Compiles `expression` – a string or already parsed expression
+        tree – within `context`."""
+
+        if isinstance(expression, str):
+            expression = parse_expression(expression)
+
+        result = self._compile(context, expression)
+        return self.finalize(context, result)
+
+    def _compile(self, context, node):
+        if isinstance(node, Literal):
+            return self.compile_literal(context, node.value)
+        elif isinstance(node, Variable):
+            return self.compile_variable(context, node.name)
+        elif isinstance(node, UnaryOperator):
+            operand = self._compile(context, node.operand)
+            return self.compile_unary(context, node.operator, operand)
+        elif isinstance(node, BinaryOperator):
+            left = self._compile(context, node.left)
+            right = self._compile(context, node.right)
+            return self.compile_operator(context, node.operator, left, right)
+        elif isinstance(node, Function):
+            args = [self._compile(context, arg) for arg in node.args]
+            return self.compile_function(context, node.name, args)
+        else:
+            raise ExpressionError("Unknown expression node %s" % (node, ))
+
+    def finalize(self, context, expression):
+        return expression
+
+    def compile_literal(self, context, literal):
+        raise NotImplementedError
+
+    def compile_variable(self, context, variable):
+        raise NotImplementedError
+
+    def compile_operator(self, context, operator, op1, op2):
+        raise NotImplementedError
+
+    def compile_unary(self, context, operator, operand):
+        raise NotImplementedError
+
+    def compile_function(self, context, function, args):
+        raise ExpressionError("Unknown function '%s'" % function)
+
+
 # Translate bubbles operator to Python operator
 _python_operators = {
-    "=": "=="
+    "=": "==",
+    "≠": "!=",
+    "≤": "<=",
+    "≥": ">=",
+    "~": "not",
+    "¬": "not",
 }
 
 
 class PythonExpressionCompiler(Compiler):
+    """Compiles expressions into Python expression source. Variables are
+    compiled as Python names, `context` is list of known variables.
+
+    ``None`` is treated as an unknown value, as ``NULL`` in SQL: result of
+    an operation with ``None`` operand is ``None``, ``and`` and ``or`` use
+    three-valued logic. Operands are bound to temporary names, so they are
+    evaluated only once."""
+
+    def __init__(self):
+        self.temporaries = 0
+
+    def temporary(self):
+        """Returns a new name for an intermediate value"""
+        self.temporaries += 1
+        return "__v%d" % self.temporaries
+
     def compile_literal(self, context, literal):
-        # TODO: support string literals (quote them properely)
-        if isinstance(literal, str):
-            raise NotImplementedError("String literals are not yet supported")
-        else:
-            return str(literal)
+        return repr(literal)
 
     def compile_variable(self, context, variable):
         if variable in context:
@@ -64,26 +362,66 @@ class PythonExpressionCompiler(Compiler):
 
     def compile_operator(self, context, operator, op1, op2):
         operator = _python_operators.get(operator, operator)
-        return "(%s%s%s)" % (op1, operator, op2)
+        left = self.temporary()
+        right = self.temporary()
+
+        if operator == "and":
+            return "(False if (%(l)s := %(a)s) is not None and not %(l)s " \
+                   "or (%(r)s := %(b)s) is not None and not %(r)s " \
+                   "else None if %(l)s is None or %(r)s is None " \
+                   "else True)" % {"l": left, "r": right, "a": op1, "b": op2}
+        elif operator == "or":
+            return "(True if (%(l)s := %(a)s) is not None and %(l)s " \
+                   "or (%(r)s := %(b)s) is not None and %(r)s " \
+                   "else None if %(l)s is None or %(r)s is None " \
+                   "else False)" % {"l": left, "r": right, "a": op1, "b": op2}
+        else:
+            return "(None if (%s := %s) is None or (%s := %s) is None " \
+                   "else %s %s %s)" % (left, op1, right, op2,
+                                       left, operator, right)
 
     def compile_unary(self, context, operator, operand):
         operator = _python_operators.get(operator, operator)
-        return "(%s%s)" % (operand, operator)
+        value = self.temporary()
+        return "(None if (%s := %s) is None else %s %s)" \
+                    % (value, operand, operator, value)
 
-    def compile_function(self, context, function, args):
-        # TODO: support functions
-        raise NotImplementedError("Functions are not yet implemented")
 
+class PythonLambdaCompiler(PythonExpressionCompiler):
+    """Compiles expressions into source of a lambda function with
+    arguments from the `context`."""
+
+    def compile_variable(self, context, variable):
+        if not variable.isidentifier():
+            raise ExpressionError("Variable '%s' is not a valid Python name"
+                                  % variable)
+        return super(PythonLambdaCompiler, self).compile_variable(context,
+                                                                  variable)
 
-def PythonLambdaCompiler(PythonExpressionCompiler):
-    def finalize(self, context):
-        # TODO: sanitize field names in context
+    def finalize(self, context, expression):
         field_list = ", ".join(context)
-        lambda_str = "lambda %s: %s" % (context, expression)
+        lambda_str = "lambda %s: %s" % (field_list, expression)
         return lambda_str
 
 
+class PythonRowCompiler(PythonExpressionCompiler):
+    """Compiles expressions into Python expression source that refers to
+    values of a row by index: ``row[index]``. `context` is a `FieldList` or
+    list of field names."""
+
+    def compile_variable(self, context, variable):
+        names = [str(field) for field in context]
+        try:
+            index = names.index(variable)
+        except ValueError:
+            raise ExpressionError("Unknown variable %s" % variable)
+
+        return "row[%d]" % index
+
+
 def lambda_from_predicate(predicate, key):
+    """Returns a function with arguments `key` – list of names – that
+    evaluates the `predicate` expression."""
     compiler = PythonLambdaCompiler()
     expression = compiler.compile(predicate, context=key)
-    return expression
+    return eval(expression, {})
@@ -4,6 +4,8 @@ import itertools
 import functools
 import re
 import inspect
+import operator
+import hashlib
 import warnings
 from .common import get_logger, IgnoringDictionary
 from .errors import *
@@ -14,6 +16,7 @@ __all__ = [
     "to_field",
     "Field",
     "FieldList",
+    "FrozenFieldList",
     "FieldFilter",
     "storage_types",
     "analytical_types",
@@ -21,6 +24,7 @@ __all__ = [
     "prepare_key",
     "prepare_aggregation_list",
     "prepare_order_list",
+    "prepare_window_list",
     "DEFAULT_ANALYTICAL_TYPES"
 ]
 
@@ -285,6 +289,8 @@ class FieldList(object):
         self._fields = []
         self._field_dict = {}
         self._field_names = []
+        # Field name -> index of the first field with the name
+        self._field_index = {}
 
         if fields:
             # Convert input to Field instances
@@ -299,10 +305,18 @@ class FieldList(object):
 
         # FIXME: deprecated: FieldList should be immutable
         field = to_field(field)
+        self._field_index.setdefault(field.name, len(self._fields))
         self._fields.append(field)
         self._field_dict[field.name] = field
         self._field_names.append(field.name)
 
+    def _reindex(self):
+        """Rebuilds the name to index map after fields were replaced or
+        removed."""
+        self._field_index = {}
+        for i, name in enumerate(self._field_names):
+            self._field_index.setdefault(name, i)
+
     def names(self, indexes=None):
         """Return names of fields in the list.
 
@@ -331,27 +345,25 @@ class FieldList(object):
 
     def index_map(self):
         """Returns a map of field name to field index"""
-        return dict( (f, i) for f, i in enumerate(self._field_names))
+        return dict(self._field_index)
 
     def mask(self, fields=None):
         """Return a list representing field selector - which fields are
         selected from a row."""
 
-        sel_names = [str(field) for field in fields]
+        sel_names = set(str(field) for field in fields)
 
-        mask = [str(name) in sel_names for name in self.names()]
+        mask = [name in sel_names for name in self._field_names]
         return mask
 
     def index(self, field):
         """Return index of a field"""
 
         try:
-            index = self._field_names.index(str(field))
-        except ValueError:
+            return self._field_index[str(field)]
+        except KeyError:
             raise NoSuchFieldError("Field list has no field with name '%s'" % str(field))
 
-        return index
-
     def fields(self, names=None, storage_type=None, analytical_type=None):
         """Return a tuple with fields. `names` specifies which fields are returned. When names is
         ``None`` all fields are returned. `storage_type` or `analytical_type`
@@ -414,6 +426,43 @@ class FieldList(object):
 
         return agg_fields
 
+    def window_fields(self, window_list):
+        """Returns a `FieldList` containing fields of window functions in the
+        `window_list` – list of tuples `(field, function, argument)` as
+        returned by :func:`prepare_window_list`. Field of a function is named
+        `field_function` or just `function` if the function has no field,
+        argument is appended if specified: `field_function_argument`.
+
+        Ranking functions (``rank``, ``dense_rank``, ``row_number``) and
+        counts have integer fields, other fields are cloned from the
+        original fields."""
+
+        window_fields = FieldList()
+
+        for field, function, argument in window_list:
+            if field is None:
+                name = function
+            else:
+                name = "%s_%s" % (str(field), function)
+
+            if argument is not None:
+                name = "%s_%s" % (name, argument)
+
+            if function in ("rank", "dense_rank", "row_number") \
+                    or function.endswith("count"):
+                field = Field(name, storage_type="integer",
+                              analytical_type="measure")
+            elif field is None:
+                raise ArgumentError("Window function '%s' requires a field"
+                                    % function)
+            else:
+                field = self.field(field).clone(name=name,
+                                                analytical_type="measure")
+
+            window_fields.append(field)
+
+        return window_fields
+
     def field(self, ref):
         """Return a field with name `ref` if `ref` is a string, or if it is an
         integer, returns a field at that index."""
@@ -439,19 +488,21 @@ class FieldList(object):
         self._fields[index] = new_field
         self._field_names[index] = new_field.name
         self._field_dict[new_field.name] = new_field
+        self._reindex()
 
     def __delitem__(self, index):
         field = self._fields[index]
         del self._field_dict[field.name]
         del self._fields[index]
         del self._field_names[index]
+        self._reindex()
 
     def __iter__(self):
         return self._fields.__iter__()
 
     def __contains__(self, field):
         if isinstance(field, str):
-            return field in self._field_names
+            return field in self._field_index
 
         return field in self._fields
 
@@ -498,6 +549,79 @@ class FieldList(object):
 
         return cloned_fields
 
+    def freeze(self):
+        """Returns a `FrozenFieldList` with the same fields."""
+        return FrozenFieldList(*self._fields)
+
+
+class FrozenFieldList(FieldList):
+    """Field list that can not be changed. The list is hashable and keeps
+    index maps and masks that were already requested. `fingerprint` is a
+    digest of the structure – names, storage and analytical types of the
+    fields – that can be used as a cache key of structure dependent
+    objects."""
+
+    def __init__(self, *fields):
+        self._frozen = False
+        super(FrozenFieldList, self).__init__(*fields)
+        self._frozen = True
+
+        self._field_names = tuple(self._field_names)
+        self._indexes_cache = {}
+        self._mask_cache = {}
+
+        structure = [(f.name, f.storage_type, f.analytical_type)
+                     for f in self._fields]
+        digest = hashlib.sha1(repr(structure).encode("utf-8"))
+        self.fingerprint = digest.hexdigest()
+
+    def _changed(self):
+        raise MetadataError("Frozen field list can not be changed")
+
+    def append(self, field):
+        if self._frozen:
+            self._changed()
+        super(FrozenFieldList, self).append(field)
+
+    def __setitem__(self, index, new_field):
+        self._changed()
+
+    def __delitem__(self, index):
+        self._changed()
+
+    def __iadd__(self, array):
+        self._changed()
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+    def names(self, indexes=None):
+        if indexes:
+            return [self._field_names[i] for i in indexes]
+        else:
+            return list(self._field_names)
+
+    def indexes(self, fields):
+        key = tuple(str(field) for field in fields)
+        try:
+            return self._indexes_cache[key]
+        except KeyError:
+            indexes = super(FrozenFieldList, self).indexes(key)
+            self._indexes_cache[key] = indexes
+            return indexes
+
+    def mask(self, fields=None):
+        key = tuple(str(field) for field in fields)
+        try:
+            return list(self._mask_cache[key])
+        except KeyError:
+            mask = super(FrozenFieldList, self).mask(key)
+            self._mask_cache[key] = tuple(mask)
+            return mask
+
+    def freeze(self):
+        return self
+
 
 class FieldFilter(object):
     """Filters fields in a stream"""
@@ -594,18 +718,25 @@ class RowFieldFilter(object):
     """Class for filtering fields in array"""
 
     def __init__(self, mask=None):
-        """Create an instance of RowFieldFilter. `mask` is a list of indexes
-        that are passed to output."""
+        """Create an instance of RowFieldFilter. `mask` is a list of flags
+        for each field whether the field is passed to output."""
         super(RowFieldFilter, self).__init__()
         self.mask = mask or []
+        self.indexes = [i for i, flag in enumerate(self.mask) if flag]
+
+        # `filter(row)` filters a `row` according to `mask` and returns a
+        # tuple. Projection is precompiled, it is called for every row.
+        if len(self.indexes) > 1:
+            self.filter = operator.itemgetter(*self.indexes)
+        elif self.indexes:
+            index = self.indexes[0]
+            self.filter = lambda row: (row[index], )
+        else:
+            self.filter = lambda row: ()
 
     def __call__(self, row):
         return self.filter(row)
 
-    def filter(self, row):
-        """Filter a `row` according to ``indexes``."""
-        return tuple(value for value,mask in zip(row, self.mask) if mask)
-
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, self.mask)
 
@@ -678,6 +809,31 @@ def prepare_order_list(fields):
 
     return prepare_tuple_list(fields, "asc")
 
+def prepare_window_list(functions):
+    """Coalesces list of window functions. Accepts a list of tuples
+    `(field, function)` or `(field, function, argument)` or just function
+    names for functions without field, such as ``rank``. Returns list of
+    tuples `(field, function, argument)`."""
+
+    if not functions:
+        return []
+
+    if isinstance(functions, str):
+        functions = [functions]
+
+    result = []
+    for obj in functions:
+        if isinstance(obj, str):
+            result.append( (None, obj, None) )
+        else:
+            field, function = obj[:2]
+            argument = obj[2] if len(obj) > 2 else None
+            if field is not None:
+                field = str(field)
+            result.append( (field, function, argument) )
+
+    return result
+
 def prepare_tuple_list(fields, default_value):
     """Coalesces list of fields to list of tuples. Accepts: a string, list of
     strings, list of tuples `(field, value)`. """
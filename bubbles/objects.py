@@ -8,12 +8,17 @@ from .errors import *
 from .extensions import Extensible, extensions
 from .metadata import *
 from .dev import required, experimental
+from collections import deque
+import threading
+import tempfile
+import pickle
 
 __all__ = [
         "DataObject",
         "IterableDataSource",
         "RowListDataObject",
         "IterableRecordsDataSource",
+        "TeeDataSource",
 
         "shared_representations",
         "data_object",
@@ -46,6 +51,16 @@ class DataObject(Extensible):
     __extension_type__ = "object"
     __extension_suffix__ = "Object"
 
+    # List of `(field, order)` tuples the rows are known to be ordered by or
+    # `None` if the order is not known. Set by operations such as `sort` and
+    # used by operations that have cheaper versions for sorted data.
+    order_by = None
+
+    # `True` if every row yielded by `rows()` is a new list that is not
+    # referenced by the object or anyone else. Consumer of such rows owns
+    # them and might modify them in place instead of copying.
+    fresh_rows = False
+
     def representations(self):
         """Returns list of representation names of this data object. Default
         implementation raises an exception, as subclasses are required to
@@ -111,9 +126,9 @@ class DataObject(Extensible):
         """Returns object's replacement which can be consumed `count` times.
         Implementation of object retention depends on the backend.
 
-        For example default iterable data object consumes the rows into a list
-        and provides data object which wraps the list and deletes the list
-        after `count` number of uses.
+        For example default iterable data object provides a
+        :class:`TeeDataSource` which shares the rows between `count` consumers
+        through a bounded buffer and spills the rest to a temporary file.
 
         .. note::
 
@@ -254,14 +269,15 @@ class IterableDataSource(DataObject):
         return True
 
     def retained(self, retain_count=1):
-        """Returns retained replacement of the receiver. Default
-        implementation consumes the iterator into a list and returns a data
-        object wrapping the list, which might leave big memory footprint on
-        larger datasets. In this case it is recommended to explicitly cache
-        the consumable object using other means.
+        """Returns retained replacement of the receiver – a
+        :class:`TeeDataSource` that can be consumed `retain_count` times.
+        Rows are shared by the consumers through a bounded buffer, rows that
+        do not fit into the buffer are spilled to a temporary file.
         """
 
-        return RowListDataObject(list(self.iterable), self.fields)
+        tee = TeeDataSource(self.iterable, self.fields, retain_count)
+        tee.order_by = self.order_by
+        return tee
 
     def filter(self, keep=None, drop=None, rename=None):
         """Returns another iterable data source with filtered fields"""
@@ -304,6 +320,190 @@ class IterableRecordsDataSource(IterableDataSource):
         return True
 
 
+"""Default number of rows held in memory by the :class:`TeeDataSource`
+before they are spilled to a temporary file."""
+DEFAULT_TEE_BUFFER_SIZE = 10000
+
+# Marks the end of the tee stream
+_END = object()
+
+class _RowTee(object):
+    def __init__(self, iterable, count, buffer_size):
+        """Shared state of `count` consumers of `iterable`. Rows are pulled
+        from the iterable by the consumer that is ahead of the others. Rows
+        that are needed by the other consumers are kept in a memory buffer
+        of `buffer_size` rows. When the buffer is full, the rows are
+        appended to a temporary spill file instead.
+
+        The stream positions are laid out as:
+
+        * ``[memory_start, memory_end)`` – rows in the memory buffer
+        * ``[memory_end, end)`` – rows in the spill file (if there is one)
+
+        Rows are removed from the memory buffer as soon as all consumers
+        read them. The spill file is removed when all consumers read all the
+        spilled rows.
+        """
+
+        self.iterator = iter(iterable)
+        self.buffer_size = buffer_size
+
+        # Consumer position. `None` means that the consumer has finished.
+        self.positions = [0] * count
+
+        self.memory = deque()
+        self.memory_start = 0
+        # Number of rows pulled from the source iterator
+        self.end = 0
+
+        self.spill = None
+        self.spill_offset = 0
+        # Consumer -> offset of the row at consumer's position
+        self.offsets = None
+
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    def next_row(self, consumer):
+        """Returns next row for `consumer` or `_END` if there are no more
+        rows."""
+
+        with self.lock:
+            position = self.positions[consumer]
+            memory_end = self.memory_start + len(self.memory)
+
+            if position < memory_end:
+                row = self.memory[position - self.memory_start]
+            elif position < self.end:
+                self.spill.seek(self.offsets[consumer])
+                row = pickle.load(self.spill)
+                self.offsets[consumer] = self.spill.tell()
+            elif self.exhausted:
+                return _END
+            else:
+                try:
+                    row = next(self.iterator)
+                except StopIteration:
+                    self.exhausted = True
+                    return _END
+
+                self.end += 1
+                self._store(consumer, row)
+
+            self.positions[consumer] = position + 1
+            self._trim()
+
+        return row
+
+    def _store(self, consumer, row):
+        """Keeps the `row` pulled by the `consumer` for the other consumers,
+        if they need it."""
+
+        needed = any(p is not None and p < self.end
+                     for i, p in enumerate(self.positions) if i != consumer)
+        if not needed:
+            # The other consumers are done – nothing to be kept
+            return
+
+        if self.spill is None and len(self.memory) < self.buffer_size:
+            self.memory.append(row)
+            return
+
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile()
+            self.spill_offset = 0
+            self.offsets = [0] * len(self.positions)
+
+        self.spill.seek(self.spill_offset)
+        pickle.dump(row, self.spill, pickle.HIGHEST_PROTOCOL)
+        self.spill_offset = self.spill.tell()
+        self.offsets[consumer] = self.spill_offset
+
+    def _trim(self):
+        """Removes rows that were read by all the consumers."""
+        active = [p for p in self.positions if p is not None]
+
+        if active:
+            low = min(active)
+        else:
+            low = self.end
+
+        while self.memory and self.memory_start < low:
+            self.memory.popleft()
+            self.memory_start += 1
+
+        if self.spill is not None and low >= self.end:
+            self.spill.close()
+            self.spill = None
+            self.offsets = None
+
+        if self.spill is None and not self.memory:
+            self.memory_start = self.end
+
+    def finish(self, consumer):
+        """Marks the `consumer` as finished."""
+        with self.lock:
+            self.positions[consumer] = None
+            self._trim()
+
+    def iterator_for(self, consumer):
+        try:
+            while True:
+                row = self.next_row(consumer)
+                if row is _END:
+                    break
+                yield row
+        finally:
+            self.finish(consumer)
+
+
+class TeeDataSource(DataObject):
+    """Data source that replays rows of an iterable to a limited number of
+    consumers. Each call to `rows()` or `records()` returns an iterator for
+    another consumer. The consumers might read the rows at different pace,
+    rows that were not yet read by all the consumers are kept in a buffer of
+    `buffer_size` rows and the rest is spilled into a temporary file. Memory
+    footprint of the object is therefore bounded regardless of size of the
+    data."""
+
+    def __init__(self, iterable, fields, count,
+                 buffer_size=DEFAULT_TEE_BUFFER_SIZE):
+        """Creates a tee of `iterable` with rows described by `fields` that
+        can be consumed `count` times."""
+
+        self.fields = fields
+        self.count = count
+        self.tee = _RowTee(iterable, count, buffer_size)
+        self._next_consumer = 0
+        self._lock = threading.Lock()
+
+    def representations(self):
+        return ["rows", "records"]
+
+    def rows(self):
+        with self._lock:
+            consumer = self._next_consumer
+            if consumer >= self.count:
+                raise ConsumedError("Retained object was already consumed "
+                                    "%d times" % self.count)
+            self._next_consumer += 1
+
+        return self.tee.iterator_for(consumer)
+
+    def records(self):
+        names = [str(field) for field in self.fields]
+        for row in self.rows():
+            yield dict(zip(names, row))
+
+    def is_consumable(self):
+        return True
+
+    def retained(self, retain_count=1):
+        tee = TeeDataSource(self.rows(), self.fields, retain_count)
+        tee.order_by = self.order_by
+        return tee
+
+
 class RowListDataObject(DataObject):
     """Wrapped Python list that serves as data source or data target. The list
     content are "rows" – lists of values corresponding to `fields`.
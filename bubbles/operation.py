@@ -9,6 +9,7 @@ from collections import OrderedDict, namedtuple
 from .dev import is_experimental
 
 import itertools
+import functools
 import inspect
 
 __all__ = (
@@ -21,6 +22,7 @@ __all__ = (
 
 Operand = namedtuple("Operand", ["rep", "islist", "isany"])
 
+@functools.lru_cache(maxsize=None)
 def rep_to_operand(rep):
     """Converts representation to `Operand` definition"""
 
@@ -188,6 +190,9 @@ class Operation(object):
         self.parameters = parameters
 
         self.registry = OrderedDict()
+        # Incremented on each registration, used to validate cached
+        # resolution orders
+        self.revision = 0
 
         self.experimental = False
 
@@ -253,6 +258,7 @@ class Operation(object):
                                     % (self.opcount + 1, func.__name__))
 
             self.registry[sig] = func
+            self.revision += 1
             func.__name__ = self.name
             return func
 
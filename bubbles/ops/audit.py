@@ -4,6 +4,7 @@ from ..metadata import *
 from ..operation import operation
 from ..prototypes import *
 from ..datautil import guess_type
+from ..sketches import HyperLogLog
 
 class BasicAuditProbe(object):
     def __init__(self, key=None, distinct_threshold=10):
@@ -14,6 +15,7 @@ class BasicAuditProbe(object):
 
         self.distinct_values = set()
         self.distinct_overflow = False
+        self.distinct_sketch = None
         self.storage_types = set()
 
         self.null_count = 0
@@ -56,12 +58,20 @@ class BasicAuditProbe(object):
             probe.probe(value)
 
     def _probe_distinct(self, value):
-        """"""
-        if self.distinct_overflow:
+        """Collects distinct values up to the `distinct_threshold`. Values
+        over the threshold are counted approximately with a HyperLogLog
+        sketch."""
+
+        # We are not testing lists, dictionaries and other values that can
+        # not be hashed
+        try:
+            hash(value)
+        except TypeError:
             return
 
-        # We are not testing lists, dictionaries and object IDs
-        storage_type = value.__class__
+        if self.distinct_overflow:
+            self.distinct_sketch.add(value)
+            return
 
         if not self.distinct_threshold or \
                 len(self.distinct_values) < self.distinct_threshold:
@@ -72,6 +82,9 @@ class BasicAuditProbe(object):
                 pass
         else:
             self.distinct_overflow = True
+            self.distinct_sketch = HyperLogLog()
+            self.distinct_sketch.update(self.distinct_values)
+            self.distinct_sketch.add(value)
 
     def finalize(self, record_count = None):
         if record_count:
@@ -107,10 +120,12 @@ class BasicAuditProbe(object):
         }
 
         d["distinct_overflow"] = self.distinct_overflow
-        d["distinct_count"] = len(self.distinct_values)
         if self.distinct_overflow:
+            # Estimated count
+            d["distinct_count"] = self.distinct_sketch.count()
             d["distinct_values"] = []
         else:
+            d["distinct_count"] = len(self.distinct_values)
             d["distinct_values"] = list(self.distinct_values)
 
         return d
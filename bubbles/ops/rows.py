@@ -3,8 +3,14 @@
 import itertools
 import functools
 import operator
+import heapq
+import tempfile
+import pickle
 import sys
-from collections import OrderedDict, namedtuple
+import re
+import math
+import random
+from collections import OrderedDict, namedtuple, deque
 from ..metadata import *
 from ..common import get_logger
 from ..errors import *
@@ -13,13 +19,14 @@ from ..objects import *
 from ..dev import experimental
 from ..prototypes import *
 from ..datautil import to_bool
+from ..sketches import HyperLogLog, TDigest
+from ..expression import PythonRowCompiler
 
 from datetime import datetime
 from time import strptime
 from base64 import b64decode
 import json
 
-# FIXME: add cheaper version for already sorted data
 # FIXME: BasicAuditProbe was removed
 
 __all__ = ()
@@ -34,6 +41,142 @@ def unary_iterator(func):
 
     return decorator
 
+#############################################################################
+# Row Stages
+#
+# Simple per-row operations – filters and field conversions – are not
+# wrapping the source iterator with another generator. They are described as
+# row stages instead. Adjacent stages are fused into one generated loop that
+# is executed when the rows are requested. The row is copied at most once in
+# the loop – only before the first stage that modifies the row in place and
+# only if the loop does not own the row yet. The loop owns rows of sources
+# with `fresh_rows` and rows created by a `fresh` map stage.
+#
+# Stage kinds:
+#
+# * ``filter`` – `code` is an expression, the row is passed further only
+#   when the expression is true
+# * ``map`` – `code` is an expression that evaluates to a new row. If
+#   `fresh` is ``True``, then the new row is a list owned by the loop and
+#   further stages might modify it in place
+# * ``update`` – `code` is a block of statements that modify the `row` in
+#   place
+#
+# The code refers to the current row as `row` and to the stage argument as
+# `arg`.
+
+RowStage = namedtuple("RowStage", ["kind", "code", "arg", "fresh"])
+
+def row_stage(kind, code, arg=None, fresh=False):
+    return RowStage(kind, code, arg, fresh)
+
+# Maximal number of generated loop functions kept for reuse
+FUSED_LOOP_CACHE_SIZE = 256
+
+def _owns_rows(stages, owned=False):
+    """Returns `True` if rows after `stages` are owned by the loop. `owned`
+    is ownership of the source rows."""
+    for stage in stages:
+        if stage.kind == "map":
+            owned = stage.fresh
+        elif stage.kind == "update":
+            owned = True
+    return owned
+
+def _compile_loop(stages, owned=False):
+    """Returns a generator function `fused(rows, arg0, arg1, ...)` that
+    applies the `stages` to the rows. If `owned` is ``True`` then the source
+    rows are lists that can be modified in place."""
+
+    stages = tuple((stage.kind, stage.code, stage.fresh) for stage in stages)
+    return _generate_loop(stages, owned)
+
+@functools.lru_cache(maxsize=FUSED_LOOP_CACHE_SIZE)
+def _generate_loop(stages, owned):
+    """Generates the loop function for `stages`, tuples of stage kind, code
+    and freshness. Generated functions are cached as the stage code embeds
+    field indexes and literals."""
+
+    args = ["arg%d" % i for i in range(len(stages))]
+    lines = ["def fused(rows, %s):" % ", ".join(args),
+             "    for row in rows:"]
+
+    for arg, (kind, code, fresh) in zip(args, stages):
+        code = re.sub(r"\barg\b", arg, code)
+
+        if kind == "filter":
+            lines.append("        if not (%s):" % code)
+            lines.append("            continue")
+        elif kind == "map":
+            lines.append("        row = %s" % code)
+            owned = fresh
+        elif kind == "update":
+            if not owned:
+                lines.append("        row = list(row)")
+                owned = True
+            for line in code.splitlines():
+                lines.append("        " + line)
+        else:
+            raise ArgumentError("Unknown row stage kind '%s'" % kind)
+
+    lines.append("        yield row")
+
+    namespace = {}
+    code = compile("\n".join(lines), "<fused rows>", "exec")
+    exec(code, namespace)
+    return namespace["fused"]
+
+
+class FusedRowsDataSource(IterableDataSource):
+    """Iterable data source that applies a chain of row stages on rows of
+    the `source` object in one loop."""
+
+    def __init__(self, source, fields, stages):
+        self.source = source
+        self.fields = fields
+        self.stages = tuple(stages)
+        self._iterable = None
+
+    @property
+    def iterable(self):
+        if self._iterable is None:
+            loop = _compile_loop(self.stages, self.source.fresh_rows)
+            args = [stage.arg for stage in self.stages]
+            self._iterable = loop(self.source.rows(), *args)
+
+        return self._iterable
+
+    @property
+    def fresh_rows(self):
+        return _owns_rows(self.stages, self.source.fresh_rows)
+
+    def is_fusable(self):
+        """Returns `True` if another stage can be fused into the receiver –
+        when the rows were not requested yet."""
+        return self._iterable is None
+
+
+def fused(obj, stage, fields=None):
+    """Returns an object that applies row `stage` to rows of `obj`. If `obj`
+    is an object with not yet consumed row stages, then the `stage` is
+    appended to the chain. If `fields` are not specified, then fields of
+    `obj` are used."""
+
+    if fields is None:
+        fields = obj.fields.clone()
+
+    if isinstance(obj, FusedRowsDataSource) and obj.is_fusable():
+        result = FusedRowsDataSource(obj.source, fields,
+                                     obj.stages + (stage, ))
+    else:
+        result = FusedRowsDataSource(obj, fields, (stage, ))
+
+    # Filters keep the order of rows
+    if stage.kind == "filter":
+        result.order_by = obj.order_by
+
+    return result
+
 #############################################################################
 # Metadata Operations
 
@@ -52,30 +195,24 @@ _default_type_converters = {
 
 @retype.register("rows")
 def _(ctx, obj, typemap):
-    def converter(converters, iterator):
-        for row in iterator:
-            result = []
-            for conv, value in zip(converters, row):
-                if conv:
-                    result.append(conv(value))
-                else:
-                    result.append(value)
-            yield result
-
     fields = FieldList()
     converters = []
-    for field in obj.fields:
+    values = []
+    for i, field in enumerate(obj.fields):
         new_type = typemap.get(field.name)
         if new_type and new_type != field.storage_type:
-            conv = _default_type_converters[new_type]
+            converters.append(_default_type_converters[new_type])
+            values.append("arg[%d](row[%d])" % (len(converters) - 1, i))
         else:
-            conv = None
-        converters.append(conv)
+            values.append("row[%d]" % i)
 
         field = field.clone(storage_type=new_type or field.storage_type)
         fields.append(field)
 
-    return IterableDataSource(converter(converters, obj), fields)
+    code = "[%s]" % ", ".join(values)
+    stage = row_stage("map", code, converters, fresh=True)
+
+    return fused(obj, stage, fields)
 
 @field_filter.register("rows")
 def _(ctx, iterator, keep=None, drop=None, rename=None, filter=None):
@@ -92,11 +229,12 @@ def _(ctx, iterator, keep=None, drop=None, rename=None, filter=None):
         field_filter = FieldFilter(keep=keep, drop=drop, rename=rename)
 
     row_filter = field_filter.row_filter(iterator.fields)
-
-    new_iterator = map(row_filter, iterator)
     new_fields = field_filter.filter(iterator.fields)
 
-    return IterableDataSource(new_iterator, new_fields)
+    # Projection to a new list – following stages can modify it in place
+    code = "[%s]" % ", ".join("row[%d]" % i for i in row_filter.indexes)
+
+    return fused(iterator, row_stage("map", code, fresh=True), new_fields)
 
 
 #############################################################################
@@ -104,7 +242,6 @@ def _(ctx, iterator, keep=None, drop=None, rename=None, filter=None):
 
 
 @filter_by_value.register("rows")
-@unary_iterator
 def _(ctx, iterator, key, value, discard=False):
     """Select rows where value of `field` belongs to the set of `values`. If
     `discard` is ``True`` then the matching rows are discarded instead
@@ -114,14 +251,13 @@ def _(ctx, iterator, key, value, discard=False):
     index = fields.index(str(key))
 
     if discard:
-        predicate = lambda row: row[index] != value
+        code = "row[%d] != arg" % index
     else:
-        predicate = lambda row: row[index] == value
+        code = "row[%d] == arg" % index
 
-    return filter(predicate, iterator)
+    return fused(iterator, row_stage("filter", code, value))
 
 @filter_by_set.register("rows")
-@unary_iterator
 def _(ctx, iterator, field, values, discard=False):
     """Select rows where value of `field` belongs to the set of `values`. If
     `discard` is ``True`` then the matching rows are discarded instead
@@ -133,14 +269,13 @@ def _(ctx, iterator, field, values, discard=False):
     values = set(values)
 
     if discard:
-        predicate = lambda row: row[index] not in values
+        code = "row[%d] not in arg" % index
     else:
-        predicate = lambda row: row[index] in values
+        code = "row[%d] in arg" % index
 
-    return filter(predicate, iterator)
+    return fused(iterator, row_stage("filter", code, values))
 
 @filter_by_range.register("rows")
-@unary_iterator
 def _(ctx, iterator, field, low, high, discard=False):
     """Select rows where value `low` <= `field` <= `high`. If
     `discard` is ``True`` then the matching rows are discarded instead
@@ -150,49 +285,41 @@ def _(ctx, iterator, field, low, high, discard=False):
     fields = iterator.fields
     index = fields.index(field)
 
-    if discard:
-        if high is None and low is not None:
-            predicate = lambda row: not (low <= row[index])
-        elif low is None and high is not None:
-            predicate = lambda row: not (row[index] <= high)
-        else:
-            predicate = lambda row: not (low <= row[index] <= high)
+    if high is None and low is not None:
+        code = "arg[0] <= row[%d]" % index
+    elif low is None and high is not None:
+        code = "row[%d] <= arg[1]" % index
     else:
-        if high is None and low is not None:
-            predicate = lambda row: low <= row[index]
-        elif low is None and high is not None:
-            predicate = lambda row: row[index] <= high
-        else:
-            predicate = lambda row: low <= row[index] <= high
+        code = "arg[0] <= row[%d] <= arg[1]" % index
+
+    if discard:
+        code = "not (%s)" % code
 
-    return filter(predicate, iterator)
+    return fused(iterator, row_stage("filter", code, (low, high)))
 
 @filter_not_empty.register("rows")
-@unary_iterator
 def _(ctx, iterator, field):
     """Select rows where value of `field` is not None"""
 
     fields = iterator.fields
     index = fields.index(field)
 
-    predicate = lambda row: row[index] is not None
+    code = "row[%d] is not None" % index
 
-    return filter(predicate, iterator)
+    return fused(iterator, row_stage("filter", code))
 
 @filter_empty.register("rows")
-@unary_iterator
 def _(ctx, iterator, field):
     """Select rows where value of `field` is None or empty string"""
 
     fields = iterator.fields
     index = fields.index(field)
 
-    predicate = lambda row: row[index] is None or row[index] == ""
+    code = "row[{0}] is None or row[{0}] == ''".format(index)
 
-    return filter(predicate, iterator)
+    return fused(iterator, row_stage("filter", code))
 
 @filter_by_predicate.register("rows")
-@unary_iterator
 def _(ctx, obj, predicate, fields, discard=False,
                         **kwargs):
     """Returns an interator selecting fields where `predicate` is true.
@@ -200,61 +327,167 @@ def _(ctx, obj, predicate, fields, discard=False,
     to be passed to the function (in that order). `kwargs` are additional key
     arguments to the predicate function."""
 
-    def iterator(indexes):
-        for row in iter(obj):
-            values = [row[index] for index in indexes]
-            flag = predicate(*values, **kwargs)
-            if (flag and not discard) or (not flag and discard):
-                yield row
+    def row_predicate(row):
+        values = [row[index] for index in indexes]
+        return predicate(*values, **kwargs)
 
     key = prepare_key(fields)
     indexes = obj.fields.indexes(key)
 
-    return iterator(indexes)
+    if discard:
+        code = "not arg(row)"
+    else:
+        code = "arg(row)"
+
+    return fused(obj, row_stage("filter", code, row_predicate))
+
+
+class _RowStageCompiler(PythonRowCompiler):
+    """Compiles expression into code of a row stage. Literals are passed to
+    the stage as the stage argument, so expressions that differ only in
+    values share the generated loop."""
+
+    def __init__(self):
+        super(_RowStageCompiler, self).__init__()
+        self.literals = []
+
+    def compile_literal(self, context, literal):
+        self.literals.append(literal)
+        return "arg[%d]" % (len(self.literals) - 1)
+
+@filter_expression.register("rows")
+def _(ctx, obj, expression, discard=False):
+    """Select rows where `expression` is true, for example ``amount > 100
+    and year >= 2012``. Variables of the expression are field names. The
+    expression is compiled into Python code once and evaluated without
+    function calls per row. If `discard` is ``True`` then the matching
+    rows are discarded instead.
+
+    Empty values (``None``) are unknown as ``NULL`` in SQL: rows where the
+    expression is unknown are neither selected nor kept with `discard`."""
+
+    compiler = _RowStageCompiler()
+    code = compiler.compile(expression, obj.fields)
+
+    if discard:
+        code = "(__result := %s) is not None and not __result" % code
+
+    return fused(obj, row_stage("filter", code, tuple(compiler.literals)))
 
 
 @filter_by_predicate.register("records")
-def _(ctx, iterator, predicate, fields, discard=False,
+def _(ctx, obj, predicate, fields, discard=False,
                         **kwargs):
     """Returns an interator selecting fields where `predicate` is true.
     `predicate` should be a python callable. `arg_fields` are names of fields
     to be passed to the function (in that order). `kwargs` are additional key
     arguments to the predicate function."""
 
-    for record in iterator:
-        args = [record[str(f)] for f in fields]
-        flag = predicate(*args, **kwargs)
-        if (flag and not discard) or (not flag and discard):
-            yield record
+    def iterator():
+        for record in obj.records():
+            args = [record[str(f)] for f in fields]
+            flag = predicate(*args, **kwargs)
+            if (flag and not discard) or (not flag and discard):
+                yield record
 
+    return IterableRecordsDataSource(iterator(), obj.fields.clone())
 
-@distinct.register("rows")
-def _(ctx, obj, key=None, is_sorted=False):
-    """Return distinct `keys` from `iterator`. `iterator` does
-    not have to be sorted. If iterator is sorted by the keys and
-    `is_sorted` is ``True`` then more efficient version is used."""
-    # TODO: remove is_sorted hint, objects should store metadata about
-    # that
 
-    def iterator(row_filter):
-        if is_sorted:
-            last_key = object()
+# Distinct Rows
+# =============
+#
+# If rows are sorted by the key, then rows of the same key are adjacent and
+# are grouped with `itertools.groupby`. Otherwise keys that were already seen
+# are kept in a set. When the set has more than `buffer_size` keys, the
+# seen keys and the rest of the rows are partitioned by the key hash into
+# temporary files and each partition is deduplicated separately. A partition
+# that has more than `buffer_size` distinct keys as well is partitioned
+# again with a different hash. Order of the rows after the spill is not
+# preserved.
+
+DEFAULT_DISTINCT_BUFFER_SIZE = 1000000
+
+# Number of partitions for spilled distinct keys
+_DISTINCT_PARTITIONS = 32
+
+# Maximal depth of re-partitioning of spilled rows. Partitions at this level
+# are processed in memory regardless of their size.
+_MAX_SPILL_LEVEL = 5
+
+def _partition_index(key, level, count):
+    """Returns partition index of `key` at re-partitioning `level`. The hash
+    is salted with the level, so that keys of one partition are distributed
+    into different partitions at the next level."""
+    if level:
+        return hash((level, key)) % count
+    else:
+        return hash(key) % count
 
-            # FIXME: use itertools equivalent
-            for row in obj:
-                key_tuple = (row_filter(row))
-                if key_tuple != last_key:
-                    yield key_tuple
+def unique_rows(rows, key, is_sorted=False, buffer_size=None):
+    """Yields tuples (`row`, `is_first`) for every row, where `is_first` is
+    ``True`` if the row is the first one with its key. `key` is a function
+    that returns a hashable key of a row. If `is_sorted` is ``True`` then
+    rows are expected to be sorted (grouped) by the key."""
 
+    if is_sorted:
+        for group_key, group in itertools.groupby(rows, key):
+            yield (next(group), True)
+            for row in group:
+                yield (row, False)
+        return
+
+    buffer_size = buffer_size or DEFAULT_DISTINCT_BUFFER_SIZE
+    items = ((False, row) for row in rows)
+    yield from _unique_items(items, key, buffer_size, 0)
+
+def _unique_items(items, key, buffer_size, level):
+    """Yields tuples (`row`, `is_first`) for `items` – tuples (`is_key`,
+    `item`) where `item` is a row or, if `is_key` is ``True``, a key that
+    was already seen. Keys precede the rows."""
+
+    items = iter(items)
+    seen = set()
+
+    for is_key, item in items:
+        if is_key:
+            seen.add(item)
         else:
-            distinct_values = set()
-            for row in obj:
-                # Construct key tuple from distinct fields
-                key_tuple = tuple(row_filter(row))
-                if key_tuple not in distinct_values:
-                    distinct_values.add(key_tuple)
-                    yield key_tuple
+            row_key = key(item)
+            if row_key in seen:
+                yield (item, False)
+                continue
+            seen.add(row_key)
+            yield (item, True)
 
+        if len(seen) >= buffer_size and level < _MAX_SPILL_LEVEL:
+            break
+    else:
+        return
+
+    # Spill: every partition starts with the keys that were already seen,
+    # followed by the remaining items of the partition in the input order.
+    partitions = _SpillPartitions(_DISTINCT_PARTITIONS)
+    try:
+        for row_key in seen:
+            index = _partition_index(row_key, level, _DISTINCT_PARTITIONS)
+            partitions.add(index, (True, row_key))
+        seen = None
+
+        for is_key, item in items:
+            row_key = item if is_key else key(item)
+            index = _partition_index(row_key, level, _DISTINCT_PARTITIONS)
+            partitions.add(index, (is_key, item))
+
+        for index in range(_DISTINCT_PARTITIONS):
+            yield from _unique_items(partitions.read(index), key,
+                                     buffer_size, level + 1)
+    finally:
+        partitions.close()
+
+def _distinct_key(obj, key):
+    """Returns tuple (`fields`, `getter`) of key fields in order of the
+    object fields and a function that returns key tuple of a row. All fields
+    are used if `key` is not specified."""
     fields = obj.fields
     if key:
         key = prepare_key(key)
@@ -264,79 +497,214 @@ def _(ctx, obj, key=None, is_sorted=False):
 
     # Retain original order of fields
     fields = FieldList(*row_filter(obj.fields))
+    getter = _values_getter(obj.fields.indexes(fields))
+
+    return (fields, getter)
+
+@distinct.register("rows")
+def _(ctx, obj, key=None, is_sorted=False, buffer_size=None):
+    """Return distinct `keys` from `iterator`. `iterator` does
+    not have to be sorted. If iterator is sorted by the keys – `is_sorted` is
+    ``True`` or the object is known to be ordered by the keys – then a
+    streaming version is used. Otherwise at most `buffer_size` keys are kept
+    in memory, the rest is spilled to temporary files."""
+
+    def iterator():
+        for row, is_first in unique_rows(obj.rows(), getter, sorted_,
+                                         buffer_size):
+            if is_first:
+                yield getter(row)
+
+    fields, getter = _distinct_key(obj, key)
+    ordered = is_ordered_by(obj, fields.names())
+    sorted_ = is_sorted or ordered
+
+    result = IterableDataSource(iterator(), fields)
+    if ordered:
+        result.order_by = obj.order_by[:len(fields)]
 
-    return IterableDataSource(iterator(row_filter), fields)
+    return result
 
 
 @distinct_rows.register("rows")
-@unary_iterator
-def _(ctx, obj, key=None, is_sorted=False):
+def _(ctx, obj, key=None, is_sorted=False, buffer_size=None):
     """Return distinct rows based on `key` from `iterator`. `iterator`
     does not have to be sorted. If iterator is sorted by the keys and
-    `is_sorted` is ``True`` then more efficient version is used."""
-    # TODO: remove is_sorted hint, objects should store metadata about
-    # that
+    `is_sorted` is ``True`` then more efficient version is used. See
+    `distinct` for more information."""
 
-    fields = obj.fields
-    if key:
-        key = prepare_key(key)
-        row_filter = FieldFilter(keep=key).row_filter(fields)
-    else:
-        row_filter = FieldFilter().row_filter(fields)
+    def iterator():
+        for row, is_first in unique_rows(obj.rows(), getter, sorted_,
+                                         buffer_size):
+            if is_first:
+                yield row
 
-    if is_sorted:
-        last_key = object()
+    fields, getter = _distinct_key(obj, key)
+    ordered = is_ordered_by(obj, fields.names())
+    sorted_ = is_sorted or ordered
 
-        # FIXME: use itertools equivalent
-        for value in obj:
-            key_tuple = (row_filter(row))
-            if key_tuple != last_key:
-                yield row
+    result = IterableDataSource(iterator(), obj.fields.clone())
+    if sorted_:
+        result.order_by = obj.order_by
 
-    else:
-        distinct_values = set()
-        for row in obj:
-            # Construct key tuple from distinct fields
-            key_tuple = tuple(row_filter(row))
-            if key_tuple not in distinct_values:
-                distinct_values.add(key_tuple)
-                yield row
+    return result
 
 
 @first_unique.register("rows")
-@unary_iterator
-def _(ctx, iterator, keys=None, discard=False):
+def _(ctx, obj, keys=None, discard=False, is_sorted=False, buffer_size=None):
     """Return rows that are unique by `keys`. If `discard` is `True` then the
-    action is reversed and duplicate rows are returned."""
+    action is reversed and duplicate rows are returned. See `distinct` for
+    description of `is_sorted` and `buffer_size`."""
 
-    # FIXME: add is_sorted version
-    # FIXME: use prepare key
+    def iterator():
+        for row, is_first in unique_rows(obj.rows(), getter, sorted_,
+                                         buffer_size):
+            # If discard is true, the first found row is discarded and the
+            # duplicates are passed
+            if is_first != discard:
+                yield row
 
-    row_filter = FieldFilter(keep=keys).row_filter(iterator.fields)
+    fields, getter = _distinct_key(obj, keys)
+    ordered = is_ordered_by(obj, fields.names())
+    sorted_ = is_sorted or ordered
 
-    distinct_values = set()
+    result = IterableDataSource(iterator(), obj.fields.clone())
+    if sorted_:
+        result.order_by = obj.order_by
 
-    for row in iterator:
-        # Construct key tuple from distinct fields
-        key_tuple = tuple(row_filter(row))
+    return result
 
-        if key_tuple not in distinct_values:
-            distinct_values.add(key_tuple)
-            if not discard:
-                yield row
-        else:
-            if discard:
-                # We already have one found record, which was discarded
-                # (because discard is true), now we pass duplicates
-                yield row
 
+# Random Sampling
+# ===============
+#
+# Reservoir sampling uses Algorithm L: after the reservoir is filled, number
+# of rows to skip until the next replacement is drawn from a geometric
+# distribution, so the skipped rows are only passed through and the number of
+# random draws is proportional to size·log(n/size). Bernoulli sampling draws
+# the gaps between selected rows in the same way.
+#
+# Sampled rows are returned in their input order.
+
+def _random_open(rng):
+    """Returns random number from the open interval (0, 1)"""
+    value = rng.random()
+    while not value:
+        value = rng.random()
+    return value
+
+def _reservoir_skip(rng, w):
+    # Number of rows skipped before the next replacement
+    if w >= 1.0:
+        return 0
+    return int(math.log(_random_open(rng)) / math.log1p(-w))
+
+def reservoir_sample(rows, size, rng):
+    """Yields uniform random sample of `size` rows from `rows` in one pass.
+    `rng` is a `random.Random` instance."""
+
+    rows = iter(rows)
+    reservoir = list(enumerate(itertools.islice(rows, size)))
+
+    if len(reservoir) == size and size > 0:
+        w = math.exp(math.log(_random_open(rng)) / size)
+        index = size - 1
+
+        while True:
+            skip = _reservoir_skip(rng, w)
+            index += skip + 1
+            row = next(itertools.islice(rows, skip, None), _EMPTY)
+            if row is _EMPTY:
+                break
+
+            reservoir[rng.randrange(size)] = (index, row)
+            w *= math.exp(math.log(_random_open(rng)) / size)
+
+        reservoir.sort(key=operator.itemgetter(0))
+
+    for index, row in reservoir:
+        yield row
+
+def bernoulli_sample(rows, probability, rng):
+    """Yields each row from `rows` with `probability`. `rng` is a
+    `random.Random` instance."""
+
+    if probability >= 1:
+        yield from rows
+        return
+    elif probability <= 0:
+        return
+
+    rows = iter(rows)
+    log_q = math.log1p(-probability)
+
+    while True:
+        skip = int(math.log(_random_open(rng)) / log_q)
+        row = next(itertools.islice(rows, skip, None), _EMPTY)
+        if row is _EMPTY:
+            break
+        yield row
+
+def stratified_sample(rows, key, size, rng):
+    """Yields uniform random sample of at most `size` rows for each distinct
+    value of `key(row)`. Only reservoirs of the strata are kept in memory.
+    `rng` is a `random.Random` instance."""
+
+    if size <= 0:
+        return
+
+    # key -> [reservoir, count, w, next replaced count]
+    strata = {}
+
+    for index, row in enumerate(rows):
+        row_key = key(row)
+        try:
+            stratum = strata[row_key]
+        except KeyError:
+            stratum = strata[row_key] = [[], 0, None, None]
+
+        reservoir = stratum[0]
+        stratum[1] += 1
+        count = stratum[1]
+
+        if count <= size:
+            reservoir.append((index, row))
+            if count == size:
+                stratum[2] = w = math.exp(math.log(_random_open(rng)) / size)
+                stratum[3] = count + _reservoir_skip(rng, w) + 1
+        elif count == stratum[3]:
+            reservoir[rng.randrange(size)] = (index, row)
+            stratum[2] = w = stratum[2] * math.exp(math.log(_random_open(rng))
+                                                   / size)
+            stratum[3] = count + _reservoir_skip(rng, w) + 1
+
+    sample = []
+    for stratum in strata.values():
+        sample += stratum[0]
+    sample.sort(key=operator.itemgetter(0))
+
+    for index, row in sample:
+        yield row
 
 @sample.register("rows")
 @unary_iterator
-def _(ctx, iterator, value, discard=False, mode="first"):
+def _(ctx, iterator, value, discard=False, mode="first", key=None,
+      seed=None):
     """Returns sample from the iterator. If `mode` is ``first`` (default),
     then `value` is number of first records to be returned. If `mode` is
-    ``nth`` then one in `value` records is returned."""
+    ``nth`` then one in `value` records is returned.
+
+    Random modes: ``random`` returns `value` rows chosen uniformly at random
+    (reservoir sampling), ``bernoulli`` returns each row with probability
+    `value` and ``stratified`` returns `value` random rows for each distinct
+    `key`. `seed` is a seed of the random generator for reproducible
+    samples. `discard` is not supported by ``random`` and ``stratified``
+    modes."""
+
+    if mode in ("random", "stratified") and discard:
+        raise ArgumentError("Sample mode '%s' can not discard" % mode)
+
+    rng = random.Random(seed)
 
     if mode == "first":
         if discard:
@@ -345,13 +713,21 @@ def _(ctx, iterator, value, discard=False, mode="first"):
             return itertools.islice(iterator, value)
     elif mode == "nth":
         if discard:
-            return discard_nth(iterator, value)
+            return (row for i, row in enumerate(iterator) if i % value != 0)
         else:
             return itertools.islice(iterator, None, None, value)
     elif mode == "random":
-        raise NotImplementedError("random sampling is not yet implemented")
+        return reservoir_sample(iterator.rows(), value, rng)
+    elif mode == "bernoulli":
+        probability = 1 - value if discard else value
+        return bernoulli_sample(iterator.rows(), probability, rng)
+    elif mode == "stratified":
+        if not key:
+            raise ArgumentError("Stratified sample requires a key")
+        key_getter = _values_getter(iterator.fields.indexes(prepare_key(key)))
+        return stratified_sample(iterator.rows(), key_getter, value, rng)
     else:
-        raise Exception("Unknown sample mode '%s'" % mode)
+        raise ArgumentError("Unknown sample mode '%s'" % mode)
 
 
 @unary_iterator
@@ -364,53 +740,373 @@ def discard_nth_base(ctx, iterator, step):
 discard_nth.register("rows")(discard_nth_base)
 discard_nth.register("records")(discard_nth_base)
 
-@sort.register("rows")
-@unary_iterator
-def _(ctx, obj, orderby):
-    iterator = obj.rows()
+# Number of rows sorted in memory. Larger inputs are sorted in runs of this
+# size that are spilled to temporary files and merged.
+DEFAULT_SORT_BUFFER_SIZE = 1000000
 
-    orderby = prepare_order_list(orderby)
+# Maximal number of runs merged at once
+_MAX_MERGE_RUNS = 64
+
+# Number of rows pickled together into a sorted run file
+_RUN_BLOCK_SIZE = 1000
+
+class _Reversed(object):
+    """Wrapper of a value that reverses the ordering. Used for descending
+    parts of a composite sort key."""
+    __slots__ = ("value", )
+
+    def __init__(self, value):
+        self.value = value
 
-    for field, order in reversed(orderby):
-        index = obj.fields.index(field)
+    def __lt__(self, other):
+        return other.value < self.value
 
+    def __gt__(self, other):
+        return other.value > self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def sort_key(fields, orderby):
+    """Returns a tuple (`key`, `reverse`) for sorting rows with `fields`
+    according to `orderby` list of `(field, order)` tuples. `key` is a
+    function that returns sort key of a row. Rows are equal if `orderby` is
+    empty."""
+
+    if not orderby:
+        return (lambda row: (), False)
+
+    indexes = []
+    descending = []
+    for field, order in orderby:
+        order = order.lower()
         if order.startswith("asc"):
-            reverse = False
+            descending.append(False)
         elif order.startswith("desc"):
-            reverse = True
+            descending.append(True)
         else:
-            raise ValueError("Unknown order %s for column %s") % (order, column)
+            raise ArgumentError("Unknown order %s for field %s"
+                                % (order, field))
+        indexes.append(fields.index(field))
+
+    if all(descending) or not any(descending):
+        return (operator.itemgetter(*indexes), all(descending))
+
+    orders = list(zip(indexes, descending))
+
+    def key(row):
+        return tuple(_Reversed(row[i]) if desc else row[i]
+                     for i, desc in orders)
+
+    return (key, False)
+
+def _write_run(rows):
+    """Writes sorted `rows` into a temporary file and returns the file."""
+    run = tempfile.TemporaryFile()
+    for i in range(0, len(rows), _RUN_BLOCK_SIZE):
+        pickle.dump(rows[i:i + _RUN_BLOCK_SIZE], run,
+                    pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+def _read_run(run):
+    """Yields rows from a sorted run file"""
+    while True:
+        try:
+            block = pickle.load(run)
+        except EOFError:
+            return
+        yield from block
+
+def sorted_rows(rows, key, reverse=False, buffer_size=None):
+    """Returns a generator of sorted `rows`. If there is more than
+    `buffer_size` rows, then the rows are sorted in runs that are spilled to
+    temporary files and merged afterwards. The sort is stable."""
+
+    buffer_size = buffer_size or DEFAULT_SORT_BUFFER_SIZE
+    rows = iter(rows)
+
+    chunk = list(itertools.islice(rows, buffer_size))
+    chunk.sort(key=key, reverse=reverse)
+
+    if len(chunk) < buffer_size:
+        yield from chunk
+        return
+
+    runs = [_write_run(chunk)]
+    chunk = None
+
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, buffer_size))
+            if not chunk:
+                break
+            chunk.sort(key=key, reverse=reverse)
+            runs.append(_write_run(chunk))
+        chunk = None
+
+        # Merge the runs in several passes if there are too many of them.
+        # Merged run replaces the first runs to keep the sort stable.
+        while len(runs) > _MAX_MERGE_RUNS:
+            merged = runs[:_MAX_MERGE_RUNS]
+            iterators = [_read_run(run) for run in merged]
+            merged_rows = heapq.merge(*iterators, key=key, reverse=reverse)
+
+            run = tempfile.TemporaryFile()
+            for block in iter(lambda: list(itertools.islice(merged_rows,
+                                                  _RUN_BLOCK_SIZE)), []):
+                pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+
+            for old in merged:
+                old.close()
+            runs = [run] + runs[_MAX_MERGE_RUNS:]
+
+        iterators = [_read_run(run) for run in runs]
+        yield from heapq.merge(*iterators, key=key, reverse=reverse)
+
+    finally:
+        for run in runs:
+            run.close()
+
+@sort.register("rows")
+def _(ctx, obj, orderby, buffer_size=None):
+    """Returns rows sorted by `orderby` – list of `(field, order)` tuples.
+    Rows are sorted in a single pass by a composite key. If there are more
+    than `buffer_size` rows, then sorted runs are spilled into temporary
+    files and merged."""
+
+    orderby = prepare_order_list(orderby)
+    if not orderby:
+        return obj
 
-        iterator = sorted(iterator, key=operator.itemgetter(index),
-                                    reverse=reverse)
+    key, reverse = sort_key(obj.fields, orderby)
 
-    return iterator
+    iterator = sorted_rows(obj.rows(), key, reverse, buffer_size)
+
+    result = IterableDataSource(iterator, obj.fields.clone())
+    result.order_by = orderby
+
+    return result
+
+
+# Top N
+# =====
+#
+# Each group keeps a heap of its best `n` rows. The heap is inverted – its
+# first item is the worst kept row – so a new row replaces it only if it is
+# better. Rank of a row is its sort key followed by its position in the
+# input, therefore rows of equal sort key are kept in the input order.
+
+def _rank_function(fields, orderby):
+    """Returns function `rank(row, index)` that returns comparable rank of
+    a row, lower rank is ranked higher."""
+
+    key, reverse = sort_key(fields, orderby)
+
+    if reverse:
+        return lambda row, index: (_Reversed(key(row)), index)
+    else:
+        return lambda row, index: (key(row), index)
+
+def _push_top(heap, item, n):
+    """Pushes `item` into `heap` of at most `n` items, the worst item is
+    replaced if the heap is full."""
+    if len(heap) < n:
+        heapq.heappush(heap, item)
+    elif heap[0][0].value > item[0].value:
+        heapq.heapreplace(heap, item)
+
+def _heap_rows(heap):
+    """Returns rows of the `heap` ordered by their rank."""
+    heap.sort(reverse=True)
+    return [row for item, row in heap]
+
+def top_rows(rows, rank, n):
+    """Returns list of best `n` `rows` by `rank` ordered by the rank."""
+
+    heap = []
+    for index, row in enumerate(rows):
+        _push_top(heap, (_Reversed(rank(row, index)), row), n)
+
+    return _heap_rows(heap)
+
+@top_n.register("rows")
+def _(ctx, obj, key, orderby, n):
+    """Returns at most `n` rows for each distinct `key` that are first
+    according to `orderby`. Only the `n` best rows of each group are kept in
+    memory. Groups are in order of their first occurrence, unless the input
+    is known to be ordered by the `key` – then each group is emitted as
+    soon as the key changes. If no `key` is specified, then the best `n` rows
+    of the whole object are returned."""
+
+    def hash_iterator():
+        # key -> heap of (inverted rank, row)
+        heaps = {}
+
+        for index, row in enumerate(obj.rows()):
+            row_key = key_getter(row)
+            try:
+                heap = heaps[row_key]
+            except KeyError:
+                heap = heaps[row_key] = []
+
+            _push_top(heap, (_Reversed(rank(row, index)), row), n)
+
+        for heap in heaps.values():
+            yield from _heap_rows(heap)
+
+    def sorted_iterator():
+        for row_key, rows in itertools.groupby(obj.rows(), key_getter):
+            yield from top_rows(rows, rank, n)
+
+    keys = prepare_key(key) if key else ()
+    orderby = prepare_order_list(orderby)
+
+    key_getter = _values_getter(obj.fields.indexes(keys))
+    rank = _rank_function(obj.fields, orderby)
+
+    ordered = is_ordered_by(obj, keys)
+
+    if n <= 0:
+        iterator = iter([])
+    elif not keys:
+        iterator = iter(top_rows(obj.rows(), rank, n))
+    elif ordered:
+        iterator = sorted_iterator()
+    else:
+        iterator = hash_iterator()
+
+    result = IterableDataSource(iterator, obj.fields.clone())
+
+    if not keys:
+        result.order_by = orderby
+    elif ordered:
+        result.order_by = obj.order_by[:len(keys)] + orderby
+
+    return result
 
 
 ###
-# Simple and naive aggregation in Python
+# Aggregation in Python
+#
+# Aggregation functions skip missing values (``None``), except `first` and
+# `last` which return the value of the first or last row of the group. All
+# functions are evaluated in one pass.
+
+# Start value of functions that have no value until the first row is seen
+_EMPTY = object()
 
 def agg_sum(a, value):
-    return a+value
+    return a + value if value is not None else a
+
+def agg_count(a, value):
+    return a + 1 if value is not None else a
+
+def agg_min(a, value):
+    if value is None:
+        return a
+    return value if a is None or value < a else a
+
+def agg_max(a, value):
+    if value is None:
+        return a
+    return value if a is None or value > a else a
+
+def agg_first(a, value):
+    return value if a is _EMPTY else a
+
+def agg_last(a, value):
+    return value
 
 def agg_average(a, value):
+    if value is None:
+        return a
     return (a[0]+1, a[1]+value)
 
 def agg_average_finalize(a):
-    return a[1]/a[0]
+    return a[1]/a[0] if a[0] else None
+
+def agg_variance(a, value):
+    # Welford's online algorithm, state is (count, mean, M2)
+    if value is None:
+        return a
+    count, mean, m2 = a
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return (count, mean, m2)
+
+def agg_variance_finalize(a):
+    # Sample variance
+    count, mean, m2 = a
+    return m2 / (count - 1) if count > 1 else None
+
+def agg_digest(a, value):
+    # Digest is created on the first value, start values are shared
+    if value is None:
+        return a
+    if a is None:
+        a = TDigest()
+    a.add(value)
+    return a
 
 AggregationFunction = namedtuple("AggregationFunction",
                             ["func", "start", "finalize"])
 aggregation_functions = {
             "sum": AggregationFunction(agg_sum, 0, None),
-            "min": AggregationFunction(min, 0, None),
-            "max": AggregationFunction(max, 0, None),
-            "average": AggregationFunction(agg_average, (0,0), agg_average_finalize)
+            "count": AggregationFunction(agg_count, 0, None),
+            "min": AggregationFunction(agg_min, None, None),
+            "max": AggregationFunction(agg_max, None, None),
+            "first": AggregationFunction(agg_first, _EMPTY, None),
+            "last": AggregationFunction(agg_last, None, None),
+            "average": AggregationFunction(agg_average, (0,0), agg_average_finalize),
+            "avg": AggregationFunction(agg_average, (0,0), agg_average_finalize),
+            "variance": AggregationFunction(agg_variance, (0, 0.0, 0.0),
+                                            agg_variance_finalize),
         }
 
+# Quantile aggregations: ``median`` and ``pNN`` where NN is a percentile,
+# such as ``p95`` or ``p99.9``
+_percentile_pattern = re.compile(r"^p(\d+(\.\d+)?)$")
+
+def aggregation_function(name):
+    """Returns `AggregationFunction` for aggregation `name`. Raises
+    `ArgumentError` for unknown aggregation."""
+
+    try:
+        return aggregation_functions[name]
+    except KeyError:
+        pass
+
+    if name == "median":
+        q = 0.5
+    else:
+        match = _percentile_pattern.match(name)
+        q = float(match.group(1)) / 100 if match else None
+
+    if q is None or q > 1:
+        raise ArgumentError("Unknown aggregation '%s'" % name)
+
+    finalize = lambda a: a.quantile(q) if a is not None else None
+    return AggregationFunction(agg_digest, None, finalize)
+
+def is_ordered_by(obj, keys):
+    """Returns `True` if rows of `obj` are known to be ordered by `keys` in
+    any direction – the leading fields of the object's `order_by` are the
+    `keys`. Rows of the same key are adjacent in such object."""
+
+    if not keys or not obj.order_by:
+        return False
+
+    leading = [str(field) for field, order in obj.order_by[:len(keys)]]
+    return set(leading) == set(str(key) for key in keys) \
+                and len(leading) == len(keys)
+
 @aggregate.register("rows")
 def _(ctx, obj, key, measures=None, include_count=True,
-      count_field="record_count"):
+      count_field="record_count", is_sorted=False):
     """Aggregates measure fields in `iterator` by `keys`. `fields` is a field
     list of the iterator, `keys` is a list of fields that will be used as
     keys. `aggregations` is a list of measures to be aggregated.
@@ -423,36 +1119,67 @@ def _(ctx, obj, key, measures=None, include_count=True,
     contain: key fields, measures (as specified in the measures list) and
     optional record count if `include_count` is ``True`` (default).
 
-    Result is not ordered even the input was ordered.
+    If the rows are sorted by the keys – `is_sorted` is ``True`` or the
+    object is known to be ordered by the keys, for example output of `sort`
+    – then each group is emitted as soon as the key changes and only one
+    group is kept in memory. Otherwise aggregates of all keys are kept in
+    memory and the result is not ordered even the input was ordered.
+    """
 
-    .. note:
+    def new_aggregate():
+        key_aggregate = [function.start
+                         for measure, index, function in measure_aggregates]
+        if include_count:
+            key_aggregate.append(0)
+        return key_aggregate
 
-        This is naïve, pure Python implementation of aggregation. Might not
-        fit your expectations in regards of speed and memory consumption for
-        large datasets.
-    """
+    def update(key_aggregate, row):
+        for i, (measure, index, function) in enumerate(measure_aggregates):
+            key_aggregate[i] = function.func(key_aggregate[i], row[index])
+
+        if include_count:
+            key_aggregate[-1] += 1
+
+    def result_row(key, key_aggregate):
+        row = list(key)
+
+        for i, (measure, index, function) in enumerate(measure_aggregates):
+            aggregate = key_aggregate[i]
+            finalize = function.finalize
+            if finalize:
+                row.append(finalize(aggregate))
+            else:
+                row.append(aggregate)
 
-    def aggregation_result(keys, aggregates, measure_aggregates):
-        # Pass results to output
-        for key in keys:
-            row = list(key[:])
+        if include_count:
+            row.append(key_aggregate[-1])
+
+        return row
+
+    def sorted_iterator(key_getter):
+        # Groups are adjacent, emit a group when the key changes
+        for key, rows in itertools.groupby(obj.rows(), key_getter):
+            key_aggregate = new_aggregate()
+            for row in rows:
+                update(key_aggregate, row)
+            yield result_row(key, key_aggregate)
 
-            key_aggregate = aggregates[key]
-            for i, (measure, index, function) in enumerate(measure_aggregates):
-                aggregate = key_aggregate[i]
-                finalize = aggregation_functions[function].finalize
-                if finalize:
-                    row.append(finalize(aggregate))
-                else:
-                    row.append(aggregate)
+    def hash_iterator(key_getter):
+        # key -> list of aggregates
+        aggregates = {}
+
+        for row in obj.rows():
+            key = key_getter(row)
 
-            if include_count:
-                row.append(key_aggregate[-1])
+            try:
+                key_aggregate = aggregates[key]
+            except KeyError:
+                key_aggregate = aggregates[key] = new_aggregate()
 
-            yield row
+            update(key_aggregate, row)
 
-    # TODO: create sorted version
-    # TODO: include SQL style COUNT(field) to count non-NULL values
+        for key, key_aggregate in aggregates.items():
+            yield result_row(key, key_aggregate)
 
     # Coalesce to a list if just one is specified
     keys = prepare_key(key)
@@ -463,19 +1190,23 @@ def _(ctx, obj, key, measures=None, include_count=True,
     out_fields = FieldList()
     out_fields += obj.fields.fields(keys)
 
-    measure_fields = set()
     measure_aggregates = []
     for measure in measures:
         name = measure[0]
         index = obj.fields.index(name)
         aggregate = measure[1]
 
-        measure_aggregates.append( (name, index, aggregate) )
-        measure_fields.add(name)
+        function = aggregation_function(aggregate)
+        measure_aggregates.append( (name, index, function) )
 
         field = obj.fields.field(name)
-        field = field.clone(name="%s_%s" % (name, aggregate),
-                            analytical_type="measure")
+        if aggregate == "count":
+            field = Field("%s_%s" % (name, aggregate),
+                          storage_type="integer",
+                          analytical_type="measure")
+        else:
+            field = field.clone(name="%s_%s" % (name, aggregate),
+                                analytical_type="measure")
         out_fields.append(field)
 
     if include_count:
@@ -485,44 +1216,428 @@ def _(ctx, obj, key, measures=None, include_count=True,
 
     if keys:
         key_selectors = obj.fields.indexes(keys)
+        key_getter = lambda row: tuple(row[s] for s in key_selectors)
     else:
-        key_selectors = []
+        key_getter = lambda row: ()
 
-    keys = set()
+    ordered = is_ordered_by(obj, keys)
 
-    # key -> list of aggregates
-    aggregates = {}
+    if is_sorted or ordered:
+        iterator = sorted_iterator(key_getter)
+    else:
+        iterator = hash_iterator(key_getter)
 
-    for row in obj.rows():
-        # Create aggregation key
-        key = tuple(row[s] for s in key_selectors)
+    result = IterableDataSource(iterator, out_fields)
+    result.fresh_rows = True
 
-        # Create new aggregate record for key if it does not exist
-        #
-        try:
-            key_aggregate = aggregates[key]
-        except KeyError:
-            keys.add(key)
-            key_aggregate = []
-            for measure, index, function in measure_aggregates:
-                start = aggregation_functions[function].start
-                key_aggregate.append(start)
-            if include_count:
-                key_aggregate.append(0)
+    if ordered:
+        result.order_by = obj.order_by[:len(keys)]
 
-            aggregates[key] = key_aggregate
+    return result
 
-        for i, (measure, index, function) in enumerate(measure_aggregates):
-            func = aggregation_functions[function].func
-            key_aggregate[i] = func(key_aggregate[i], row[index])
 
-        if include_count:
-            key_aggregate[-1] += 1
+# Window Functions
+# ================
+#
+# Rows are processed partition by partition in the window order (sorted by
+# the partition key and `orderby`). Values of most functions depend only on
+# the current and preceding rows and are computed as the rows stream
+# through. Rows wait only for `lead` – at most the largest lead offset of
+# rows is delayed – and for aggregates over the whole partition, which keep
+# the partition in memory.
+
+_ranking_functions = ("rank", "dense_rank", "row_number")
+
+def _window_rank(order_getter, function):
+    row_number = 0
+    rank = 0
+    dense_rank = 0
+    last = _EMPTY
+
+    def value(row):
+        nonlocal row_number, rank, dense_rank, last
+        row_number += 1
+        order = order_getter(row)
+        if order != last:
+            rank = row_number
+            dense_rank += 1
+            last = order
+
+        if function == "rank":
+            return rank
+        elif function == "dense_rank":
+            return dense_rank
+        else:
+            return row_number
+
+    return value
+
+def _window_lag(index, offset):
+    if not offset:
+        return operator.itemgetter(index)
+
+    previous = deque(maxlen=offset)
+
+    def value(row):
+        result = previous[0] if len(previous) == offset else None
+        previous.append(row[index])
+        return result
+
+    return value
+
+def _window_running(index, function):
+    state = function.start
+
+    def value(row):
+        nonlocal state
+        state = function.func(state, row[index])
+        return function.finalize(state) if function.finalize else state
+
+    return value
+
+def _window_moving(index, function, size):
+    # Window of the last `size` values, missing values are skipped. The
+    # aggregate is updated as values enter and leave the window.
+    if function in ("min", "max"):
+        return _window_moving_extreme(index, function, size)
+
+    window = deque()
+    total = 0
+    count = 0
+
+    def value(row):
+        nonlocal total, count
+        current = row[index]
+        window.append(current)
+        if current is not None:
+            total += current
+            count += 1
+
+        if len(window) > size:
+            removed = window.popleft()
+            if removed is not None:
+                total -= removed
+                count -= 1
+
+        if function == "count":
+            return count
+        elif not count:
+            return None
+        elif function == "sum":
+            return total
+        else:
+            return total / count
+
+    return value
+
+def _window_moving_extreme(index, function, size):
+    # Monotonic deque of (position, value) – values that can still become
+    # the extreme of the window, the extreme is the first one
+    candidates = deque()
+    replaces = operator.le if function == "min" else operator.ge
+    position = 0
+
+    def value(row):
+        nonlocal position
+        current = row[index]
+        if current is not None:
+            while candidates and replaces(current, candidates[-1][1]):
+                candidates.pop()
+            candidates.append((position, current))
+
+        if candidates and candidates[0][0] <= position - size:
+            candidates.popleft()
+
+        position += 1
+        return candidates[0][1] if candidates else None
+
+    return value
+
+_moving_functions = ("sum", "average", "avg", "min", "max", "count")
+
+@window_aggregate.register("rows")
+def _(ctx, obj, key, orderby, functions, is_sorted=False):
+    """Appends values of window `functions` evaluated over partitions by
+    `key` ordered by `orderby` to the rows. `functions` is a list of
+    tuples `(field, function[, argument])`, see `prepare_window_list()`.
+
+    Functions:
+
+    * ``rank``, ``dense_rank``, ``row_number`` – ranking by `orderby`
+    * ``lag``, ``lead`` – value of the field `argument` rows (default 1)
+      before or after the current row
+    * ``running_AGG`` – aggregation `AGG` (such as ``sum``) of the rows from
+      the start of the partition to the current row
+    * ``moving_AGG`` – aggregation `AGG` (``sum``, ``average``, ``min``,
+      ``max``, ``count``) of the last `argument` rows
+    * ``AGG`` – aggregation of the whole partition
+
+    Result is ordered by the partition key and `orderby`. If the object is
+    not known to be ordered so – or `is_sorted` is not ``True`` – then the
+    rows are sorted first.
+    """
+
+    def partition_rows(rows):
+        values = [(position, factory()) for position, factory in backward]
+        states = [function.start for position, index, function in totals]
+        pending = deque()
+
+        for row in rows:
+            out = list(row) + extension
+            for position, value in values:
+                out[position] = value(row)
+
+            for i, (position, index, function) in enumerate(totals):
+                states[i] = function.func(states[i], row[index])
+
+            for position, index, offset in leads:
+                if len(pending) >= offset:
+                    pending[-offset][position] = row[index]
+
+            pending.append(out)
+            if not totals and len(pending) > max_lead:
+                yield pending.popleft()
+
+        for i, (position, index, function) in enumerate(totals):
+            if function.finalize:
+                total = function.finalize(states[i])
+            else:
+                total = states[i]
+            for out in pending:
+                out[position] = total
+
+        yield from pending
+
+    def iterator(rows):
+        for partition_key, rows in itertools.groupby(rows, key_getter):
+            yield from partition_rows(rows)
+
+    keys = prepare_key(key) if key else ()
+    orderby = prepare_order_list(orderby)
+    functions = prepare_window_list(functions)
+
+    out_fields = FieldList()
+    out_fields += obj.fields.clone()
+    out_fields += obj.fields.window_fields(functions)
+
+    key_getter = _values_getter(obj.fields.indexes(keys))
+    order_getter = _values_getter(obj.fields.indexes([f for f, o in orderby]))
+
+    width = len(obj.fields)
+    extension = [None] * len(functions)
+
+    # (position, function returning a function of a row)
+    backward = []
+    # (position, index, offset)
+    leads = []
+    # (position, index, AggregationFunction)
+    totals = []
+
+    for i, (field, function, argument) in enumerate(functions):
+        position = width + i
+        index = obj.fields.index(field) if field is not None else None
+
+        if function in _ranking_functions:
+            factory = functools.partial(_window_rank, order_getter, function)
+        elif function in ("lag", "lead"):
+            offset = 1 if argument is None else argument
+            if offset < 0:
+                raise ArgumentError("Offset of '%s' should not be negative"
+                                    % function)
+            if function == "lead" and offset:
+                leads.append((position, index, offset))
+                continue
+            factory = functools.partial(_window_lag, index, offset)
+        elif function.startswith("running_"):
+            agg = aggregation_function(function[len("running_"):])
+            factory = functools.partial(_window_running, index, agg)
+        elif function.startswith("moving_"):
+            agg = function[len("moving_"):]
+            if agg not in _moving_functions:
+                raise ArgumentError("Unknown window function '%s'"
+                                    % function)
+            if not argument:
+                raise ArgumentError("Window size is required for '%s'"
+                                    % function)
+            factory = functools.partial(_window_moving, index, agg, argument)
+        else:
+            totals.append((position, index, aggregation_function(function)))
+            continue
+
+        backward.append((position, factory))
+
+    max_lead = max(offset for position, index, offset in leads) \
+                    if leads else 0
+
+    # Rows should be ordered by the key (any direction) and by `orderby`
+    if keys:
+        order_prefix = obj.order_by[:len(keys)] \
+                            if is_ordered_by(obj, keys) else None
+    else:
+        order_prefix = []
+
+    if is_sorted or not (keys or orderby):
+        rows = obj.rows()
+        order_by = None
+    elif order_prefix is not None \
+            and (obj.order_by or [])[len(keys):len(keys) + len(orderby)] \
+                == orderby:
+        rows = obj.rows()
+        order_by = order_prefix + orderby
+    else:
+        order_by = [(key, "asc") for key in keys] + orderby
+        sort_function, reverse = sort_key(obj.fields, order_by)
+        rows = sorted_rows(obj.rows(), sort_function, reverse)
+
+    result = IterableDataSource(iterator(rows), out_fields)
+    result.order_by = order_by
+    result.fresh_rows = True
+
+    return result
+
+#############################################################################
+# Auditing
+
+@approx_distinct_count.register("rows")
+def _(ctx, obj, fields=None, precision=None):
+    """Returns an object with one row of estimated distinct value counts of
+    `fields` (all fields if not specified). The counts are estimated with
+    HyperLogLog sketches of `precision` (see `bubbles.sketches`) in
+    constant memory. Empty values (``None``) are not counted, as in SQL
+    ``COUNT(DISTINCT ...)``."""
+
+    if not fields:
+        fields = obj.fields
+    fields = prepare_key(fields)
+    indexes = obj.fields.indexes(fields)
+
+    sketches = [HyperLogLog(precision) for index in indexes]
+
+    if len(indexes) == 1:
+        index = indexes[0]
+        sketches[0].update(row[index] for row in obj.rows()
+                           if row[index] is not None)
+    else:
+        adds = [(index, sketch.add) for index, sketch
+                in zip(indexes, sketches)]
+        for row in obj.rows():
+            for index, add in adds:
+                value = row[index]
+                if value is not None:
+                    add(value)
+
+    out_fields = FieldList()
+    for field in obj.fields.fields(fields):
+        out_fields.append(field.clone(storage_type="integer",
+                                      analytical_type="measure"))
+
+    row = [sketch.count() for sketch in sketches]
+    return IterableDataSource(iter([row]), out_fields)
+
+@quantiles.register("rows")
+def _(ctx, obj, fields, quantiles=None, compression=None):
+    """Returns estimated `quantiles` (list of numbers between 0 and 1, default
+    is minimum, quartiles and maximum) of numeric `fields`. Result has a row
+    for each quantile with the quantile in the first field ``quantile``
+    followed by values of the `fields`. Quantiles are estimated in one pass
+    with t-digests of `compression` (see `bubbles.sketches`), empty values
+    are skipped."""
 
-    iterator = aggregation_result(keys, aggregates, measure_aggregates)
+    fields = prepare_key(fields)
+    indexes = obj.fields.indexes(fields)
+    quantiles = quantiles or [0, 0.25, 0.5, 0.75, 1]
 
-    return IterableDataSource(iterator, out_fields)
+    digests = [TDigest(compression) for index in indexes]
+    pairs = list(zip(indexes, digests))
 
+    for row in obj.rows():
+        for index, digest in pairs:
+            value = row[index]
+            if value is not None:
+                digest.add(value)
+
+    out_fields = FieldList(Field("quantile", "number"))
+    for field in obj.fields.fields(fields):
+        out_fields.append(field.clone(storage_type="number",
+                                      analytical_type="measure"))
+
+    rows = [[q] + [digest.quantile(q) for digest in digests]
+            for q in quantiles]
+    return IterableDataSource(iter(rows), out_fields)
+
+@histogram.register("rows")
+def _(ctx, obj, field, bins=10, low=None, high=None, compression=None):
+    """Returns histogram of numeric `field` with `bins` bins of equal width
+    between `low` and `high`. Result has fields ``low``, ``high`` and
+    ``count``. Upper bound of the last bin is inclusive.
+
+    If both `low` and `high` are specified, then values are counted exactly
+    and values outside of the range are ignored. Otherwise the range is
+    from minimum to maximum of the values and the counts are estimated from
+    a t-digest of `compression`. Empty values are skipped."""
+
+    if bins <= 0:
+        raise ArgumentError("Number of histogram bins should be positive, "
+                            "is %s" % (bins, ))
+    if low is not None and high is not None and high < low:
+        raise ArgumentError("Histogram high bound %s is lower than low "
+                            "bound %s" % (high, low))
+
+    index = obj.fields.index(field)
+    values = (row[index] for row in obj.rows())
+    values = (value for value in values if value is not None)
+
+    if low is not None and high is not None:
+        counts = [0] * bins
+        width = (high - low) / bins
+        for value in values:
+            if low <= value < high:
+                # Values just below `high` might be rounded to `bins`
+                counts[min(int((value - low) / width), bins - 1)] += 1
+            elif value == high:
+                counts[-1] += 1
+    else:
+        digest = TDigest(compression)
+        digest.update(values)
+
+        if digest.count():
+            total = digest.total
+            # Values outside of an explicit bound are not counted
+            if low is None:
+                low = digest.min
+                first = 0
+            else:
+                first = round(digest.cdf(low) * total)
+            if high is None:
+                high = digest.max
+                last = total
+            else:
+                last = round(digest.cdf(high) * total)
+
+            # Counts are differences of rounded cumulative counts, so they
+            # sum up to the number of values in the range
+            edges = [low + (high - low) * i / bins for i in range(1, bins)]
+            cumulative = [first]
+            cumulative += [round(digest.cdf(edge) * total) for edge in edges]
+            cumulative.append(last)
+            counts = [max(b - a, 0) for a, b
+                      in zip(cumulative, cumulative[1:])]
+        else:
+            counts = [0] * bins
+
+    if low is None or high is None:
+        rows = []
+    else:
+        rows = [[low + (high - low) * i / bins,
+                 low + (high - low) * (i + 1) / bins,
+                 count] for i, count in enumerate(counts)]
+
+    out_fields = FieldList(Field("low", "number"),
+                           Field("high", "number"),
+                           Field("count", "integer",
+                                 analytical_type="measure"))
+
+    return IterableDataSource(iter(rows), out_fields)
 
 #############################################################################
 # Transpose
@@ -560,10 +1675,6 @@ def _(ctx, obj, key, column_field, value_field):
 
 @append_constant_fields.register("rows")
 def _(ctx, obj, fields, value):
-    def iterator(constants):
-        for row in obj.rows():
-            yield list(row) + constants
-
     if not isinstance(value, (list, tuple)):
         constants = (value, )
     else:
@@ -571,20 +1682,12 @@ def _(ctx, obj, fields, value):
 
     output_fields = obj.fields + fields
 
-    return IterableDataSource(iterator(constants), output_fields)
+    stage = row_stage("map", "[*row, *arg]", constants, fresh=True)
+    return fused(obj, stage, output_fields)
 
 
 @dates_to_dimension.register("rows")
 def _(ctx, obj, fields=None, unknown_date=0):
-    def iterator(indexes):
-        for row in obj.rows():
-            row = list(row)
-
-            for index in indexes:
-                row[index] = row[index].strftime("%Y%m%d")
-
-            yield row
-
     if fields:
         date_fields = obj.fields(fields)
     else:
@@ -602,25 +1705,30 @@ def _(ctx, obj, fields=None, unknown_date=0):
 
     fields = FieldList(*fields)
 
-    return IterableDataSource(iterator(indexes), fields)
+    code = []
+    for index in indexes:
+        code.append("if row[{0}] is None:\n"
+                    "    row[{0}] = arg\n"
+                    "else:\n"
+                    "    row[{0}] = row[{0}].strftime('%Y%m%d')".format(index))
+
+    stage = row_stage("update", "\n".join(code), unknown_date)
+    return fused(obj, stage, fields)
 
 
 @string_to_date.register("rows")
 def _(ctx, obj, fields, fmt="%Y-%m-%dT%H:%M:%S.Z"):
-    def iterator(indexes):
-        for row in obj.rows():
-            row = list(row)
-            for index in indexes:
-                date_str = row[index]
-                value = None
-                if date_str:
-                    try:
-                        value = datetime.strptime(row[index], fmt)
-                    except ValueError:
-                        pass
-
-                row[index] = value
-            yield row
+    def convert(row):
+        for index in indexes:
+            date_str = row[index]
+            value = None
+            if date_str:
+                try:
+                    value = datetime.strptime(date_str, fmt)
+                except ValueError:
+                    pass
+
+            row[index] = value
 
     date_fields = prepare_key(fields)
     indexes = obj.fields.indexes(date_fields)
@@ -634,23 +1742,20 @@ def _(ctx, obj, fields, fmt="%Y-%m-%dT%H:%M:%S.Z"):
         else:
             fields.append(field.clone())
 
-    return IterableDataSource(iterator(indexes), fields)
+    return fused(obj, row_stage("update", "arg(row)", convert), fields)
+
+# Date and time attributes that can be extracted by `split_date`
+DATE_PARTS = ("year", "month", "day", "hour", "minute", "second",
+              "microsecond")
 
 @split_date.register("rows")
 def _(ctx, obj, fields, parts=["year", "month", "day"]):
     """Extract `parts` from date objects"""
 
-    def iterator(indexes):
-        for row in obj.rows():
-            new_row = []
-            for i, value in enumerate(row):
-                if i in indexes:
-                    for part in parts:
-                        new_row.append(getattr(value, part))
-                else:
-                    new_row.append(value)
-
-            yield new_row
+    for part in parts:
+        if part not in DATE_PARTS:
+            raise ArgumentError("Unknown date part '%s'. Should be one of: %s"
+                                % (part, ", ".join(DATE_PARTS)))
 
     date_fields = prepare_key(fields)
 
@@ -660,36 +1765,36 @@ def _(ctx, obj, fields, parts=["year", "month", "day"]):
     fields = FieldList()
     proto = Field(name="p", storage_type="integer", analytical_type="ordinal")
 
-    for field in obj.fields:
+    values = []
+    for i, field in enumerate(obj.fields):
         if str(field) in date_fields:
             for part in parts:
                 name = "%s_%s" % (str(field), part)
                 fields.append(proto.clone(name=name))
+                values.append("row[%d].%s" % (i, part))
         else:
             fields.append(field.clone())
+            values.append("row[%d]" % i)
 
-    return IterableDataSource(iterator(indexes), fields)
+    code = "[%s]" % ", ".join(values)
+    return fused(obj, row_stage("map", code, fresh=True), fields)
 
 @text_substitute.register("rows")
-@unary_iterator
 def _(ctx, iterator, field, substitutions):
     """Substitute field using text substitutions"""
     # Compile patterns
-    fields = iterator.fields
-    substitutions = [(re.compile(patt), r) for (patt, r) in subsitutions]
-    index = fields.index(field)
-    for row in iterator:
-        row = list(row)
+    substitutions = [(re.compile(patt), r) for (patt, r) in substitutions]
+    index = iterator.fields.index(field)
 
-        value = row[index]
+    def substitute(value):
         for (pattern, repl) in substitutions:
-            value = re.sub(pattern, repl, value)
-        row[index] = value
+            value = pattern.sub(repl, value)
+        return value
 
-        yield row
+    code = "row[{0}] = arg(row[{0}])".format(index)
+    return fused(iterator, row_stage("update", code, substitute))
 
 @empty_to_missing.register("rows")
-@unary_iterator
 @experimental
 def _(ctx, iterator, fields=None, strict=False):
     """Converts empty strings into `None` values."""
@@ -707,14 +1812,12 @@ def _(ctx, iterator, fields=None, strict=False):
 
     indexes = iterator.fields.indexes(fields)
 
-    for row in iterator:
-        row = list(row)
-        for index in indexes:
-            row[index] = row[index] if row[index] else None
-        yield row
+    code = ["if not row[{0}]:\n"
+            "    row[{0}] = None".format(index) for index in indexes]
+
+    return fused(iterator, row_stage("update", "\n".join(code)))
 
 @string_strip.register("rows")
-@unary_iterator
 def _(ctx, iterator, strip_fields=None, chars=None):
     """Strip characters from `strip_fields` in the iterator. If no
     `strip_fields` is provided, then it strips all `string` or `text` storage
@@ -729,13 +1832,11 @@ def _(ctx, iterator, strip_fields=None, chars=None):
 
     indexes = fields.indexes(strip_fields)
 
-    for row in iterator:
-        row = list(row)
-        for index in indexes:
-            value = row[index]
-            if value:
-                row[index] = value.strip(chars)
-        yield row
+    code = ["if row[{0}]:\n"
+            "    row[{0}] = row[{0}].strip(arg)".format(index)
+            for index in indexes]
+
+    return fused(iterator, row_stage("update", "\n".join(code), chars))
 
 @string_split_fixed.register("rows")
 def _(ctx, iterato, split_fields=None, new_fields=None, widths=None):
@@ -756,55 +1857,325 @@ def _(ctx, objects):
 
 
 
-@join_details.register("rows", "rows")
-def _(self, master, detail, master_key, detail_key):
-    """"Simple master-detail join"""
-
-    def _join_detail_iterator(master, detail, master_key, detail_key):
-        """Simple iterator implementation of the left inner join"""
+# Hash Join
+# =========
+#
+# Detail rows are kept in a hash table of lists of detail values by key.
+# Master rows are streamed and joined with all the matching detail rows.
+# If there are more than `buffer_size` detail rows, then both sides are
+# partitioned by the key hash into temporary files and the partitions are
+# joined one by one (grace hash join). The same budget applies to every
+# partition: a partition with more than `buffer_size` detail rows is
+# partitioned again with a different hash. Details of a single key can not
+# be split, such partition is loaded into memory. Order of the master rows
+# is not preserved after a spill.
+
+DEFAULT_JOIN_BUFFER_SIZE = 1000000
+
+# Number of partitions of the grace hash join
+_JOIN_PARTITIONS = 32
+
+def _values_getter(indexes):
+    """Returns a function that returns tuple of row values at `indexes`"""
+    if not indexes:
+        return lambda row: ()
+    elif len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index], )
+    else:
+        return operator.itemgetter(*indexes)
+
+def _is_empty_key(key):
+    return key is None or (isinstance(key, tuple) and None in key)
+
+
+class _SpillPartitions(object):
+    """Items distributed into partitions stored in temporary files."""
+
+    def __init__(self, count):
+        self.files = [tempfile.TemporaryFile() for i in range(count)]
+        self.buffers = [[] for i in range(count)]
+
+    def add(self, index, item):
+        buffer = self.buffers[index]
+        buffer.append(item)
+        if len(buffer) >= _RUN_BLOCK_SIZE:
+            pickle.dump(buffer, self.files[index], pickle.HIGHEST_PROTOCOL)
+            self.buffers[index] = []
+
+    def read(self, index):
+        """Returns an iterator over items of partition `index`. The
+        partition is closed when read."""
+        spill = self.files[index]
+        if self.buffers[index]:
+            pickle.dump(self.buffers[index], spill, pickle.HIGHEST_PROTOCOL)
+            self.buffers[index] = []
+        spill.seek(0)
+        yield from _read_run(spill)
+        spill.close()
+
+    def close(self):
+        for spill in self.files:
+            spill.close()
+
+
+def _probe(master, table, master_key, empty, inner):
+    for row in master:
+        matches = table.get(master_key(row))
+        if matches:
+            for values in matches:
+                yield [*row, *values]
+        elif not inner:
+            yield [*row, *empty]
+
+def hash_join(master, detail, master_key, detail_key, value_indexes,
+              inner=True, buffer_size=None):
+    """Joins `master` rows with `detail` rows. `master_key` and
+    `detail_key` are functions returning key of a row, values of detail
+    rows at `value_indexes` are appended to the master row. If `inner` is
+    ``True`` then only master rows with a matching detail are returned,
+    otherwise missing details are ``None``. Rows with empty keys are never
+    matched."""
+
+    buffer_size = buffer_size or DEFAULT_JOIN_BUFFER_SIZE
+    detail_values = _values_getter(value_indexes)
+    empty = (None, ) * len(value_indexes)
+
+    def details():
+        for row in detail:
+            key = detail_key(row)
+            if not _is_empty_key(key):
+                yield (key, detail_values(row))
 
-        djoins = []
-        detail_map = {}
+    yield from _grace_hash_join(master, details(), master_key, empty, inner,
+                                buffer_size, 0)
 
-        # TODO: support compound keys
-        detail_index = detail.fields.index(detail_key[0])
-        detail_dict = {}
+def _grace_hash_join(master, details, master_key, empty, inner, buffer_size,
+                     level):
+    """Joins `master` rows with `details` – tuples (`key`, `values`) with
+    non-empty keys. Details are partitioned together with the master rows
+    when there are more than `buffer_size` of them."""
 
-        for row in detail:
-            row = list(row)
-            key = row.pop(detail_index)
-            detail_dict[key] = row
+    details = iter(details)
+    table = {}
+    count = 0
 
-        for master_row in master:
-            row = list(master_row)
+    for key, values in details:
+        try:
+            table[key].append(values)
+        except KeyError:
+            table[key] = [values]
 
-            master_index = master.fields.index(master_key[0])
-            key = master_row[master_index]
-            try:
-                detail_row = detail_dict[key]
-            except KeyError:
-                continue
+        count += 1
+        # Details of one key can not be partitioned
+        if count >= buffer_size and len(table) > 1 \
+                and level < _MAX_SPILL_LEVEL:
+            break
+    else:
+        yield from _probe(master, table, master_key, empty, inner)
+        return
+
+    detail_parts = _SpillPartitions(_JOIN_PARTITIONS)
+    master_parts = _SpillPartitions(_JOIN_PARTITIONS)
+
+    try:
+        for key, values_list in table.items():
+            index = _partition_index(key, level, _JOIN_PARTITIONS)
+            for values in values_list:
+                detail_parts.add(index, (key, values))
+        table = None
+
+        for key, values in details:
+            index = _partition_index(key, level, _JOIN_PARTITIONS)
+            detail_parts.add(index, (key, values))
+
+        for row in master:
+            key = master_key(row)
+            if _is_empty_key(key):
+                if not inner:
+                    yield [*row, *empty]
             else:
-                yield row + detail_row
+                index = _partition_index(key, level, _JOIN_PARTITIONS)
+                master_parts.add(index, row)
+
+        for index in range(_JOIN_PARTITIONS):
+            yield from _grace_hash_join(master_parts.read(index),
+                                        detail_parts.read(index),
+                                        master_key, empty, inner,
+                                        buffer_size, level + 1)
+    finally:
+        detail_parts.close()
+        master_parts.close()
+
+def _join_detail(master, detail, master_key, detail_key, inner, buffer_size):
+    """Returns a tuple (`iterator`, `fields`) of master-detail join."""
 
     master_key = prepare_key(master_key)
     detail_key = prepare_key(detail_key)
 
-    if len(master_key) > 1 or len(detail_key) > 1:
-        raise ArgumentError("Compound keys are not supported yet")
-
-    result = _join_detail_iterator(master, detail, master_key, detail_key)
+    if len(master_key) != len(detail_key):
+        raise ArgumentError("Master key and detail key should have the same "
+                            "number of fields")
 
     # Prepare output fields and columns selection - the selection skips detail
     # columns that are used as key, because they are already present in the
     # master table.
 
-    out_fields = master.fields.clone()
-    for field in detail.fields:
+    fields = FieldList()
+    value_indexes = []
+    for i, field in enumerate(detail.fields):
+        if str(field) not in detail_key:
+            fields.append(field.clone())
+            value_indexes.append(i)
+
+    iterator = hash_join(master.rows(),
+                         detail.rows(),
+                         operator.itemgetter(*master.fields.indexes(master_key)),
+                         operator.itemgetter(*detail.fields.indexes(detail_key)),
+                         value_indexes,
+                         inner=inner,
+                         buffer_size=buffer_size)
+
+    return (iterator, fields)
+
+@join_details.register("rows", "rows")
+def _(ctx, master, detail, master_key, detail_key, inner=True,
+      buffer_size=None):
+    """Master-detail hash join on simple or compound keys. Each master row
+    is joined with every matching detail row. If `inner` is ``False`` then
+    master rows without details are kept and detail values are ``None``
+    (left outer join).
+
+    Whole `detail` is consumed first. If it has more than `buffer_size` rows,
+    then both objects are partitioned to temporary files."""
+
+    iterator, fields = _join_detail(master, detail, master_key, detail_key,
+                                    inner, buffer_size)
+
+    return IterableDataSource(iterator, master.fields + fields)
+
+# Merge Join
+# ==========
+#
+# Both inputs are sorted by the join key in ascending order. The inputs are
+# read in one pass, only the detail rows of the current key are kept in
+# memory.
+
+def _sorted_groups(rows, key, name):
+    """Yields tuples (`key`, `rows`) of consecutive rows with the same key.
+    Rows with empty keys are skipped. Raises an error if the keys are not in
+    ascending order."""
+
+    rows = (row for row in rows if not _is_empty_key(key(row)))
+    previous = None
+    for group_key, group in itertools.groupby(rows, key):
+        if previous is not None and group_key < previous:
+            raise DataObjectError("Rows of %s are not sorted by the join "
+                                  "key" % name)
+        previous = group_key
+        yield (group_key, group)
+
+def sorted_merge_join(master, detail, master_key, detail_key, value_indexes,
+                      inner=True):
+    """Joins `master` rows with `detail` rows, both sorted by the key in
+    ascending order. Arguments are the same as in :func:`hash_join`."""
+
+    detail_values = _values_getter(value_indexes)
+    empty = (None, ) * len(value_indexes)
+
+    groups = _sorted_groups(detail, detail_key, "detail")
+    current = next(groups, None)
+    values = None
+
+    previous = None
+    for row in master:
+        key = master_key(row)
+
+        if _is_empty_key(key):
+            if not inner:
+                yield [*row, *empty]
+            continue
+
+        if previous is not None and key < previous:
+            raise DataObjectError("Rows of master are not sorted by the join "
+                                  "key")
+        previous = key
+
+        while current is not None and current[0] < key:
+            current = next(groups, None)
+            values = None
+
+        if current is not None and current[0] == key:
+            # Detail rows are read only once, kept for duplicate master keys
+            if values is None:
+                values = [detail_values(detail_row)
+                          for detail_row in current[1]]
+            for detail_row in values:
+                yield [*row, *detail_row]
+        elif not inner:
+            yield [*row, *empty]
+
+@merge_join.register("rows", "rows")
+def _(ctx, master, detail, master_key, detail_key, inner=True):
+    """Master-detail join of objects sorted by the join keys in ascending
+    order. Objects are read in one pass and only details of one key are held
+    in memory. Duplicate keys are allowed on both sides. Keys that are not
+    in order raise an error. See `join_details` for the description of the
+    arguments."""
+
+    master_key = prepare_key(master_key)
+    detail_key = prepare_key(detail_key)
+
+    if len(master_key) != len(detail_key):
+        raise ArgumentError("Master key and detail key should have the same "
+                            "number of fields")
+
+    fields = master.fields.clone()
+    value_indexes = []
+    for i, field in enumerate(detail.fields):
         if str(field) not in detail_key:
-            out_fields.append(field)
+            fields.append(field.clone())
+            value_indexes.append(i)
+
+    master_getter = operator.itemgetter(*master.fields.indexes(master_key))
+    detail_getter = operator.itemgetter(*detail.fields.indexes(detail_key))
+
+    iterator = sorted_merge_join(master.rows(), detail.rows(),
+                                 master_getter, detail_getter,
+                                 value_indexes, inner=inner)
+
+    result = IterableDataSource(iterator, fields)
+    result.order_by = master.order_by
+
+    return result
+
+@join_details.register("rows", "rows[]", name="join_details")
+def _(ctx, master, details, joins, inner=True, buffer_size=None):
+    """Star join of `master` with `details`. `joins` is a list of
+    dictionaries with keys `master` and `detail` with the master and detail
+    key (field name or list of fields) for each detail.
+
+    Details are joined one after another, master rows are streamed through
+    hash tables of all the details."""
+
+    if not details:
+        raise ArgumentError("No details provided, nothing to join")
+
+    if not joins:
+        raise ArgumentError("No joins specified")
+
+    if len(details) != len(joins):
+        raise ArgumentError("For every detail there should be a join "
+                            "(%d:%d)." % (len(details), len(joins)))
+
+    result = master
+    for detail, join in zip(details, joins):
+        iterator, fields = _join_detail(result, detail,
+                                        join["master"], join["detail"],
+                                        inner, buffer_size)
+        result = IterableDataSource(iterator, result.fields + fields)
 
-    return IterableDataSource(result, out_fields)
+    return result
 
 
 #############################################################################
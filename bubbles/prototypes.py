@@ -59,19 +59,26 @@ def filter_by_predicate(ctx, obj, predicate, fields, discard=False,
     raise NotImplementedError
 
 @operation
-def distinct(ctx, obj, key=None, is_sorted=False):
+def filter_expression(ctx, obj, expression, discard=False):
     raise NotImplementedError
 
 @operation
-def distinct_rows(ctx, obj, key=None, is_sorted=False):
+def distinct(ctx, obj, key=None, is_sorted=False, buffer_size=None):
     raise NotImplementedError
 
 @operation
-def first_unique(ctx, iterator, keys=None, discard=False):
+def distinct_rows(ctx, obj, key=None, is_sorted=False,
+                  buffer_size=None):
     raise NotImplementedError
 
 @operation
-def sample(ctx, iterator, value, discard=False, mode="first"):
+def first_unique(ctx, iterator, keys=None, discard=False, is_sorted=False,
+                 buffer_size=None):
+    raise NotImplementedError
+
+@operation
+def sample(ctx, iterator, value, discard=False, mode="first", key=None,
+           seed=None):
     raise NotImplementedError
 
 @operation
@@ -83,7 +90,11 @@ def discard_nth(ctx, iterator, step):
 # Ordering
 
 @operation
-def sort(ctx, obj, orderby):
+def sort(ctx, obj, orderby, buffer_size=None):
+    raise NotImplementedError
+
+@operation
+def top_n(ctx, obj, key, orderby, n):
     raise NotImplementedError
 
 
@@ -92,7 +103,11 @@ def sort(ctx, obj, orderby):
 
 @operation
 def aggregate(ctx, obj, key, measures=None, include_count=True,
-      count_field="record_count"):
+      count_field="record_count", is_sorted=False):
+    raise NotImplementedError
+
+@operation
+def window_aggregate(ctx, obj, key, orderby, functions, is_sorted=False):
     raise NotImplementedError
 
 
@@ -149,7 +164,12 @@ def append(ctx, objects):
     raise NotImplementedError
 
 @operation(2)
-def join_details(self, master, detail, master_key, detail_key):
+def join_details(self, master, detail, master_key, detail_key, inner=True,
+                 buffer_size=None):
+    raise NotImplementedError
+
+@operation(2)
+def merge_join(self, master, detail, master_key, detail_key, inner=True):
     raise NotImplementedError
 
 
@@ -186,6 +206,19 @@ def nonempty_count(ctx, obj, fields=None):
 def distinct_count(ctx, obj, fields=None):
     raise NotImplementedError
 
+@operation
+def approx_distinct_count(ctx, obj, fields=None, precision=None):
+    raise NotImplementedError
+
+@operation
+def quantiles(ctx, obj, fields, quantiles=None, compression=None):
+    raise NotImplementedError
+
+@operation
+def histogram(ctx, obj, field, bins=10, low=None, high=None,
+              compression=None):
+    raise NotImplementedError
+
 #############################################################################
 # Audit
 
@@ -233,6 +266,10 @@ def fetch_all(ctx, obj):
 def as_dict(ctx, obj, key=None, value=None):
     raise NotImplementedError
 
+@operation
+def as_batches(ctx, obj, batch_size=None):
+    raise NotImplementedError
+
 #############################################################################
 # Assertions
 
@@ -248,12 +285,5 @@ def assert_contains(ctx, obj, field, value):
 def assert_missing(ctx, obj, field, value):
     raise NotImplementedError
 
-@operation
-def _(ctx, obj, field, value):
-    raise NotImplementedError
-
-@operation
-def _(ctx, obj, field, value):
-    raise NotImplementedError
 
 
@@ -7,17 +7,166 @@ import urllib.request
 import urllib.parse
 import codecs
 import json
+import io
+import os.path
+import threading
+import queue
+import gzip
+import bz2
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    from .common import MissingPackage
+    zstandard = MissingPackage("zstandard", "Zstandard compressed files",
+                               "https://github.com/indygreg/python-zstandard")
 
 __all__ = (
     "Resource",
     "is_local",
     "read_json",
+    "compression_from_path",
+    "resolve_compression",
+    "open_compressed",
 )
 
+# File extension -> compression
+_compression_extensions = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zst": "zstd",
+}
+
+COMPRESSIONS = ("gzip", "bz2", "xz", "zstd")
+
+def compression_from_path(path):
+    """Returns name of compression of file `path` (local path or URL)
+    according to its extension: ``gzip``, ``bz2``, ``xz``, ``zstd`` or
+    `None` if the file is not compressed."""
+    # Plain paths may contain '#' or '?', only URLs are parsed
+    if path.startswith("file:") or not is_local(path):
+        path = urllib.parse.urlparse(path).path
+    ext = os.path.splitext(path)[1].lower()
+    return _compression_extensions.get(ext)
+
+def resolve_compression(compression, path):
+    """Returns compression name. `compression` ``infer`` is resolved from
+    the `path` extension."""
+
+    if compression == "infer":
+        if not isinstance(path, str):
+            return None
+        return compression_from_path(path)
+    elif compression and compression not in COMPRESSIONS:
+        raise ArgumentError("Unknown compression '%s'. Supported: %s"
+                            % (compression, ", ".join(COMPRESSIONS)))
+    return compression or None
+
+def open_compressed(fileobj, mode, compression):
+    """Returns a binary stream that reads (mode ``rb``) or writes (``wb``
+    or ``ab``) `compression` compressed data from or to a binary file object
+    `fileobj`. Closing the returned stream does not close the `fileobj`."""
+
+    if mode not in ("rb", "wb", "ab"):
+        raise ArgumentError("Invalid mode '%s' of compressed stream" % mode)
+
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode=mode)
+    elif compression == "bz2":
+        return bz2.BZ2File(fileobj, mode=mode)
+    elif compression == "xz":
+        return lzma.LZMAFile(fileobj, mode=mode)
+    elif compression == "zstd":
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(fileobj,
+                                                read_across_frames=True,
+                                                closefd=False)
+        else:
+            return zstandard.ZstdCompressor().stream_writer(fileobj,
+                                                            closefd=False)
+    else:
+        raise ArgumentError("Unknown compression '%s'" % (compression, ))
+
+
+# Threaded Reader
+# ===============
+#
+# Decompression of a stream is done in a background thread that reads blocks
+# of the decompressed data into a bounded queue. Decompressors release the
+# GIL while decompressing, so decompression runs in parallel with the
+# consumer, such as a CSV parser.
+
+_THREAD_BLOCK_SIZE = 1024 * 1024
+_THREAD_QUEUE_SIZE = 4
+
+class _ThreadedReader(io.RawIOBase):
+    def __init__(self, stream):
+        """Raw binary stream with data read from `stream` in a background
+        thread."""
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=_THREAD_QUEUE_SIZE)
+        self.stopped = False
+        self.block = b""
+        self.eof = False
+
+        self.thread = threading.Thread(target=self._read_blocks,
+                                       name="Resource reader",
+                                       daemon=True)
+        self.thread.start()
+
+    def _read_blocks(self):
+        try:
+            while not self.stopped:
+                block = self.stream.read(_THREAD_BLOCK_SIZE)
+                self.queue.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.block:
+            if self.eof:
+                return 0
+
+            block = self.queue.get()
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            elif not block:
+                self.eof = True
+                return 0
+
+            self.block = memoryview(block)
+
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            # Unblock the thread waiting for free space in the queue
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.stream.close()
+        super().close()
+
 
 class Resource(ContextDecorator):
     def __init__(self, url=None, handle=None, opener=None, encoding=None,
-                 binary=False):
+                 binary=False, compression="infer", threaded=True):
         """Creates a data resource for reading. Arguments:
 
         * `url` – resource URL or a local path
@@ -29,6 +178,12 @@ class Resource(ContextDecorator):
           opener
         * `binary` – `True` if the resource is binary, `False` (default) if it
           is a text
+        * `compression` – ``gzip``, ``bz2``, ``xz`` or ``zstd`` (requires
+          the `zstandard` package). Default ``infer`` determines compression
+          from the URL extension, such as ``.csv.gz``. `None` means no
+          compression.
+        * `threaded` – if `True` (default) then compressed data are
+          decompressed in a background thread
 
         The resource can be used as a context manager: `with Resource(url) as
         f: ...`.
@@ -42,8 +197,16 @@ class Resource(ContextDecorator):
         self.url = url
         self.binary = binary
         self.encoding = encoding
+        self.threaded = threaded
+
+        if handle is None:
+            self.compression = resolve_compression(compression, url)
+        else:
+            self.compression = None
 
         self.reader = None
+        # Underlying file of a compressed resource
+        self.raw_handle = None
 
         if not opener:
             if is_local(url):
@@ -67,6 +230,9 @@ class Resource(ContextDecorator):
         if self.handle:
             return self.handle
 
+        if self.compression:
+            return self._open_compressed()
+
         if self.opener:
             self.handle = self.opener(self.url)
         else:
@@ -77,9 +243,28 @@ class Resource(ContextDecorator):
 
         return self.handle
 
+    def _open_compressed(self):
+        if self.opener:
+            self.raw_handle = self.opener(self.url)
+        else:
+            self.raw_handle = open(self.url, mode="rb")
+
+        stream = open_compressed(self.raw_handle, "rb", self.compression)
+
+        if self.threaded:
+            stream = io.BufferedReader(_ThreadedReader(stream))
+
+        if not self.binary:
+            stream = io.TextIOWrapper(stream, encoding=self.encoding)
+
+        self.handle = stream
+        return self.handle
+
     def close(self):
         if self.should_close:
             self.handle.close()
+        if self.raw_handle is not None:
+            self.raw_handle.close()
 
     def __enter__(self):
         return self.open()
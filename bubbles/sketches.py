@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""Probabilistic data sketches – compact summaries of large data streams."""
+
+from hashlib import blake2b
+from math import log, asin, sin, pi
+from .errors import *
+
+__all__ = (
+        "HyperLogLog",
+        "TDigest",
+        "sketch_hash",
+    )
+
+def sketch_hash(value):
+    """Returns 64-bit hash of `value`. The hash is computed from the value's
+    `repr()`, therefore it is stable between processes and platforms (unlike
+    `hash()` of strings) and sketches built in different processes can be
+    merged. Note that values with different representations, such as ``1``
+    and ``1.0``, have different hashes."""
+
+    digest = blake2b(repr(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+# HyperLogLog
+# ===========
+#
+# The 64-bit hash of a value is split into a register index – the first
+# `precision` bits – and the rest. A register keeps the maximal position of
+# the first set bit of the rest seen so far. The number of distinct values is
+# estimated from the harmonic mean of the registers, small cardinalities are
+# estimated by linear counting of empty registers.
+#
+# Memory used is 2^precision bytes regardless of the number of values, the
+# relative standard error is 1.04/sqrt(2^precision) – about 0.8% for the
+# default precision 14.
+
+DEFAULT_HLL_PRECISION = 14
+
+class HyperLogLog(object):
+    def __init__(self, precision=None):
+        """Creates an empty HyperLogLog sketch for estimating number of
+        distinct values. `precision` is number of bits used for register
+        index, between 4 and 18, default is 14.
+
+        Sketches of the same precision can be merged: the merged sketch is
+        the same as if it was built from all the values of both sketches.
+        """
+
+        precision = precision or DEFAULT_HLL_PRECISION
+        if not 4 <= precision <= 18:
+            raise ArgumentError("HyperLogLog precision should be between "
+                                "4 and 18, is %s" % (precision, ))
+
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """Adds `value` to the sketch. Value should have stable `repr()`."""
+        self.add_hash(sketch_hash(value))
+
+    def add_hash(self, hashed):
+        """Adds a 64-bit hash of a value to the sketch. Use this method if
+        the values are hashed by other means than `sketch_hash()`."""
+
+        index = hashed >> (64 - self.precision)
+        # Remaining bits with a stop bit, so the rank is at most
+        # 64 - precision + 1
+        rest_bits = 64 - self.precision
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """Adds all `values` to the sketch."""
+        registers = self.registers
+        rest_bits = 64 - self.precision
+        mask = (1 << rest_bits) - 1
+
+        for value in values:
+            digest = blake2b(repr(value).encode("utf-8"),
+                             digest_size=8).digest()
+            hashed = int.from_bytes(digest, "little")
+            index = hashed >> rest_bits
+            rank = rest_bits - (hashed & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        """Merges `other` sketch into the receiver."""
+        if other.precision != self.precision:
+            raise ArgumentError("Can not merge HyperLogLog sketches of "
+                                "different precision (%s and %s)"
+                                % (self.precision, other.precision))
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def copy(self):
+        """Returns a copy of the sketch."""
+        sketch = HyperLogLog(self.precision)
+        sketch.registers = bytearray(self.registers)
+        return sketch
+
+    def count(self):
+        """Returns estimated number of distinct values added to the
+        sketch."""
+
+        m = len(self.registers)
+
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * log(float(m) / zeros)
+
+        return int(round(estimate))
+
+    def __or__(self, other):
+        sketch = self.copy()
+        sketch.merge(other)
+        return sketch
+
+
+
+# t-digest
+# ========
+#
+# Distribution of numeric values is summarized by a sorted list of centroids
+# – (mean, weight) pairs. Centroids near the tails of the distribution are
+# kept small and centroids in the middle may be large, which gives accurate
+# extreme quantiles (p99, p999) with a bounded number of centroids. Size of
+# the centroids is limited by the k1 scale function
+#
+#     k(q) = compression / (2 pi) * asin(2q - 1)
+#
+# a centroid covers at most one unit of k. New values are collected in a
+# buffer which is merged with the centroids when it is full.
+#
+# Memory used is proportional to `compression` regardless of the number of
+# values.
+
+DEFAULT_TDIGEST_COMPRESSION = 100
+
+class TDigest(object):
+    def __init__(self, compression=None):
+        """Creates an empty t-digest for estimating quantiles of numeric
+        values. Higher `compression` (default 100) means more centroids and
+        more accurate estimates.
+
+        Digests can be merged – the merged digest estimates quantiles of all
+        values of both digests."""
+
+        compression = compression or DEFAULT_TDIGEST_COMPRESSION
+        if compression < 10:
+            raise ArgumentError("t-digest compression should be at least 10, "
+                                "is %s" % (compression, ))
+
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.total = 0
+        self.min = None
+        self.max = None
+
+        self._buffer = []
+        self._buffer_size = int(5 * compression)
+
+    def add(self, value, weight=1):
+        """Adds a numeric `value` with `weight` to the digest."""
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= self._buffer_size:
+            self._compress()
+
+    def update(self, values):
+        """Adds all numeric `values` to the digest."""
+        buffer = self._buffer
+        size = self._buffer_size
+        for value in values:
+            buffer.append((value, 1))
+            if len(buffer) >= size:
+                self._compress()
+
+    def merge(self, other):
+        """Merges `other` digest into the receiver."""
+        other._compress()
+        if not other.means:
+            return
+
+        self._buffer += zip(other.means, other.weights)
+        self._compress()
+
+        # Extremes of the other digest are not centroid means
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+
+    def copy(self):
+        """Returns a copy of the digest."""
+        self._compress()
+        digest = TDigest(self.compression)
+        digest.means = list(self.means)
+        digest.weights = list(self.weights)
+        digest.total = self.total
+        digest.min = self.min
+        digest.max = self.max
+        return digest
+
+    def __or__(self, other):
+        digest = self.copy()
+        digest.merge(other)
+        return digest
+
+    def _compress(self):
+        """Merges buffered values into centroids."""
+
+        if not self._buffer:
+            return
+
+        items = list(zip(self.means, self.weights)) + self._buffer
+        items.sort(key=lambda item: item[0])
+        # Buffer is cleared in place, `update()` holds a reference to it
+        del self._buffer[:]
+
+        if self.min is None or items[0][0] < self.min:
+            self.min = items[0][0]
+        if self.max is None or items[-1][0] > self.max:
+            self.max = items[-1][0]
+
+        total = self.total = sum(weight for mean, weight in items)
+        scale = self.compression / (2 * pi)
+
+        def limit(weight_so_far):
+            # Weight at which the current centroid spans one unit of k
+            k = scale * asin(2 * weight_so_far / total - 1) + 1
+            if k >= scale * pi / 2:
+                return total
+            return total * (sin(k / scale) + 1) / 2
+
+        means = []
+        weights = []
+
+        mean, weight = items[0]
+        weight_so_far = 0
+        weight_limit = limit(0)
+
+        for item_mean, item_weight in items[1:]:
+            if weight_so_far + weight + item_weight <= weight_limit:
+                weight += item_weight
+                mean += (item_mean - mean) * item_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                weight_so_far += weight
+                weight_limit = limit(weight_so_far)
+                mean, weight = item_mean, item_weight
+
+        means.append(mean)
+        weights.append(weight)
+
+        self.means = means
+        self.weights = weights
+
+    def count(self):
+        """Returns total weight of values added to the digest."""
+        self._compress()
+        return self.total
+
+    def quantile(self, q):
+        """Returns estimated value at quantile `q` (between 0 and 1) or
+        ``None`` if the digest is empty."""
+
+        if not 0 <= q <= 1:
+            raise ArgumentError("Quantile should be between 0 and 1, is %s"
+                                % (q, ))
+
+        self._compress()
+        if not self.means:
+            return None
+
+        index = q * self.total
+        cumulative = 0
+        prev_mean = self.min
+        prev_mid = 0
+
+        for mean, weight in zip(self.means, self.weights):
+            mid = cumulative + weight / 2
+            if index < mid:
+                return prev_mean + (mean - prev_mean) \
+                            * (index - prev_mid) / (mid - prev_mid)
+            prev_mean, prev_mid = mean, mid
+            cumulative += weight
+
+        if self.total == prev_mid:
+            return self.max
+
+        return prev_mean + (self.max - prev_mean) \
+                    * (index - prev_mid) / (self.total - prev_mid)
+
+    def cdf(self, value):
+        """Returns estimated fraction of values that are less than or equal
+        to `value` or ``None`` if the digest is empty."""
+
+        self._compress()
+        if not self.means:
+            return None
+
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+
+        cumulative = 0
+        prev_mean = self.min
+        prev_mid = 0
+
+        for mean, weight in zip(self.means, self.weights):
+            mid = cumulative + weight / 2
+            if value < mean:
+                fraction = (value - prev_mean) / (mean - prev_mean)
+                return (prev_mid + fraction * (mid - prev_mid)) / self.total
+            prev_mean, prev_mid = mean, mid
+            cumulative += weight
+
+        fraction = (value - prev_mean) / (self.max - prev_mean)
+        return (prev_mid + fraction * (self.total - prev_mid)) / self.total
@@ -4,6 +4,7 @@ from .errors import *
 from .metadata import *
 from .extensions import Extensible, extensions
 from .objects import data_object
+from .resource import compression_from_path
 import os.path
 
 __all__ = [
@@ -132,23 +133,38 @@ class FileSystemStore(DataStore):
 
         * `csv` - CSV source object (read-only)
         * `xls` – MS Excel object
+
+        CSV files might be compressed, for example ``data.csv.gz``. See
+        :class:`Resource` for supported compressions.
         """
 
         super().__init__()
         self.path = path
 
-    def get_object(self, name):
+    def get_object(self, name, compression="infer", **options):
         """Returns a CSVSource object with filename constructed from store's
-        path and extension"""
+        path and extension. `compression` is passed to the CSV source, the
+        default ``infer`` determines it from the extension. Only CSV files
+        might be compressed. `options` are passed to the object."""
         path = os.path.join(self.path, name)
-        ext = os.path.splitext(name)[1]
 
+        base = name
+        if compression_from_path(name):
+            base = os.path.splitext(name)[0]
+
+        ext = os.path.splitext(base)[1]
         ext = ext[1:] if ext else ext
 
+        if ext != "csv" and (base != name
+                             or compression not in ("infer", None)):
+            raise ArgumentError("Compressed '%s' files are not supported"
+                                % ext)
+
         if ext == "csv":
-            return data_object("csv_source", path)
+            return data_object("csv_source", path, compression=compression,
+                               **options)
         elif ext == "xls":
-            return data_object("xls", path)
+            return data_object("xls", path, **options)
         else:
             raise ArgumentError("Unknown extension '%s'" % ext)
 
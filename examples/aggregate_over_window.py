@@ -33,13 +33,10 @@ p.source_object("iterable_data_source", iterable=data, fields=fields)
 # Uncomment this to get SQL operations instead of python iterator
 p.create("default", "data")
 
-# Find last purchase date
-last_purchase = p.fork()
-last_purchase.aggregate(["customer_id"],
-                        [["year", "max"]],
-                        include_count=False)
-last_purchase.rename_fields({"year_max": "last_purchase_year"})
-p.join_details(last_purchase, "customer_id", "customer_id")
+# Find last purchase date and running total of the customer in one pass
+p.window_aggregate("customer_id", "year",
+                   [["year", "max"], ["amount", "running_sum"]])
+p.rename_fields({"year_max": "last_purchase_year"})
 
 p.pretty_print()
 
@@ -0,0 +1,46 @@
+import unittest
+
+from bubbles import FieldList, OperationContext
+from bubbles.backends.mongo.objects import MongoDBCollection
+import bubbles.backends.mongo.ops
+
+class GroupingCollection(object):
+    """Collection that records conditions of the group requests"""
+    def __init__(self):
+        self.conditions = []
+
+    def group(self, key, condition, initial, reduce):
+        self.conditions.append(condition)
+        return [{"year": 2013}]
+
+class MongoBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = OperationContext()
+        self.context.add_operations_from(bubbles.backends.mongo.ops)
+
+        self.collection = GroupingCollection()
+        self.obj = MongoDBCollection(self.collection,
+                                     FieldList("year", "amount"),
+                                     store=object(), expand=False)
+
+    def test_filter_distinct(self):
+        ops = self.context.op
+
+        obj = ops.filter_expression(self.obj, "amount > 100")
+        self.assertEqual({"amount": {"$gt": 100}}, obj.query)
+
+        result = ops.distinct(obj, "year")
+        self.assertEqual([[2013]], [list(row) for row in result.rows()])
+        self.assertEqual([{"amount": {"$gt": 100}}],
+                         self.collection.conditions)
+
+        ops.distinct(self.obj, "year")
+        self.assertEqual({}, self.collection.conditions[-1])
+
+    def test_filter_discard(self):
+        obj = self.context.op.filter_expression(self.obj, "amount != 100",
+                                                discard=True)
+        self.assertEqual({"amount": 100}, obj.query)
+
+if __name__ == "__main__":
+    unittest.main()
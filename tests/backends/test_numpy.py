@@ -0,0 +1,127 @@
+import unittest
+from datetime import date
+
+from bubbles import FieldList, IterableDataSource, OperationContext
+from bubbles.backends.numpy.objects import BatchesDataSource
+import bubbles.backends.numpy.ops
+import bubbles.ops.rows
+
+class NumPyBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = OperationContext()
+        self.context.add_operations_from(bubbles.ops.rows)
+        self.context.add_operations_from(bubbles.backends.numpy.ops)
+
+        self.fields = FieldList(("id", "integer"),
+                                ("category", "string"),
+                                ("amount", "number"),
+                                ("day", "date"),
+                                ("code", "string"))
+        self.data = [
+            (i, "ab"[i % 2], i * 1.5, date(2013, 1 + i % 12, 1 + i % 28),
+             str(i))
+            for i in range(100)
+        ]
+
+    def batches(self, batch_size=16):
+        source = IterableDataSource(iter(self.data), self.fields)
+        return self.context.op.as_batches(source, batch_size=batch_size)
+
+    def test_conversion(self):
+        obj = self.batches()
+
+        self.assertIsInstance(obj, BatchesDataSource)
+        self.assertEqual(self.data, list(obj.rows()))
+
+        batch = next(self.batches().batches())
+        self.assertEqual(16, len(batch[0]))
+        self.assertEqual("int64", batch[0].dtype.name)
+        self.assertEqual("object", batch[1].dtype.name)
+
+    def test_missing_values(self):
+        data = [(1, None, None, None, None), (2, "a", 1.0, None, None)]
+        source = IterableDataSource(iter(data), self.fields)
+        obj = self.context.op.as_batches(source)
+        self.assertEqual(data, list(obj.rows()))
+
+    def test_filters(self):
+        obj = self.batches()
+        obj = self.context.op.filter_by_range(obj, "id", 10, 50)
+        obj = self.context.op.filter_by_set(obj, "category", ["a"])
+        obj = self.context.op.filter_by_value(obj, "id", 20, discard=True)
+
+        self.assertIsInstance(obj, BatchesDataSource)
+
+        expected = [row for row in self.data
+                    if 10 <= row[0] <= 50 and row[1] == "a" and row[0] != 20]
+        self.assertEqual(expected, list(obj.rows()))
+
+    def test_aggregate(self):
+        obj = self.context.op.aggregate(self.batches(), "category",
+                                        ["amount", ("id", "min"),
+                                         ("id", "max"), ("id", "average")])
+
+        self.assertEqual(["category", "amount_sum", "id_min", "id_max",
+                          "id_average", "record_count"], obj.fields.names())
+
+        result = sorted(obj.rows())
+        self.assertEqual([("a", 3675.0, 0, 98, 49.0, 50),
+                          ("b", 3750.0, 1, 99, 50.0, 50)], result)
+
+    def test_aggregate_missing_values(self):
+        data = [(1, "a", 1.0, None, None), (2, "a", None, None, None),
+                (3, "b", None, None, None)]
+        source = IterableDataSource(iter(data), self.fields)
+        obj = self.context.op.as_batches(source)
+
+        obj = self.context.op.aggregate(obj, "category",
+                                        [("amount", "sum"),
+                                         ("amount", "max"),
+                                         ("amount", "average")])
+        self.assertEqual([("a", 1.0, 1.0, 1.0, 2),
+                          ("b", 0, None, None, 1)], sorted(obj.rows()))
+
+    def test_retype_and_split_date(self):
+        obj = self.context.op.retype(self.batches(), {"code": "integer"})
+        obj = self.context.op.split_date(obj, "day")
+
+        self.assertEqual(["id", "category", "amount", "day_year",
+                          "day_month", "day_day", "code"],
+                         obj.fields.names())
+
+        rows = list(obj.rows())
+        self.assertEqual((13, "b", 19.5, 2013, 2, 14, 13), rows[13])
+
+    def test_split_date_missing_values(self):
+        fields = FieldList(("day", "date"), ("id", "integer"))
+        data = [(date(2013, 2, 3), 1), (None, 2)]
+        obj = self.context.op.as_batches(IterableDataSource(iter(data),
+                                                            fields))
+        obj = self.context.op.split_date(obj, "day")
+
+        self.assertEqual([(2013, 2, 3, 1), (None, None, None, 2)],
+                         list(obj.rows()))
+
+    def test_retype_python_types(self):
+        fields = FieldList(("id", "integer"), ("shape", "string"))
+        data = [(1, '{"type": "Point", "coordinates": [1, 2]}')]
+        source = IterableDataSource(iter(data), fields)
+        obj = self.context.op.as_batches(source)
+
+        obj = self.context.op.retype(obj, {"shape": "geojson"})
+        self.assertIsInstance(obj, BatchesDataSource)
+        self.assertEqual([(1, {"type": "Point", "coordinates": [1, 2]})],
+                         list(obj.rows()))
+
+        # Conversions without batches converter are retried on rows
+        obj = self.context.op.retype(self.batches(), {"code": "array"})
+        self.assertNotIsInstance(obj, BatchesDataSource)
+        self.assertEqual("array", obj.fields["code"].storage_type)
+
+    def test_retained(self):
+        obj = self.batches().retained(2)
+        first = obj.rows()
+        second = obj.rows()
+
+        self.assertEqual(self.data, list(first))
+        self.assertEqual(self.data, list(second))
@@ -1,10 +1,11 @@
 import unittest
 from ..common import data_path
 
-from bubbles import FieldList, OperationContext
+from bubbles import FieldList, IterableDataSource, OperationContext
 from bubbles.errors import ProbeAssertionError
 from bubbles.backends.sql.objects import SQLDataStore
 import bubbles.backends.sql.ops
+import bubbles.ops.rows
 
 class SQLBackendTestCase(unittest.TestCase):
     def setUp(self):
@@ -22,6 +23,37 @@ class SQLBackendTestCase(unittest.TestCase):
         result = self.context.op.distinct(self.table)
         self.assertEqual(3, len(list(result.rows())))
 
+    def test_approx_distinct_count(self):
+        result = self.context.op.approx_distinct_count(self.table, ["a", "b"])
+        self.assertEqual([(1, 2)], list(result.rows()))
+
+    def test_sample(self):
+        result = self.context.op.sample(self.table, 2, mode="random")
+        rows = list(result.rows())
+        self.assertEqual(2, len(rows))
+        self.assertEqual(2, len(set(tuple(row) for row in rows)))
+
+        result = self.context.op.sample(self.table, 1, mode="bernoulli")
+        self.assertEqual(3, len(list(result.rows())))
+
+        result = self.context.op.sample(self.table, 1, discard=True)
+        self.assertEqual([(1, 2, 4), (1, 3, 5)], list(result.rows()))
+
+    def test_top_n(self):
+        result = self.context.op.top_n(self.table, "b", [("c", "desc")], 1)
+        self.assertEqual(["a", "b", "c"], result.fields.names())
+        self.assertEqual([(1, 2, 4), (1, 3, 5)], list(result.rows()))
+
+    def test_window_aggregate(self):
+        result = self.context.op.window_aggregate(self.table, "a", "c",
+                                                  [("c", "running_sum"),
+                                                   ("c", "lag"), "rank"])
+        self.assertEqual(["a", "b", "c", "c_running_sum", "c_lag", "rank"],
+                         result.fields.names())
+        self.assertEqual([(1, 2, 3, 3, None, 1), (1, 2, 4, 7, 3, 2),
+                          (1, 3, 5, 12, 4, 3)],
+                         [tuple(row) for row in result.rows()])
+
     def test_assert_unique(self):
         self.context.op.assert_unique(self.table, 'c')
 
@@ -39,3 +71,49 @@ class SQLBackendTestCase(unittest.TestCase):
 
         with self.assertRaises(ProbeAssertionError):
             self.context.op.assert_missing(self.table, 'a', 1)
+
+    def test_filter_by_set(self):
+        result = self.context.op.filter_by_set(self.table, 'c', [3, 5])
+        self.assertEqual([(1, 2, 3), (1, 3, 5)], list(result.rows()))
+
+        result = self.context.op.filter_by_set(self.table, 'c', [3, 5],
+                                               discard=True)
+        self.assertEqual([(1, 2, 4)], list(result.rows()))
+
+    def test_filter_expression(self):
+        result = self.context.op.filter_expression(self.table,
+                                                   "b = 2 and c > 3 or c = 5")
+        self.assertEqual([(1, 2, 4), (1, 3, 5)], list(result.rows()))
+
+        result = self.context.op.filter_expression(self.table, "c - a < 3",
+                                                   discard=True)
+        self.assertEqual([(1, 2, 4), (1, 3, 5)], list(result.rows()))
+
+        # Rows with NULL values are neither selected nor kept by discard
+        self.table.append_from_iterable([(1, None, 6)])
+        result = self.context.op.filter_expression(self.table, "b > 2")
+        self.assertEqual([(1, 3, 5)], list(result.rows()))
+
+        result = self.context.op.filter_expression(self.table, "b > 2",
+                                                   discard=True)
+        self.assertEqual([(1, 2, 3), (1, 2, 4)], list(result.rows()))
+
+    def test_filter_expression_rows_parity(self):
+        self.context.add_operations_from(bubbles.ops.rows)
+        self.table.append_from_iterable([(1, None, 7)])
+        rows = IterableDataSource(list(self.table.rows()), self.table.fields)
+
+        for expression in ("b = null", "not (b = null)", "b != null",
+                           "c / 2 = 3", "c / 2 > 2"):
+            for discard in (False, True):
+                expected = self.context.op.filter_expression(rows, expression,
+                                                             discard=discard)
+                result = self.context.op.filter_expression(self.table,
+                                                           expression,
+                                                           discard=discard)
+                self.assertEqual(list(expected.rows()), list(result.rows()),
+                                 "%s (discard=%s)" % (expression, discard))
+
+    def test_filter_by_range(self):
+        result = self.context.op.filter_by_range(self.table, 'c', None, 4)
+        self.assertEqual([(1, 2, 3), (1, 2, 4)], list(result.rows()))
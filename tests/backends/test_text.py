@@ -1,9 +1,18 @@
 import unittest
+import tempfile
+import shutil
+import csv
+import os
+import gzip
+from datetime import date
 from ..common import data_path
 
 from bubbles.errors import *
 from bubbles.backends.text.objects import CSVSource, CSVTarget
+from bubbles.backends.text.objects import ParallelCSVSource
 from bubbles.metadata import FieldList
+from bubbles.resource import Resource, compression_from_path
+from bubbles.stores import FileSystemStore
 
 class TextBackendTestCase(unittest.TestCase):
     def test_load(self):
@@ -50,5 +59,218 @@ class TextBackendTestCase(unittest.TestCase):
         obj_utf.release()
         self.assertEqual(rows_l2, rows_utf)
 
+    def test_retained(self):
+        obj = CSVSource(data_path("fruits-sk.csv"))
+        retained = obj.retained(2)
+
+        self.assertFalse(retained.is_consumable())
+        self.assertEqual(["id", "fruit", "type"], retained.fields.names())
+
+        first = list(retained.rows())
+        second = list(retained.rows())
+        self.assertEqual(16, len(first))
+        self.assertEqual(first, second)
+
+        records = list(retained.records())
+        self.assertEqual("jablko", records[0]["fruit"])
+
+    def test_conversion(self):
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+
+        with os.fdopen(handle, "w") as f:
+            f.write("id,amount,day\n")
+            f.write("1,10.5,2013-01-01\n")
+            f.write("2,,2013-01-01\n")
+            f.write("x,bad,2013-01-02\n")
+            f.write("4,n/a,2013-01-01,extra\n")
+
+        fields = FieldList(("id", "integer"), ("amount", "number"),
+                           ("day", "date"))
+        fields["amount"].missing_value = "n/a"
+        converters = {
+            "integer": int,
+            "number": float,
+            "date": lambda value: date(*map(int, value.split("-")))
+        }
+
+        obj = CSVSource(path, fields=fields, type_converters=converters,
+                        batch_size=2)
+        rows = list(obj.rows())
+        obj.release()
+
+        self.assertEqual([1, 10.5, date(2013, 1, 1)], rows[0])
+        self.assertEqual([2, None, date(2013, 1, 1)], rows[1])
+        self.assertEqual([None, None, date(2013, 1, 2)], rows[2])
+        self.assertEqual([4, None, date(2013, 1, 1), "extra"], rows[3])
+        self.assertEqual({"id": 1, "amount": 1}, obj.conversion_errors)
+
+        obj = CSVSource(path, fields=fields, type_converters=converters,
+                        strict=True)
+        with self.assertRaises(ValueError):
+            list(obj.rows())
+        obj.release()
+
+    def test_target(self):
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        fields = FieldList("id", "name")
+        rows = [[i, "name %d" % i] for i in range(100)]
+
+        for threaded in (False, True):
+            target = CSVTarget(path, fields=fields, batch_size=7,
+                               threaded=threaded)
+            target.append(["first", "row"])
+            target.append_from(rows)
+            target.append(["last", "row"])
+            target.finalize()
+
+            obj = CSVSource(path)
+            result = list(obj.rows())
+            obj.release()
+
+            self.assertEqual(102, len(result))
+            self.assertEqual(["first", "row"], result[0])
+            self.assertEqual(["10", "name 10"], result[11])
+            self.assertEqual(["last", "row"], result[-1])
+
+        # Rows are written as appended even if the caller reuses them
+        def reused_rows():
+            row = [None, None]
+            for i in range(3):
+                row[:] = [i, i * 10]
+                yield row
+
+        for threaded in (False, True):
+            target = CSVTarget(path, fields=fields, batch_size=7,
+                               threaded=threaded)
+            for row in reused_rows():
+                target.append(row)
+            target.append_from(reused_rows())
+            target.finalize()
+
+            obj = CSVSource(path)
+            result = list(obj.rows())
+            obj.release()
+
+            self.assertEqual([["0", "0"], ["1", "10"], ["2", "20"]] * 2,
+                             result)
+
+        # Errors of the writer thread are raised in the caller
+        target = CSVTarget(path, fields=fields, threaded=True)
+        with self.assertRaises(csv.Error):
+            target.append_from([[1, "one"], 2])
+        target.finalize()
+
+    def test_compression(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        fields = FieldList("id", "name")
+        rows = [[str(i), "name %d" % i] for i in range(100)]
+
+        for name in ("data.csv.gz", "data.csv.bz2", "data.csv.xz"):
+            target = CSVTarget(os.path.join(path, name), fields=fields,
+                               threaded=True)
+            target.append_from(rows)
+            target.finalize()
+
+            with open(os.path.join(path, name), "rb") as f:
+                self.assertNotIn(b"name 10", f.read())
+
+            obj = FileSystemStore(path).get_object(name)
+            self.assertEqual(rows, list(obj.rows()))
+            obj.release()
+
+        # Explicit compression and decompression in the caller's thread
+        name = os.path.join(path, "data.txt")
+        target = CSVTarget(name, fields=fields, compression="gzip")
+        target.append_from(rows)
+        target.finalize()
+
+        resource = Resource(name, compression="gzip", threaded=False)
+        with resource as f:
+            self.assertEqual("id,name", f.readline().strip())
+        with self.assertRaises(ArgumentError):
+            Resource(name, compression="zip")
+
+    def test_store_compression(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        store = FileSystemStore(path)
+
+        for name in ("data.csv.gz", "plain.csv", "data.xls.gz"):
+            with gzip.open(os.path.join(path, name), "wt") as f:
+                f.write("id,name\n1,one\n")
+
+        obj = store.get_object("data.csv.gz")
+        self.assertEqual([["1", "one"]], list(obj.rows()))
+        obj.release()
+
+        # Explicit compression of a file without compression extension
+        obj = store.get_object("plain.csv", compression="gzip")
+        self.assertEqual([["1", "one"]], list(obj.rows()))
+        obj.release()
+
+        with self.assertRaisesRegex(ArgumentError, "Compressed 'xls'"):
+            store.get_object("data.xls.gz")
+
+    def test_compression_special_path(self):
+        handle, path = tempfile.mkstemp(prefix="data#1?", suffix=".csv.gz")
+        self.addCleanup(os.remove, path)
+
+        with os.fdopen(handle, "wb") as raw, gzip.open(raw, "wt") as f:
+            f.write("id,name\n1,one\n")
+
+        self.assertEqual("gzip", compression_from_path(path))
+        self.assertEqual("gzip",
+                         compression_from_path("http://localhost/a.csv.gz?x"))
+        self.assertEqual([["1", "one"]], list(CSVSource(path).rows()))
+
+    def test_parallel(self):
+        obj = CSVSource(data_path("fruits-sk.csv"))
+        expected = list(obj.rows())
+        obj.release()
+
+        obj = ParallelCSVSource(data_path("fruits-sk.csv"), chunk_size=40,
+                                workers=2)
+        self.assertEqual(["id", "fruit", "type"], obj.fields.names())
+        self.assertFalse(obj.is_consumable())
+        self.assertEqual(expected, list(obj.rows()))
+
+        obj = ParallelCSVSource(data_path("fruits-sk.csv"), chunk_size=40,
+                                workers=2, keep_order=False)
+        self.assertEqual(sorted(expected), sorted(obj.rows()))
+
+    def test_parallel_quoted_newlines(self):
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+
+        with os.fdopen(handle, "w", newline="") as f:
+            f.write('skip\nid,text\n')
+            for i in range(200):
+                f.write('%d,"line\n""%d""\n"\n' % (i, i))
+
+        obj = ParallelCSVSource(path, skip_rows=1, chunk_size=7, workers=2)
+        rows = list(obj.rows())
+        self.assertEqual(200, len(rows))
+        self.assertEqual(["13", 'line\n"13"\n'], rows[13])
+
+        with self.assertRaises(ArgumentError):
+            ParallelCSVSource("http://localhost/data.csv")
+
+    def test_parallel_special_path(self):
+        handle, path = tempfile.mkstemp(prefix="data#1?", suffix=".csv")
+        self.addCleanup(os.remove, path)
+
+        with os.fdopen(handle, "w", newline="") as f:
+            f.write("id,name\n1,one\n2,two\n")
+
+        obj = ParallelCSVSource(path, workers=2)
+        self.assertEqual(path, obj.path)
+        self.assertEqual([["1", "one"], ["2", "two"]], list(obj.rows()))
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 from bubbles import *
+import bubbles.prototypes
 # import bubbles.iterator
 
 # FIXME: clean this up
@@ -236,6 +237,36 @@ class OperationTestCase(unittest.TestCase):
         result = c.op.upper(obj)
         self.assertEqual(list("WINDCHIMES"), result)
 
+    def test_dispatch_cache(self):
+        op = Operation("upper")
+        @op.register("text")
+        def _(ctx, obj):
+            return "text"
+
+        c = OperationContext()
+        c.add_operation(op)
+
+        obj = TextObject("windchimes")
+        self.assertEqual("text", c.op.upper(obj))
+        self.assertEqual(1, len(c._dispatch_cache))
+
+        # New registration invalidates the cached order
+        @op.register("rows")
+        def _(ctx, obj):
+            return "rows"
+
+        self.assertEqual("rows", c.op.upper(obj))
+
+        # Replaced operation invalidates the cache as well
+        other = Operation("upper")
+        @other.register("*")
+        def _(ctx, obj):
+            return "any"
+
+        c.add_operation(other)
+        self.assertEqual(0, len(c._dispatch_cache))
+        self.assertEqual("any", c.op.upper(obj))
+
     def test_get_representations(self):
         obj = DummyDataObject(["rows", "sql"])
         self.assertEqual( [["rows", "sql"]], get_representations(obj))
@@ -400,5 +431,69 @@ class OperationTestCase(unittest.TestCase):
         self.assertEqual("sql", c.op.meditate(objsql))
         self.assertEqual("rows", c.op.meditate(objrows))
 
+class LazyContextTestCase(unittest.TestCase):
+    def test_module_index(self):
+        from bubbles.execution.context import _module_operations
+
+        index = _module_operations("bubbles.ops.generic")
+        self.assertIn(("keep_fields", ("*", )), index)
+
+        index = _module_operations("bubbles.backends.sql.ops")
+        self.assertIn(("distinct", ("sql", )), index)
+        self.assertIn(("join_details", ("sql", "sql[]")), index)
+
+        self.assertIsNone(_module_operations("bubbles.no_such_module"))
+
+    def test_lazy_load(self):
+        c = OperationContext()
+        c.add_lazy_operations_from("bubbles.ops.rows")
+        c.add_lazy_operations_from("bubbles.ops.generic")
+
+        self.assertNotIn("keep_fields", c.operations)
+
+        obj = IterableDataSource(iter([[1, 2]]), FieldList("a", "b"))
+        result = c.op.keep_fields(obj, ["a"])
+
+        self.assertEqual(["a"], result.fields.names())
+        self.assertEqual([], c._lazy_modules)
+
+    def test_lazy_load_matching(self):
+        c = OperationContext()
+        c.add_lazy_operations_from("bubbles.ops.generic")
+        c.add_lazy_operations_from("bubbles.backends.mongo.ops")
+
+        # Only modules with signature matching the operands are loaded
+        c.load_lazy_modules("field_filter", [["rows", "records"]])
+        self.assertEqual(["bubbles.ops.generic",
+                          "bubbles.backends.mongo.ops"], c._lazy_modules)
+
+        c.load_lazy_modules("field_filter", [["mongo"]])
+        self.assertEqual(["bubbles.ops.generic"], c._lazy_modules)
+
+    def test_lazy_load_miss(self):
+        c = OperationContext()
+        c.add_operations_from(bubbles.prototypes)
+        c.add_lazy_operations_from("bubbles.ops.rows")
+        c.add_lazy_operations_from("bubbles.backends.mongo.ops")
+
+        obj = IterableDataSource(iter([[1, 2]]), FieldList("a", "b"))
+        c.op.field_filter(obj, keep=["a"])
+        self.assertEqual(["bubbles.backends.mongo.ops"], c._lazy_modules)
+        self.assertEqual(set(), c._lazy_misses)
+
+        obj = IterableDataSource(iter([[1, 2]]), FieldList("a", "b"))
+        c.op.field_filter(obj, keep=["a"])
+
+        # Representations without a matching module are not matched again
+        self.assertIn(("field_filter", (("rows", "records"), )),
+                      c._lazy_misses)
+
+        # Registering a module forgets the misses
+        c.add_lazy_operations_from("bubbles.ops.generic")
+        self.assertEqual(set(), c._lazy_misses)
+
+        self.assertEqual(["mongo"], [sig[0] for sig in
+                                     c.lazy_signatures("field_filter")])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,171 @@
+import unittest
+import threading
+from bubbles import *
+import bubbles.ops.rows
+import bubbles.backends.sql.ops
+from bubbles.backends.sql.objects import SQLDataStore
+
+class ParallelEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = OperationContext()
+        self.context.add_operations_from(bubbles.ops.rows)
+
+        self.fields = FieldList("id", "name")
+        self.data = [[1, "one"], [2, "two"], [3, "three"]]
+
+    def test_independent_branches(self):
+        barrier = threading.Barrier(2, timeout=5)
+        collected = {}
+
+        @operation
+        def collect(ctx, obj, label):
+            # Both branches have to be running at the same time to pass
+            barrier.wait()
+            collected[label] = list(obj.rows())
+            return obj
+
+        self.context.add_operation(collect)
+
+        source = IterableDataSource(iter(self.data), self.fields)
+
+        graph = Graph()
+        graph.add(ObjectNode(source), "source")
+        graph.add(Node("collect", "left"), "left")
+        graph.add(Node("collect", "right"), "right")
+        graph.connect("source", "left")
+        graph.connect("source", "right")
+
+        engine = ParallelExecutionEngine(self.context, max_workers=2)
+        engine.run(graph)
+
+        self.assertEqual(self.data, collected["left"])
+        self.assertEqual(self.data, collected["right"])
+
+    def test_failure(self):
+        @operation
+        def fail(ctx, obj):
+            raise ProbeAssertionError("failed")
+
+        self.context.add_operation(fail)
+
+        source = IterableDataSource(iter(self.data), self.fields)
+
+        graph = Graph()
+        graph.add(ObjectNode(source), "source")
+        graph.add(Node("fail"), "fail")
+        graph.connect("source", "fail")
+
+        engine = ParallelExecutionEngine(self.context)
+        with self.assertRaises(ProbeAssertionError):
+            engine.run(graph)
+
+class PushdownPlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = OperationContext()
+        self.context.add_operations_from(bubbles.ops.rows)
+        self.context.add_operations_from(bubbles.backends.sql.ops)
+
+        store = SQLDataStore("sqlite:///")
+        self.table = store.create("test", FieldList(("id", "integer"),
+                                                    ("amount", "integer")))
+        self.table.append_from_iterable([(1, 10), (2, 20), (3, 30), (4, 40)])
+
+        self.collected = []
+
+        @operation
+        def collect(ctx, obj):
+            self.collected.append((obj.representations()[0],
+                                   [tuple(row) for row in obj.rows()]))
+            return obj
+
+        self.context.add_operation(collect)
+
+    def create_graph(self):
+        graph = Graph()
+        graph.add(ObjectNode(self.table), "source")
+        graph.add(Node("filter_by_predicate", lambda v: v > 1, ["id"]),
+                  "predicate")
+        graph.add(Node("filter_by_set", "amount", [20, 30, 40]), "set")
+        graph.add(Node("sort", [("id", "desc")]), "sort")
+        graph.add(Node("collect"), "collect")
+        graph.connect("source", "predicate")
+        graph.connect("predicate", "set")
+        graph.connect("set", "sort")
+        graph.connect("sort", "collect")
+
+        return graph
+
+    def test_optimize(self):
+        graph = self.create_graph()
+        planner = PushdownPlanner(self.context)
+        optimized = planner.optimize(graph)
+
+        order = [optimized.node_name(node)
+                 for node in optimized.sorted_nodes()]
+        self.assertEqual(["source", "set", "sort", "predicate", "collect"],
+                         order)
+
+        # Original graph is not modified
+        self.assertEqual(graph.nodes["source"],
+                         graph.sources("predicate")["default"])
+
+    def create_probed_graph(self, sorted_representations):
+        # Collect representations of the object that the sort step receives
+        graph = self.create_graph()
+        node = graph.nodes["sort"]
+        evaluate = node.evaluate
+
+        def probe(engine, context, operands=None):
+            sorted_representations.append(operands[0].representations()[0])
+            return evaluate(engine, context, operands)
+
+        node.evaluate = probe
+        return graph
+
+    def test_run(self):
+        planned = []
+        planner = PushdownPlanner(self.context)
+        engine = ExecutionEngine(self.context, planner=planner)
+        engine.run(self.create_probed_graph(planned))
+
+        unplanned = []
+        engine = ExecutionEngine(self.context)
+        engine.run(self.create_probed_graph(unplanned))
+
+        # Steps in front of the moved filter stay in the database
+        self.assertEqual(["sql"], planned)
+        self.assertEqual(["rows"], unplanned)
+
+        expected = [(4, 40), (3, 30), (2, 20)]
+        self.assertEqual(("rows", expected), self.collected[0])
+        self.assertEqual(("rows", expected), self.collected[1])
+
+    def test_filter_expression(self):
+        planner = PushdownPlanner(self.context)
+
+        self.assertTrue(planner.is_native(Node("filter_expression",
+                                               "amount > 10")))
+        # Comparison with null falls back to rows
+        self.assertFalse(planner.is_native(Node("filter_expression",
+                                                "amount = null")))
+        self.assertFalse(planner.is_native(Node("filter_expression",
+                                                expression="amount = null")))
+
+    def test_default_context(self):
+        # Backend operations of the default context are loaded on demand
+        planner = PushdownPlanner(default_context)
+
+        self.assertTrue(planner.is_native(Node("filter_by_set", "amount",
+                                               [20])))
+        self.assertTrue(planner.is_native(Node("sort", [("id", "desc")])))
+        self.assertFalse(planner.is_native(Node("filter_by_predicate",
+                                                lambda v: v > 1, ["id"])))
+
+        optimized = planner.optimize(self.create_graph())
+        order = [optimized.node_name(node)
+                 for node in optimized.sorted_nodes()]
+        self.assertEqual(["source", "set", "sort", "predicate", "collect"],
+                         order)
+
+if __name__ == "__main__":
+    unittest.main()
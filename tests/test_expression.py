@@ -0,0 +1,74 @@
+import unittest
+from bubbles import *
+from bubbles.expression import *
+from bubbles.backends.mongo.ops import MongoQueryCompiler
+
+class ExpressionTestCase(unittest.TestCase):
+    def test_parse(self):
+        tree = parse_expression("amount > 100 AND year >= 2012")
+        self.assertEqual("and", tree.operator)
+        self.assertEqual(">", tree.left.operator)
+        self.assertEqual(["amount", "year"], expression_variables(tree))
+
+        with self.assertRaises(ExpressionError):
+            parse_expression("amount >")
+        with self.assertRaises(ExpressionError):
+            parse_expression("(amount > 1")
+        with self.assertRaises(ExpressionError):
+            parse_expression("amount # 1")
+
+    def test_python_compiler(self):
+        compiler = PythonExpressionCompiler()
+        code = compiler.compile("not a = 'x' or -b * 2 + 1 < 3", ["a", "b"])
+        function = eval("lambda a, b: %s" % code)
+        self.assertTrue(function("y", -10))
+        self.assertTrue(function("x", 10))
+        self.assertFalse(function("x", -10))
+
+        # None is unknown value
+        self.assertTrue(function(None, 10))
+        self.assertIsNone(function(None, -10))
+        self.assertIsNone(function("x", None))
+
+        with self.assertRaises(ExpressionError):
+            compiler.compile("c > 1", ["a", "b"])
+
+        code = PythonRowCompiler().compile("b ≥ 1.5", FieldList("a", "b"))
+        function = eval("lambda row: %s" % code)
+        self.assertTrue(function([0, 2]))
+        self.assertIsNone(function([0, None]))
+
+    def test_lambda_from_predicate(self):
+        predicate = lambda_from_predicate("amount > 100 and year >= 2012",
+                                          ["amount", "year"])
+        self.assertTrue(predicate(200, 2013))
+        self.assertFalse(predicate(50, 2013))
+
+    def test_mongo_compiler(self):
+        compiler = MongoQueryCompiler()
+        condition = compiler.compile("amount > 100 and not 2012 < year",
+                                     ["amount", "year"])
+        self.assertEqual({"$and": [{"amount": {"$gt": 100}},
+                                   {"year": {"$lte": 2012}}]},
+                         condition.true)
+        self.assertEqual({"$or": [{"amount": {"$lte": 100}},
+                                  {"year": {"$gt": 2012}}]},
+                         condition.false)
+
+        # Null and missing fields are neither equal nor unequal
+        condition = compiler.compile("year != 2012", ["year"])
+        self.assertEqual({"year": {"$nin": [2012, None]}}, condition.true)
+        self.assertEqual({"year": 2012}, condition.false)
+
+        condition = compiler.compile("not year = 2012", ["year"])
+        self.assertEqual({"year": {"$nin": [2012, None]}}, condition.true)
+
+        with self.assertRaises(ExpressionError):
+            compiler.compile("year = null", ["year"])
+        with self.assertRaises(ExpressionError):
+            compiler.compile("amount > year", ["amount", "year"])
+        with self.assertRaises(ExpressionError):
+            compiler.compile("amount + 1 > 2", ["amount"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from copy import copy
-from bubbles import FieldList, Field, FieldFilter, to_field, prepare_aggregation_list
+from bubbles import FieldList, FrozenFieldList, Field, FieldFilter, to_field, \
+                    prepare_aggregation_list
 from bubbles.errors import *
 
 class FieldListTestCase(unittest.TestCase):
@@ -45,6 +46,50 @@ class FieldListTestCase(unittest.TestCase):
         self.assertIn("a", fields)
         self.assertIn(field, fields._fields)
 
+    def test_index_map(self):
+        fields = FieldList("a", "b", "c")
+        self.assertEqual({"a": 0, "b": 1, "c": 2}, fields.index_map())
+
+        del fields[0]
+        self.assertEqual(0, fields.index("b"))
+        self.assertNotIn("a", fields)
+        with self.assertRaises(NoSuchFieldError):
+            fields.index("a")
+
+        fields[1] = Field("x")
+        self.assertEqual(1, fields.index("x"))
+        self.assertNotIn("c", fields)
+
+        fields.append("y")
+        self.assertEqual((2, 0), fields.indexes(["y", "b"]))
+
+    def test_frozen(self):
+        fields = FieldList("a", "b", "c")
+        frozen = fields.freeze()
+
+        self.assertIsInstance(frozen, FrozenFieldList)
+        self.assertEqual(fields, frozen)
+        self.assertEqual((2, 0), frozen.indexes(["c", "a"]))
+        self.assertEqual((2, 0), frozen.indexes(["c", "a"]))
+        self.assertEqual([True, False, True], frozen.mask(["a", "c"]))
+
+        with self.assertRaises(MetadataError):
+            frozen.append("d")
+        with self.assertRaises(MetadataError):
+            del frozen[0]
+        with self.assertRaises(MetadataError):
+            frozen += ["d"]
+
+        self.assertEqual(["a", "b", "c", "d"], (frozen + ["d"]).names())
+
+        other = FieldList("a", "b", "c").freeze()
+        self.assertEqual(frozen.fingerprint, other.fingerprint)
+        self.assertEqual(hash(frozen), hash(other))
+        self.assertEqual({frozen: 1}[other], 1)
+
+        other = FieldList("a", "b", ("c", "integer")).freeze()
+        self.assertNotEqual(frozen.fingerprint, other.fingerprint)
+
     def test_aggregated_fields(self):
         fields = FieldList("a", "b")
         agg_list = prepare_aggregation_list(['a', ('b', 'avg')])
@@ -144,6 +189,18 @@ class MetadataTestCase(unittest.TestCase):
         m = FieldFilter()
         self.assertListEqual([True, True, True, True],
                                 m.field_mask(self.fields))
+
+    def test_row_filter(self):
+        row = ["a", "b", "c", "d"]
+
+        m = FieldFilter(keep=["a", "c"])
+        self.assertEqual(("a", "c"), m.row_filter(self.fields)(row))
+
+        m = FieldFilter(keep=["d"])
+        self.assertEqual(("d", ), m.row_filter(self.fields)(row))
+
+        m = FieldFilter(drop=["a", "b", "c", "d"])
+        self.assertEqual((), m.row_filter(self.fields)(row))
 def test_suite():
    suite = unittest.TestSuite()
 
@@ -0,0 +1,57 @@
+import unittest
+from bubbles import *
+
+class TeeDataSourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fields = FieldList("id", "value")
+        self.data = [[i, "value%d" % i] for i in range(100)]
+
+    def test_sequential(self):
+        tee = TeeDataSource(iter(self.data), self.fields, 3, buffer_size=10)
+
+        self.assertEqual(self.data, list(tee.rows()))
+        self.assertEqual(self.data, list(tee.rows()))
+        self.assertEqual(self.data, list(tee.rows()))
+
+        with self.assertRaises(ConsumedError):
+            tee.rows()
+
+    def test_interleaved(self):
+        tee = TeeDataSource(iter(self.data), self.fields, 2, buffer_size=10)
+
+        first = tee.rows()
+        second = tee.rows()
+
+        result1 = []
+        result2 = []
+
+        for i, row in enumerate(first):
+            result1.append(row)
+            # The second consumer falls behind and catches up again
+            if i % 30 == 29:
+                result2 += [next(second) for j in range(25)]
+
+        result2 += list(second)
+
+        self.assertEqual(self.data, result1)
+        self.assertEqual(self.data, result2)
+        self.assertIsNone(tee.tee.spill)
+
+    def test_partial_consumption(self):
+        tee = TeeDataSource(iter(self.data), self.fields, 2, buffer_size=10)
+
+        first = tee.rows()
+        self.assertEqual(self.data[:5], [next(first) for i in range(5)])
+        first.close()
+
+        self.assertEqual(self.data, list(tee.rows()))
+
+    def test_retained(self):
+        obj = IterableDataSource(iter(self.data), self.fields)
+        retained = obj.retained(2)
+
+        self.assertEqual(self.data, list(retained.rows()))
+        self.assertEqual(self.data, list(retained.rows()))
+
+if __name__ == "__main__":
+    unittest.main()
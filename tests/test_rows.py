@@ -0,0 +1,675 @@
+import unittest
+from datetime import date
+from bubbles import *
+import bubbles.ops.rows
+from bubbles.ops.rows import FusedRowsDataSource
+
+# Data sets as tuples (rows, fields) for `source()`
+
+JOIN_MASTER = ([[1, "x", 10], [2, "y", 20], [3, "x", 30], [None, "x", 40]],
+               FieldList("id", "code", "amount"))
+JOIN_DETAIL = ([[1, "x", "one"], [1, "x", "uno"], [2, "x", "two"],
+                [3, "x", "three"]],
+               FieldList("did", "dcode", "name"))
+
+DISTINCT = ([[i % 7, i % 3, i] for i in range(100)],
+            FieldList("a", "b", "c"))
+
+LATENCY = ([["a" if i % 4 else "b", i % 100 + 1] for i in range(1000)],
+           FieldList("customer", "latency"))
+
+SAMPLE = ([[i % 3, i] for i in range(10000)], FieldList("group", "id"))
+
+WINDOW = ([[4, 1, 2012, 50], [1, 1, 2009, 10], [2, 1, 2010, 20],
+           [5, 2, 2010, 50], [3, 1, 2010, 20], [6, 2, 2012, None]],
+          FieldList("id", "customer", "year", "amount"))
+
+class RowOperationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = OperationContext()
+        self.context.add_operations_from(bubbles.ops.rows)
+
+        self.fields = FieldList("id", "name", "amount")
+        self.data = [
+            [1, " one ", "10"],
+            [2, "two", "20"],
+            [3, "", "30"],
+            [4, " four", "40"]
+        ]
+
+    def source(self, data=None, fields=None):
+        # Source of `data` rows, default is the data of the test case
+        if data is None:
+            data, fields = self.data, self.fields
+        return IterableDataSource(iter(data), fields)
+
+    def test_fused_chain(self):
+        ops = self.context.op
+
+        obj = ops.filter_by_range(self.source(), "id", 2, None)
+        obj = ops.string_strip(obj, ["name"])
+        obj = ops.empty_to_missing(obj, ["name"])
+        obj = ops.retype(obj, {"amount": "integer"})
+        obj = ops.filter_by_set(obj, "id", [3, 4, 5])
+
+        self.assertIsInstance(obj, FusedRowsDataSource)
+        self.assertEqual(5, len(obj.stages))
+        self.assertIsInstance(obj.source, IterableDataSource)
+        self.assertNotIsInstance(obj.source, FusedRowsDataSource)
+
+        self.assertEqual([[3, None, 30], [4, "four", 40]], list(obj.rows()))
+        self.assertEqual("integer", obj.fields["amount"].storage_type)
+
+        # Input rows are not modified
+        self.assertEqual([3, "", "30"], self.data[2])
+        self.assertEqual([4, " four", "40"], self.data[3])
+
+    def test_consumed_chain(self):
+        ops = self.context.op
+
+        obj = ops.filter_by_value(self.source(), "id", 1, discard=True)
+        rows = obj.rows()
+        self.assertEqual([2, "two", "20"], next(rows))
+
+        # Rows were already requested, the chain is not extended
+        filtered = ops.filter_by_value(obj, "id", 4)
+        self.assertIs(obj, filtered.source)
+        self.assertEqual([[4, " four", "40"]], list(filtered.rows()))
+
+    def test_filter_expression(self):
+        ops = self.context.op
+
+        obj = ops.filter_expression(self.source(),
+                                    "id >= 2 and not name = 'two'")
+        self.assertIsInstance(obj, FusedRowsDataSource)
+        self.assertEqual([3, 4], [row[0] for row in obj.rows()])
+
+        obj = ops.filter_expression(self.source(), "id * 10 = 20 or id = 4",
+                                    discard=True)
+        self.assertEqual([1, 3], [row[0] for row in obj.rows()])
+
+        with self.assertRaises(ExpressionError):
+            ops.filter_expression(self.source(), "price > 10")
+
+        # Rows with empty values are neither selected nor kept by discard
+        data = [[1, None, 200], [2, "two", None], [3, "three", 100]]
+        source = self.source(data, self.fields)
+        obj = ops.filter_expression(source, "amount > 150")
+        self.assertEqual([1], [row[0] for row in obj.rows()])
+
+        source = self.source(data, self.fields)
+        obj = ops.filter_expression(source, "- amount < -150 or name = 'x'",
+                                    discard=True)
+        self.assertEqual([3], [row[0] for row in obj.rows()])
+
+    def test_fresh_rows(self):
+        ops = self.context.op
+
+        # Rows of the source are not modified
+        self.assertFalse(self.source().fresh_rows)
+        obj = ops.string_strip(self.source(), ["name"])
+        # Copies of the rows
+        self.assertTrue(obj.fresh_rows)
+        self.assertEqual("one", list(obj.rows())[0][1])
+        self.assertEqual(" one ", self.data[0][1])
+
+        # Rows owned by the loop are modified in place
+        source = self.source()
+        source.fresh_rows = True
+        obj = ops.string_strip(source, ["name"])
+        rows = list(obj.rows())
+        self.assertIs(self.data[0], rows[0])
+        self.assertEqual("one", self.data[0][1])
+
+        obj = ops.field_filter(self.source(), keep=["name", "id"])
+        self.assertTrue(obj.fresh_rows)
+        obj = ops.string_strip(obj, ["name"])
+        self.assertEqual([[1, "one"], [2, "two"]], list(obj.rows())[:2])
+
+    def test_fields_and_dates(self):
+        ops = self.context.op
+
+        fields = FieldList("id", ("day", "date"))
+        data = [[1, date(2013, 1, 2)], [2, None]]
+        obj = self.source(data, fields)
+
+        obj = ops.dates_to_dimension(obj, unknown_date=-1)
+        obj = ops.append_constant_fields(obj, FieldList("flag"), "x")
+        obj = ops.field_filter(obj, keep=["day", "flag"])
+
+        self.assertIsInstance(obj, FusedRowsDataSource)
+        self.assertEqual(["day", "flag"], obj.fields.names())
+        self.assertEqual([("20130102", "x"), (-1, "x")],
+                         [tuple(row) for row in obj.rows()])
+
+    def test_split_date(self):
+        ops = self.context.op
+
+        fields = FieldList("id", ("day", "date"))
+        data = [[1, date(2013, 1, 2)]]
+
+        obj = self.source(data, fields)
+        obj = ops.split_date(obj, ["day"], ["year", "day"])
+        self.assertEqual(["id", "day_year", "day_day"], obj.fields.names())
+        self.assertEqual([[1, 2013, 2]], list(obj.rows()))
+
+        obj = self.source(data, fields)
+        with self.assertRaises(ArgumentError):
+            ops.split_date(obj, ["day"], ["year", "__class__.__name__"])
+
+    def test_sort(self):
+        ops = self.context.op
+
+        fields = FieldList("a", "b", "i")
+        data = [((i * 7) % 5, (i * 3) % 4, i) for i in range(500)]
+
+        expected = sorted(data, key=lambda row: (row[0], -row[1]))
+        source = self.source(data, fields)
+        result = ops.sort(source, [("a", "asc"), ("b", "desc")])
+        self.assertEqual(expected, list(result.rows()))
+
+        expected = sorted(data, key=lambda row: row[1], reverse=True)
+        source = self.source(data, fields)
+        result = ops.sort(source, [("b", "desc")])
+        self.assertEqual(expected, list(result.rows()))
+
+        source = self.source(data, fields)
+        result = ops.sort(source, [])
+        self.assertEqual(data, list(result.rows()))
+
+    def test_external_sort(self):
+        ops = self.context.op
+
+        fields = FieldList("a", "b", "i")
+        data = [((i * 7) % 5, (i * 3) % 4, i) for i in range(500)]
+        expected = sorted(data, key=lambda row: (-row[0], row[1]))
+
+        # Too many runs to be merged at once
+        source = self.source(data, fields)
+        result = ops.sort(source, [("a", "desc"), "b"], buffer_size=3)
+        self.assertEqual(expected, list(result.rows()))
+
+    def test_aggregate_functions(self):
+        ops = self.context.op
+
+        fields = FieldList("key", "value")
+        data = [["a", 3], ["a", None], ["a", 1], ["a", 5], ["b", None]]
+        source = self.source(data, fields)
+
+        measures = [("value", function) for function in
+                    ["sum", "count", "min", "max", "first", "last",
+                     "average", "variance"]]
+        result = ops.aggregate(source, "key", measures)
+
+        self.assertEqual(["key", "value_sum", "value_count", "value_min",
+                          "value_max", "value_first", "value_last",
+                          "value_average", "value_variance",
+                          "record_count"], result.fields.names())
+
+        rows = sorted(result.rows())
+        self.assertEqual(["a", 9, 3, 1, 5, 3, 5, 3.0, 4.0, 4], rows[0])
+        self.assertEqual(["b", 0, 0, None, None, None, None, None, None, 1],
+                         rows[1])
+
+    def test_sorted_aggregate(self):
+        ops = self.context.op
+
+        fields = FieldList("key", "value")
+        data = [["b", 1], ["a", 2], ["b", 3], ["a", 4], ["c", 5]]
+
+        def rows():
+            yield from data
+            # Input was exhausted, the last group is emitted only now
+            self.exhausted = True
+
+        self.exhausted = False
+        source = IterableDataSource(rows(), fields)
+        sorted_source = ops.sort(source, [("key", "desc")])
+        result = ops.aggregate(sorted_source, "key", "value")
+
+        self.assertEqual([("key", "desc")], result.order_by)
+
+        iterator = result.rows()
+        self.assertEqual(["c", 5, 1], next(iterator))
+        self.assertEqual(["b", 4, 2], next(iterator))
+        self.assertEqual(["a", 6, 2], next(iterator))
+
+        # Explicit flag, groups are emitted as the key changes
+        data = [["a", 1], ["a", 2], ["b", 3]]
+        self.exhausted = False
+        source = IterableDataSource(rows(), fields)
+        iterator = ops.aggregate(source, "key", "value", is_sorted=True).rows()
+        self.assertEqual(["a", 3, 2], next(iterator))
+        self.assertFalse(self.exhausted)
+        self.assertEqual(["b", 3, 1], next(iterator))
+
+    def test_join(self):
+        ops = self.context.op
+
+        master = self.source(*JOIN_MASTER)
+        detail = self.source(*JOIN_DETAIL)
+        result = ops.join_details(master, detail, ["id", "code"],
+                                  ["did", "dcode"])
+        self.assertEqual(["id", "code", "amount", "name"],
+                         result.fields.names())
+        self.assertEqual([[1, "x", 10, "one"], [1, "x", 10, "uno"],
+                          [3, "x", 30, "three"]], list(result.rows()))
+
+        master = self.source(*JOIN_MASTER)
+        detail = self.source(*JOIN_DETAIL)
+        result = ops.join_details(master, detail, ["id", "code"],
+                                  ["did", "dcode"], inner=False)
+        self.assertEqual([[1, "x", 10, "one"], [1, "x", 10, "uno"],
+                          [2, "y", 20, None], [3, "x", 30, "three"],
+                          [None, "x", 40, None]], list(result.rows()))
+
+    def test_grace_join(self):
+        ops = self.context.op
+
+        master = self.source(*JOIN_MASTER)
+        detail = self.source(*JOIN_DETAIL)
+        expected = list(ops.join_details(master, detail, "id", "did",
+                                         inner=False).rows())
+
+        master = self.source(*JOIN_MASTER)
+        detail = self.source(*JOIN_DETAIL)
+        result = ops.join_details(master, detail, "id", "did", inner=False,
+                                  buffer_size=2)
+        self.assertEqual(sorted(expected, key=repr),
+                         sorted(result.rows(), key=repr))
+
+    def test_grace_join_repartition(self):
+        ops = self.context.op
+
+        # Partitions of the first spill are larger than the buffer, key 0 has
+        # more details than the buffer
+        details = [[i % 300, i] for i in range(1000)] \
+                    + [[0, i] for i in range(1000, 1010)]
+        masters = [[i, "m%d" % i] for i in range(-10, 310)]
+
+        def join(buffer_size):
+            master = self.source(masters, FieldList("id", "name"))
+            detail = self.source(details, FieldList("did", "value"))
+            result = ops.join_details(master, detail, "id", "did",
+                                      inner=False, buffer_size=buffer_size)
+            return sorted(result.rows(), key=repr)
+
+        self.assertEqual(join(None), join(3))
+
+    def test_star_join(self):
+        ops = self.context.op
+
+        master = self.source(*JOIN_MASTER)
+        detail = self.source(*JOIN_DETAIL)
+        codes = self.source([["x", "ex"], ["y", "why"]],
+                            FieldList("code", "label"))
+        joins = [{"master": "id", "detail": "did"},
+                 {"master": "code", "detail": "code"}]
+
+        result = ops.join_details(master, [detail, codes], joins)
+        self.assertEqual(["id", "code", "amount", "dcode", "name", "label"],
+                         result.fields.names())
+        rows = list(result.rows())
+        self.assertEqual([1, "x", 10, "x", "one", "ex"], rows[0])
+        self.assertEqual([2, "y", 20, "x", "two", "why"], rows[2])
+        self.assertEqual(4, len(rows))
+
+    def test_merge_join(self):
+        ops = self.context.op
+
+        master = self.source([
+            [None, "n"], [1, "a"], [1, "b"], [2, "c"], [4, "d"], [5, "e"]
+        ], FieldList("id", "name"))
+        detail = self.source([
+            [0, "zero"], [1, "x"], [1, "y"], [3, "z"], [5, "w"]
+        ], FieldList("id", "value"))
+
+        result = ops.merge_join(master, detail, "id", "id", inner=False)
+        self.assertEqual(["id", "name", "value"], result.fields.names())
+        self.assertEqual([[None, "n", None],
+                          [1, "a", "x"], [1, "a", "y"],
+                          [1, "b", "x"], [1, "b", "y"],
+                          [2, "c", None], [4, "d", None], [5, "e", "w"]],
+                         list(result.rows()))
+
+        master = self.source([[2, "a"], [1, "b"]], FieldList("id", "name"))
+        detail = self.source([[1, "x"]], FieldList("id", "value"))
+        result = ops.merge_join(master, detail, "id", "id")
+        with self.assertRaises(DataObjectError):
+            list(result.rows())
+
+    def test_distinct(self):
+        ops = self.context.op
+
+        result = ops.distinct(self.source(*DISTINCT), ["b", "a"])
+        self.assertEqual(["a", "b"], result.fields.names())
+        self.assertEqual(21, len(list(result.rows())))
+
+        obj = ops.sort(self.source(*DISTINCT), ["a", "b"])
+        result = ops.distinct(obj, "a")
+        self.assertEqual([("a", "asc")], result.order_by)
+        self.assertEqual([(i,) for i in range(7)], list(result.rows()))
+
+        result = ops.distinct_rows(self.source(*DISTINCT), "a")
+        self.assertEqual([[i, i % 3, i] for i in range(7)],
+                         list(result.rows()))
+
+    def test_distinct_spill(self):
+        ops = self.context.op
+
+        expected = ops.distinct_rows(self.source(*DISTINCT), ["a", "b"])
+        result = ops.distinct_rows(self.source(*DISTINCT), ["a", "b"],
+                                   buffer_size=5)
+        self.assertEqual(sorted(expected.rows()), sorted(result.rows()))
+
+        result = ops.distinct(self.source(*DISTINCT), buffer_size=5)
+        self.assertEqual(100, len(list(result.rows())))
+
+    def test_distinct_repartition(self):
+        ops = self.context.op
+
+        # Partitions of the first spill are larger than the buffer
+        data = [[i % 500, i] for i in range(2000)]
+        obj = self.source(data, FieldList("a", "b"))
+        result = ops.distinct(obj, "a", buffer_size=3)
+        self.assertEqual([(i,) for i in range(500)], sorted(result.rows()))
+
+        obj = self.source(data, FieldList("a", "b"))
+        result = ops.first_unique(obj, "a", buffer_size=3)
+        self.assertEqual([[i, i] for i in range(500)], sorted(result.rows()))
+
+    def test_first_unique(self):
+        ops = self.context.op
+
+        result = ops.first_unique(self.source(*DISTINCT), "a", buffer_size=3)
+        self.assertEqual(sorted([i, i % 3, i] for i in range(7)),
+                         sorted(result.rows()))
+
+        result = ops.first_unique(self.source(*DISTINCT), "a", discard=True,
+                                  buffer_size=3)
+        self.assertEqual(93, len(list(result.rows())))
+
+        obj = ops.sort(self.source(*DISTINCT), "a")
+        result = ops.first_unique(obj, "a", discard=True)
+        self.assertEqual([("a", "asc")], result.order_by)
+        self.assertEqual(93, len(list(result.rows())))
+
+    def test_approx_distinct_count(self):
+        ops = self.context.op
+
+        data = [[i % 1000, i] for i in range(20000)]
+        obj = self.source(data, FieldList("a", "b"))
+        result = ops.approx_distinct_count(obj)
+
+        self.assertEqual(["a", "b"], result.fields.names())
+        self.assertEqual("integer", result.fields["a"].storage_type)
+        (a, b), = list(result.rows())
+        self.assertAlmostEqual(1000, a, delta=50)
+        self.assertAlmostEqual(20000, b, delta=1000)
+
+        # Empty values are not counted
+        data = [[1, None], [None, None], [1, 2], [None, 3]]
+        obj = self.source(data, FieldList("a", "b"))
+        self.assertEqual([[1, 2]],
+                         list(ops.approx_distinct_count(obj).rows()))
+
+        obj = self.source(data, FieldList("a", "b"))
+        self.assertEqual([[1]],
+                         list(ops.approx_distinct_count(obj, "a").rows()))
+
+    def test_quantile_aggregations(self):
+        ops = self.context.op
+
+        result = ops.aggregate(self.source(*LATENCY), "customer",
+                               [("latency", "median"), ("latency", "p95"),
+                                ("latency", "p100")])
+        self.assertEqual(["customer", "latency_median", "latency_p95",
+                          "latency_p100", "record_count"],
+                         result.fields.names())
+
+        rows = sorted(result.rows())
+        self.assertEqual("a", rows[0][0])
+        self.assertAlmostEqual(50.5, rows[0][1], delta=1)
+        self.assertAlmostEqual(95, rows[0][2], delta=1)
+        self.assertEqual(100, rows[0][3])
+        self.assertAlmostEqual(49, rows[1][1], delta=1)
+        self.assertAlmostEqual(93, rows[1][2], delta=1)
+        self.assertEqual([97, 250], rows[1][3:])
+
+        with self.assertRaises(ArgumentError):
+            ops.aggregate(self.source(*LATENCY), "customer",
+                          [("latency", "p101")])
+
+    def test_quantiles(self):
+        ops = self.context.op
+
+        result = ops.quantiles(self.source(*LATENCY), "latency", [0, 0.5, 1])
+        self.assertEqual(["quantile", "latency"], result.fields.names())
+        rows = list(result.rows())
+        self.assertEqual([0, 1], rows[0])
+        self.assertAlmostEqual(50.5, rows[1][1], delta=1)
+        self.assertEqual([1, 100], rows[2])
+
+    def test_histogram(self):
+        ops = self.context.op
+
+        result = ops.histogram(self.source(*LATENCY), "latency", 4, 0, 100)
+        self.assertEqual(["low", "high", "count"], result.fields.names())
+        self.assertEqual([[0, 25, 240], [25, 50, 250], [50, 75, 250],
+                          [75, 100, 260]], list(result.rows()))
+
+        result = list(ops.histogram(self.source(*LATENCY), "latency",
+                                    3).rows())
+        self.assertEqual(1, result[0][0])
+        self.assertEqual(100, result[-1][1])
+        self.assertEqual(1000, sum(row[2] for row in result))
+        for row in result:
+            self.assertAlmostEqual(333, row[2], delta=20)
+
+        # Values outside of explicit bounds are not counted, estimated
+        # counts are close to the exact ones
+        exact = ops.histogram(self.source(*LATENCY), "latency", 2, 50, 100)
+        self.assertEqual([[50, 75, 250], [75, 100, 260]],
+                         list(exact.rows()))
+        result = list(ops.histogram(self.source(*LATENCY), "latency", 2,
+                                    low=50).rows())
+        self.assertEqual([50, 100], [result[0][0], result[-1][1]])
+        self.assertAlmostEqual(250, result[0][2], delta=10)
+        self.assertAlmostEqual(260, result[1][2], delta=10)
+
+        exact = ops.histogram(self.source(*LATENCY), "latency", 2, 1, 50)
+        self.assertEqual([[1, 25.5, 250], [25.5, 50, 250]],
+                         list(exact.rows()))
+        result = list(ops.histogram(self.source(*LATENCY), "latency", 2,
+                                    high=50).rows())
+        self.assertEqual([1, 50], [result[0][0], result[-1][1]])
+        self.assertAlmostEqual(250, result[0][2], delta=10)
+        self.assertAlmostEqual(250, result[1][2], delta=10)
+
+        # Value just below the high bound is in the last bin
+        obj = self.source([[0.9999999999999999]], FieldList("value"))
+        result = list(ops.histogram(obj, "value", 3, 0.0, 1.0).rows())
+        self.assertEqual([0, 0, 1], [row[2] for row in result])
+
+        with self.assertRaises(ArgumentError):
+            ops.histogram(self.source(*LATENCY), "latency", 0, 0, 100)
+        with self.assertRaises(ArgumentError):
+            ops.histogram(self.source(*LATENCY), "latency", 4, 100, 0)
+
+    def test_random_sample(self):
+        ops = self.context.op
+
+        rows = list(ops.sample(self.source(*SAMPLE), 100, mode="random",
+                               seed=1).rows())
+        self.assertEqual(100, len(rows))
+        self.assertEqual(sorted(rows, key=lambda row: row[1]), rows)
+        # Samples are spread over the whole input
+        self.assertGreater(rows[-1][1] - rows[0][1], 5000)
+
+        again = ops.sample(self.source(*SAMPLE), 100, mode="random", seed=1)
+        self.assertEqual(rows, list(again.rows()))
+
+        rows = list(ops.sample(self.source(*SAMPLE), 20000,
+                               mode="random").rows())
+        self.assertEqual(10000, len(rows))
+
+        # Every row has the same chance to be selected
+        counts = [0] * 5
+        for seed in range(2000):
+            obj = self.source([[i] for i in range(5)], FieldList("id"))
+            for row in ops.sample(obj, 1, mode="random", seed=seed).rows():
+                counts[row[0]] += 1
+        for count in counts:
+            self.assertAlmostEqual(400, count, delta=80)
+
+        with self.assertRaises(ArgumentError):
+            ops.sample(self.source(*SAMPLE), 10, discard=True, mode="random")
+
+    def test_bernoulli_sample(self):
+        ops = self.context.op
+
+        rows = list(ops.sample(self.source(*SAMPLE), 0.1, mode="bernoulli",
+                               seed=1).rows())
+        self.assertAlmostEqual(1000, len(rows), delta=150)
+        self.assertEqual(sorted(rows, key=lambda row: row[1]), rows)
+
+        rows = list(ops.sample(self.source(*SAMPLE), 0.1, mode="bernoulli",
+                               discard=True, seed=1).rows())
+        self.assertAlmostEqual(9000, len(rows), delta=150)
+
+        rows = list(ops.sample(self.source(*SAMPLE), 1,
+                               mode="bernoulli").rows())
+        self.assertEqual(10000, len(rows))
+
+    def test_stratified_sample(self):
+        ops = self.context.op
+
+        data = [["a", i] for i in range(1000)] + [["b", 1000], ["b", 1001]]
+        obj = self.source(data, FieldList("group", "id"))
+        rows = list(ops.sample(obj, 10, mode="stratified", key="group",
+                               seed=1).rows())
+
+        self.assertEqual(12, len(rows))
+        self.assertEqual(sorted(rows, key=lambda row: row[1]), rows)
+        self.assertEqual([["b", 1000], ["b", 1001]], rows[-2:])
+
+        # One row per stratum is chosen uniformly
+        data = [["a", i] for i in range(4)]
+        counts = [0] * 4
+        for seed in range(400):
+            obj = self.source(data, FieldList("group", "id"))
+            rows = list(ops.sample(obj, 1, mode="stratified", key="group",
+                                   seed=seed).rows())
+            self.assertEqual(1, len(rows))
+            counts[rows[0][1]] += 1
+
+        for count in counts:
+            self.assertTrue(60 < count < 140, counts)
+
+    def test_nth_sample(self):
+        ops = self.context.op
+
+        rows = list(ops.sample(self.source(*SAMPLE), 1000, mode="nth").rows())
+        self.assertEqual([[0, 0], [1, 1000]], rows[:2])
+
+        rows = list(ops.sample(self.source(*SAMPLE), 2, mode="nth",
+                               discard=True).rows())
+        self.assertEqual(5000, len(rows))
+        self.assertEqual([1, 1], rows[0])
+
+    def test_top_n(self):
+        ops = self.context.op
+
+        data = [["a", 3, 1], ["b", 1, 2], ["a", 5, 3], ["a", 1, 4],
+                ["b", 4, 5], ["a", 5, 6], ["c", 2, 7]]
+        fields = FieldList("customer", "amount", "id")
+
+        obj = self.source(data, fields)
+        result = ops.top_n(obj, "customer", [("amount", "desc")], 2)
+        self.assertEqual([["a", 5, 3], ["a", 5, 6], ["b", 4, 5],
+                          ["b", 1, 2], ["c", 2, 7]], list(result.rows()))
+
+        obj = self.source(data, fields)
+        result = ops.top_n(obj, None, ["amount", ("id", "desc")], 3)
+        self.assertEqual([("amount", "asc"), ("id", "desc")], result.order_by)
+        self.assertEqual([["a", 1, 4], ["b", 1, 2], ["c", 2, 7]],
+                         list(result.rows()))
+
+        obj = ops.sort(self.source(data, fields), "customer")
+        result = ops.top_n(obj, "customer", "amount", 1)
+        self.assertEqual([("customer", "asc"), ("amount", "asc")],
+                         result.order_by)
+        self.assertEqual([["a", 1, 4], ["b", 1, 2], ["c", 2, 7]],
+                         list(result.rows()))
+
+    def test_window_aggregate(self):
+        ops = self.context.op
+
+        result = ops.window_aggregate(self.source(*WINDOW), "customer", "year",
+                                      [("amount", "running_sum"),
+                                       ("amount", "lag"),
+                                       ("amount", "lead", 2),
+                                       ("amount", "moving_average", 2),
+                                       "rank", "dense_rank",
+                                       ("year", "max")])
+
+        self.assertEqual(["id", "customer", "year", "amount",
+                          "amount_running_sum", "amount_lag",
+                          "amount_lead_2", "amount_moving_average_2",
+                          "rank", "dense_rank", "year_max"],
+                         result.fields.names())
+        self.assertEqual("integer", result.fields["rank"].storage_type)
+        self.assertEqual([("customer", "asc"), ("year", "asc")],
+                         result.order_by)
+
+        self.assertEqual([
+            [1, 1, 2009, 10, 10, None, 20, 10.0, 1, 1, 2012],
+            [2, 1, 2010, 20, 30, 10, 50, 15.0, 2, 2, 2012],
+            [3, 1, 2010, 20, 50, 20, None, 20.0, 2, 2, 2012],
+            [4, 1, 2012, 50, 100, 20, None, 35.0, 4, 3, 2012],
+            [5, 2, 2010, 50, 50, None, None, 50.0, 1, 1, 2012],
+            [6, 2, 2012, None, 50, 50, None, 50.0, 2, 2, 2012],
+        ], list(result.rows()))
+
+        with self.assertRaises(ArgumentError):
+            ops.window_aggregate(self.source(*WINDOW), "customer", "year",
+                                 [("amount", "moving_sum")])
+        with self.assertRaises(ArgumentError):
+            ops.window_aggregate(self.source(*WINDOW), "customer", "year",
+                                 [("amount", "lag", -1)])
+
+    def test_window_offsets_and_moving(self):
+        ops = self.context.op
+
+        result = ops.window_aggregate(self.source(*WINDOW), None, "id",
+                                      [("amount", "lag", 0),
+                                       ("amount", "lead", 0),
+                                       ("amount", "moving_sum", 3),
+                                       ("amount", "moving_count", 3),
+                                       ("amount", "moving_min", 3),
+                                       ("amount", "moving_max", 2)])
+        rows = [row[3:] for row in result.rows()]
+        self.assertEqual([
+            [10, 10, 10, 10, 1, 10, 10],
+            [20, 20, 20, 30, 2, 10, 20],
+            [20, 20, 20, 50, 3, 10, 20],
+            [50, 50, 50, 90, 3, 20, 50],
+            [50, 50, 50, 120, 3, 20, 50],
+            [None, None, None, 100, 2, 50, 50],
+        ], rows)
+
+    def test_sorted_window_aggregate(self):
+        ops = self.context.op
+
+        obj = ops.sort(self.source(*WINDOW), [("customer", "desc"), "year"])
+        result = ops.window_aggregate(obj, "customer", "year",
+                                      ["row_number", ("id", "lead")])
+
+        self.assertEqual([("customer", "desc"), ("year", "asc")],
+                         result.order_by)
+        self.assertEqual([[5, 2, 2010, 50, 1, 6], [6, 2, 2012, None, 2, None],
+                          [1, 1, 2009, 10, 1, 2]],
+                         list(result.rows())[:3])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import pickle
+from bubbles.errors import ArgumentError
+import random
+import bisect
+from bubbles.sketches import HyperLogLog, TDigest
+
+class HyperLogLogTestCase(unittest.TestCase):
+    def test_small_counts(self):
+        sketch = HyperLogLog()
+        self.assertEqual(0, sketch.count())
+
+        sketch.update(["a", "b", "c", "a", None, None])
+        self.assertEqual(4, sketch.count())
+
+    def test_estimate(self):
+        sketch = HyperLogLog(12)
+        sketch.update(range(100000))
+        self.assertAlmostEqual(100000, sketch.count(), delta=5000)
+
+    def test_merge(self):
+        left = HyperLogLog()
+        right = HyperLogLog()
+        both = HyperLogLog()
+
+        left.update(range(0, 30000))
+        right.update(range(20000, 50000))
+        both.update(range(0, 50000))
+
+        self.assertEqual(both.registers, (left | right).registers)
+
+        left.merge(right)
+        self.assertEqual(both.count(), left.count())
+
+        restored = pickle.loads(pickle.dumps(left))
+        self.assertEqual(left.count(), restored.count())
+
+        with self.assertRaises(ArgumentError):
+            left.merge(HyperLogLog(10))
+
+        with self.assertRaises(ArgumentError):
+            HyperLogLog(20)
+
+class TDigestTestCase(unittest.TestCase):
+    def test_small(self):
+        digest = TDigest()
+        self.assertIsNone(digest.quantile(0.5))
+
+        digest.update([5, 1, 4, 2, 3])
+        self.assertEqual(3, digest.quantile(0.5))
+        self.assertEqual(1, digest.quantile(0))
+        self.assertEqual(5, digest.quantile(1))
+        self.assertEqual(0.5, digest.cdf(3))
+
+        digest.add(6)
+        self.assertEqual(3.5, digest.quantile(0.5))
+
+    def test_quantiles(self):
+        rng = random.Random(42)
+        data = [rng.expovariate(1) for i in range(50000)]
+
+        digest = TDigest()
+        digest.update(data)
+        self.assertLess(len(digest.means), 200)
+
+        # Error of the estimate is measured as error of its rank
+        data.sort()
+        for q in (0.001, 0.01, 0.5, 0.9, 0.99, 0.999):
+            rank = bisect.bisect(data, digest.quantile(q)) / len(data)
+            self.assertAlmostEqual(q, rank, delta=0.005)
+
+    def test_merge(self):
+        rng = random.Random(42)
+        data = [rng.random() for i in range(20000)]
+
+        left = TDigest()
+        right = TDigest()
+        left.update(data[:5000])
+        right.update(data[5000:])
+
+        merged = left | right
+        self.assertEqual(20000, merged.count())
+        self.assertAlmostEqual(0.5, merged.quantile(0.5), delta=0.02)
+        self.assertEqual(min(data), merged.min)
+        self.assertEqual(max(data), merged.max)
+
+if __name__ == "__main__":
+    unittest.main()